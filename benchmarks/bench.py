@@ -0,0 +1,399 @@
+###
+# #%L
+# Appose: multi-language interprocess cooperation with shared memory.
+# %%
+# Copyright (C) 2023 - 2024 Appose developers.
+# %%
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDERS OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+# #L%
+###
+
+"""
+End-to-end benchmarks of Appose's Python service and worker.
+
+Usage examples:
+    python benchmarks/bench.py
+    python benchmarks/bench.py --quick --output results.json
+    python benchmarks/bench.py latency ndarray
+
+Each benchmark reports its measurements as a JSON object; the results of all
+benchmarks run are written to standard output, or to the given output file,
+along with a description of the environment they were measured in. The
+script exits with an error if a benchmark reports regressions, as the imports
+benchmark does when importing the worker exceeds its budgets.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List
+
+import appose
+from appose.framing import Framing
+from appose.service import ResponseType, TaskStatus
+from appose.types import decode, encode, get_codec, set_codec
+
+Results = Dict[str, Any]
+
+
+def bench_startup(quick: bool) -> Results:
+    """
+    Time until a Python worker reports being ready, and until its first task
+    completes: cold, adopting a standby worker, and forked from a fork server.
+    """
+    env = appose.system()
+    results = {}
+    modes = ["cold", "standby"]
+    server = None
+    if hasattr(os, "fork"):
+        server = env.fork_server()
+        modes.append("fork")
+    for mode in modes:
+        if mode == "standby":
+            env.standby(1)
+        started, first_task = [], []
+        for _ in range(3 if quick else 10):
+            if mode == "standby":
+                time.sleep(0.5)  # Let the replacement worker warm up.
+            begin = time.perf_counter()
+            with env.python(fork=mode == "fork") as service:
+                service.start(wait=True)
+                started.append(time.perf_counter() - begin)
+                _run(service, "1")
+                first_task.append(time.perf_counter() - begin)
+        results[mode] = {
+            "ready_s": _summary(started),
+            "first_task_s": _summary(first_task),
+        }
+    env.standby(0)
+    if server is not None:
+        server.close()
+    return results
+
+
+def bench_latency(quick: bool) -> Results:
+    """
+    Round-trip time of trivial tasks, executed one after the other.
+    """
+    env = appose.system()
+    results = {}
+    for framing in (Framing.TEXT, Framing.BINARY):
+        with env.python(framing=framing) as service:
+            _run(service, "1")  # Warm up.
+            times = []
+            for _ in range(200 if quick else 2000):
+                begin = time.perf_counter()
+                _run(service, "1")
+                times.append(time.perf_counter() - begin)
+        results[framing.value] = _summary(times)
+    return results
+
+
+def bench_throughput(quick: bool) -> Results:
+    """
+    Tasks completed per second, with N tasks in flight at once.
+    """
+    env = appose.system()
+    total = 500 if quick else 5000
+    results = {}
+    with env.python() as service:
+        _run(service, "1")  # Warm up.
+        for concurrency in (1, 8, 64):
+            begin = time.perf_counter()
+            done = 0
+            while done < total:
+                tasks = [service.task("1").start() for _ in range(concurrency)]
+                for task in tasks:
+                    task.wait_for()
+                done += concurrency
+            elapsed = time.perf_counter() - begin
+            results[f"concurrency_{concurrency}"] = {
+                "tasks": done,
+                "tasks_per_s": done / elapsed,
+            }
+    return results
+
+
+def bench_updates(quick: bool) -> Results:
+    """
+    UPDATE events per second received from a single task.
+    """
+    env = appose.system()
+    count = 10000 if quick else 100000
+    script = f"for i in range({count}):\n    task.update(current=i, maximum={count})\n"
+    results = {}
+    for update_interval in (0, 0.01):
+        with env.python(update_interval=update_interval) as service:
+            task = service.task(script)
+            events = []
+            task.listen(
+                lambda e: (
+                    events.append(1) if e.response_type == ResponseType.UPDATE else None
+                )
+            )
+            begin = time.perf_counter()
+            task.wait_for()
+            elapsed = time.perf_counter() - begin
+            _check(task)
+        results[f"interval_{update_interval}"] = {
+            "updates_sent": count,
+            "events_received": len(events),
+            "updates_per_s": count / elapsed,
+        }
+    return results
+
+
+def bench_codec(quick: bool) -> Results:
+    """
+    Cost of encoding and decoding a large message, per available codec.
+    """
+    data = {
+        "task": "87427f91-d193-4b25-8d35-e1292a34b5c4",
+        "requestType": "EXECUTE",
+        "inputs": {
+            f"key{i}": {"values": list(range(20)), "label": f"item {i}", "x": i / 3}
+            for i in range(1000 if quick else 10000)
+        },
+    }
+    repeats = 5 if quick else 20
+    results = {}
+    original = get_codec()
+    try:
+        for name in ("json", "orjson"):
+            try:
+                set_codec(name)
+            except ValueError:
+                continue
+            encoded = encode(data)
+            results[name] = {
+                "bytes": len(encoded),
+                "encode_s": _summary(_repeat(lambda: encode(data), repeats)),
+                "decode_s": _summary(_repeat(lambda: decode(encoded), repeats)),
+            }
+    finally:
+        set_codec(original.name)
+    return results
+
+
+def bench_ndarray(quick: bool) -> Results:
+    """
+    Bandwidth of passing NumPy arrays of various sizes to a task.
+    """
+    import numpy
+
+    env = appose.system()
+    sizes = [1 << 10, 1 << 16, 1 << 20, 1 << 24]
+    if not quick:
+        sizes.append(1 << 27)
+    script = "a.ndarray()[-1]"
+    results = {}
+    with env.python() as service:
+        _run(service, "1")  # Warm up.
+        for size in sizes:
+            array = numpy.ones(size, dtype="uint8")
+            repeats = max(3, min(100, (1 << 28) // size // 16))
+            staged = _repeat(lambda: _run(service, script, {"a": array}), repeats)
+            with appose.NDArray("uint8", [size], pool=service.shm_pool) as shared:
+                shared.ndarray()[:] = 1
+                zero_copy = _repeat(
+                    lambda: _run(service, script, {"a": shared}), repeats
+                )
+            results[str(size)] = {
+                "staged_mb_per_s": size / statistics.median(staged) / 1e6,
+                "shared_mb_per_s": size / statistics.median(zero_copy) / 1e6,
+            }
+    return results
+
+
+def bench_imports(quick: bool) -> Results:
+    """
+    Time to import the worker, the package, and the service in a fresh
+    interpreter, as reported by -X importtime, and the modules each loads.
+    The worker's import is checked against budgets, and any it exceeds are
+    listed as regressions.
+    """
+    results, loaded = {}, {}
+    for module in ("appose.python_worker", "appose", "appose.service"):
+        times, modules = [], []
+        for _ in range(5 if quick else 20):
+            script = f"import sys, {module}; print(*sys.modules)"
+            proc = subprocess.run(
+                [sys.executable, "-X", "importtime", "-c", script],
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+            modules = proc.stdout.split()
+            for line in proc.stderr.splitlines():
+                # import time: self [us] | cumulative | imported package
+                fields = line.split("|")
+                if len(fields) == 3 and fields[2].strip() == module:
+                    times.append(int(fields[1]) / 1e6)
+        results[module] = {"import_s": _summary(times), "modules": len(modules)}
+        loaded[module] = set(modules)
+
+    worker = results["appose.python_worker"]
+    regressions = []
+    if worker["import_s"]["p50"] > _WORKER_IMPORT_BUDGET_S:
+        regressions.append(
+            f"worker import takes {worker['import_s']['p50']:.3f} s, "
+            f"over the budget of {_WORKER_IMPORT_BUDGET_S} s"
+        )
+    if worker["modules"] > _WORKER_MODULE_BUDGET:
+        regressions.append(
+            f"worker imports {worker['modules']} modules, "
+            f"over the budget of {_WORKER_MODULE_BUDGET}"
+        )
+    forbidden = sorted(loaded["appose.python_worker"] & set(_WORKER_FORBIDDEN_MODULES))
+    if forbidden:
+        regressions.append(f"worker imports {', '.join(forbidden)}")
+    worker["regressions"] = regressions
+    return results
+
+
+# Budgets for importing appose.python_worker, which every worker process pays
+# for before reading its first request: its median import time, the number of
+# modules it loads (including the interpreter's own), and modules only the
+# service side needs.
+_WORKER_IMPORT_BUDGET_S = 0.15
+_WORKER_MODULE_BUDGET = 150
+_WORKER_FORBIDDEN_MODULES = (
+    "appose.environment",
+    "appose.forkserver",
+    "appose.metrics",
+    "appose.pool",
+    "appose.service",
+    "appose.standby",
+    "appose.tracing",
+    "asyncio",
+    "http.server",
+    "uuid",
+)
+
+
+BENCHMARKS: Dict[str, Callable[[bool], Results]] = {
+    "startup": bench_startup,
+    "imports": bench_imports,
+    "latency": bench_latency,
+    "throughput": bench_throughput,
+    "updates": bench_updates,
+    "codec": bench_codec,
+    "ndarray": bench_ndarray,
+}
+
+
+def _run(service, script: str, inputs=None):
+    task = service.task(script, inputs)
+    task.wait_for()
+    _check(task)
+    return task
+
+
+def _check(task) -> None:
+    if task.status != TaskStatus.COMPLETE:
+        raise RuntimeError(f"Task {task.status.value}: {task.error}")
+
+
+def _repeat(func: Callable[[], Any], repeats: int) -> List[float]:
+    times = []
+    for _ in range(repeats):
+        begin = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - begin)
+    return times
+
+
+def _summary(times: List[float]) -> Results:
+    ordered = sorted(times)
+    return {
+        "n": len(ordered),
+        "mean": statistics.fmean(ordered),
+        "p50": _percentile(ordered, 50),
+        "p99": _percentile(ordered, 99),
+        "min": ordered[0],
+        "max": ordered[-1],
+    }
+
+
+def _percentile(ordered: List[float], percent: float) -> float:
+    index = min(len(ordered) - 1, round(percent / 100 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument(
+        "benchmarks",
+        nargs="*",
+        help=f"the benchmarks to run, among: {', '.join(BENCHMARKS)} (default: all)",
+    )
+    parser.add_argument(
+        "-o", "--output", help="file to write the JSON results to (default: stdout)"
+    )
+    parser.add_argument(
+        "--quick", action="store_true", help="fewer repetitions, for a smoke test"
+    )
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark: {name}")
+
+    results = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": sys.version,
+            "platform": platform.platform(),
+            "codec": get_codec().name,
+            "quick": args.quick,
+        },
+        "results": {},
+    }
+    for name in args.benchmarks or list(BENCHMARKS):
+        print(f"Running {name}...", file=sys.stderr)
+        results["results"][name] = BENCHMARKS[name](args.quick)
+
+    output = json.dumps(results, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+    regressions = [
+        f"{name}: {regression}"
+        for name, result in results["results"].items()
+        for measured in result.values()
+        if isinstance(measured, dict)
+        for regression in measured.get("regressions", [])
+    ]
+    if regressions:
+        sys.exit("Regressions:\n" + "\n".join(regressions))
+
+
+if __name__ == "__main__":
+    main()
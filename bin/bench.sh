@@ -0,0 +1,13 @@
+#!/bin/sh
+
+# Usage examples:
+#   bin/bench.sh
+#   bin/bench.sh --quick --output results.json
+#   bin/bench.sh latency ndarray
+
+set -e
+
+dir=$(dirname "$0")
+cd "$dir/.."
+
+python benchmarks/bench.py $@
@@ -4,11 +4,11 @@ dir=$(dirname "$0")
 cd "$dir/.."
 
 exitCode=0
-black src tests
+black src tests benchmarks
 code=$?; test $code -eq 0 || exitCode=$code
-isort src tests
+isort src tests benchmarks
 code=$?; test $code -eq 0 || exitCode=$code
-python -m flake8 src tests
+python -m flake8 src tests benchmarks
 code=$?; test $code -eq 0 || exitCode=$code
 validate-pyproject pyproject.toml
 code=$?; test $code -eq 0 || exitCode=$code
@@ -142,6 +142,15 @@ Asynchronously execute a script within the worker process. E.g.:
        "inputs" : {"gamma": 2.2}
     }
 
+The worker may queue the script until it has capacity to execute it; the
+optional integer `priority` key (default 0) moves it ahead of queued scripts
+of lower priority. A LAUNCH response is issued once the script really starts.
+The optional integer `window` key bounds how many RESULT responses may be
+outstanding before the script's `task.emit` blocks awaiting an ACKNOWLEDGE.
+If the service traces the task, the optional `trace` object carries its
+trace context, as `traceId` and `spanId` hex strings; the worker exposes it
+to the script as `task.trace`.
+
 #### CANCEL
 
 Cancel a running script. E.g.:
@@ -151,6 +160,88 @@ Cancel a running script. E.g.:
        "requestType" : "CANCEL"
     }
 
+#### BATCH
+
+Asynchronously execute a script within the worker process once per input
+set, sequentially. The `inputs` key holds a list of input sets. Upon success,
+the COMPLETION response's outputs hold a single `results` entry, listing the
+outputs of each execution in order. E.g.:
+
+    {
+       "task" : "87427f91-d193-4b25-8d35-e1292a34b5c4",
+       "requestType" : "BATCH",
+       "script" : "gamma ** 2\n",
+       "inputs" : [{"gamma": 2.2}, {"gamma": 1.8}]
+    }
+
+#### PREPARE
+
+Register a script with the worker, so that later EXECUTE and BATCH requests
+can reference it by a `scriptId` key instead of repeating its source in a
+`script` key. Unlike EXECUTE, it is not associated with a task, and elicits
+no response. The ID is the hex-encoded SHA-256 hash of the script. Its
+optional `forget` key lists the IDs of previously prepared scripts which the
+worker may discard, as the service will prepare them again before reuse. E.g.:
+
+    {
+       "requestType" : "PREPARE",
+       "scriptId" : "8d1e8e0dc5f6a9a5e8d5d4c5e0c8e0f2a9b6ed84b1e2d2c8e4f1a0b9c8d7e6f5",
+       "script" : "task.outputs[\"result\"] = computeResult(gamma)\n"
+    }
+
+#### SESSION
+
+Manage a session of the worker. EXECUTE requests with a `session` key share
+their script bindings with all other tasks of the same session, so variables
+persist across them. A SESSION request's `action` is either `reset`, to
+discard the session's variables, or `info`, to report on them via the
+`exists`, `variables` and `size` outputs of its COMPLETION response. E.g.:
+
+    {
+       "task" : "87427f91-d193-4b25-8d35-e1292a34b5c4",
+       "requestType" : "SESSION",
+       "session" : "model",
+       "action" : "reset"
+    }
+
+#### ACKNOWLEDGE
+
+Signal that the service has consumed `count` RESULT items of a task whose
+EXECUTE request set a `window`, allowing the script to emit that many more.
+A negative count lifts the limit for the rest of the task. E.g.:
+
+    {
+       "task" : "87427f91-d193-4b25-8d35-e1292a34b5c4",
+       "requestType" : "ACKNOWLEDGE",
+       "count" : 32
+    }
+
+#### RELEASE
+
+Report that shared memory blocks previously referenced by requests have
+been unlinked, so the worker can close any mappings of them it keeps for
+reuse. Unlike other requests, it is not associated with a task, and elicits
+no response. E.g.:
+
+    {
+       "requestType" : "RELEASE",
+       "shm" : ["psm_5b2c0ad1"]
+    }
+
+#### CONFIGURE
+
+Negotiate how subsequent messages are framed. Unlike other requests, it is
+not associated with a task. The request is always sent as a line of text,
+and is only sent by services that were asked for a non-default framing or
+codec. The optional `pickle` key asks to exchange values JSON cannot represent
+as pickles (see below). E.g.:
+
+    {
+       "requestType" : "CONFIGURE",
+       "framing" : "BINARY",
+       "pickle" : true
+    }
+
 ### Responses from worker to service
 
 A *response* is a single line of JSON with a `task` key taking the form
@@ -159,11 +250,18 @@ of a UUID, and a `responseType` key with one of the following values:
 #### LAUNCH
 
 A LAUNCH response is issued to confirm the success of an EXECUTE
-request.
+request. Its optional `timings` object holds the monotonic clock readings,
+in seconds, of when the worker `received` the request, `decoded` it, and
+`launched` it. Terminal responses likewise report when the script `finished`
+and when the worker began `encoding` the response itself. For a traced task,
+the `thread` string names the worker thread executing the script.
 
     {
        "task" : "87427f91-d193-4b25-8d35-e1292a34b5c4",
-       "responseType" : "LAUNCH"
+       "responseType" : "LAUNCH",
+       "timings" : {
+         "received" : 5821.0412, "decoded" : 5821.0413, "launched" : 5821.0415
+       }
     }
 
 #### UPDATE
@@ -182,6 +280,18 @@ reached, or both.
        "maximum" : 91
     }
 
+#### RESULT
+
+A RESULT response conveys one partial result, emitted by the script via
+`task.emit(item)` while it is still running. Items arrive in emission order,
+and before the task's COMPLETION response.
+
+    {
+       "task" : "87427f91-d193-4b25-8d35-e1292a34b5c4",
+       "responseType" : "RESULT",
+       "item" : {"frame" : 7, "mean" : 0.42}
+    }
+
 #### COMPLETION
 
 A COMPLETION response is issued to convey that a task has successfully
@@ -213,25 +323,115 @@ and successfully execute, such as an exception being raised.
        "responseType" : "FAILURE",
        "error", "Invalid gamma value"
     }
+
+#### CONFIGURED
+
+A CONFIGURED response acknowledges a CONFIGURE request, stating the framing
+the worker agreed to use. It is sent as a line of text, after which both
+directions switch to the agreed-upon framing. A worker not supporting the
+requested framing acknowledges TEXT instead. Its `pickle` key states whether
+the worker agreed to pickling, which then applies in both directions.
+
+    {
+       "responseType" : "CONFIGURED",
+       "framing" : "BINARY",
+       "pickle" : true
+    }
+
+#### READY
+
+Python workers send a READY response once started, as a line of text, after
+importing the modules they were told to preload and running their warm-up
+script, and before reading any request. It reports the worker's
+`capabilities` and the monotonic clock readings of its startup `timings`;
+an `error` key holds the traceback of a failed preload or warm-up.
+
+    {
+       "responseType" : "READY",
+       "capabilities" : {"language" : "python", "pid" : 4242, "pickle" : true},
+       "timings" : {"started" : 5820.97, "imported" : 5821.02, "ready" : 5821.03}
+    }
+
+### Binary framing
+
+With BINARY framing, each message is a frame instead of a line: a header of
+two big-endian unsigned 32-bit integers giving the length in bytes of the
+message's UTF-8 encoded JSON and its number of attachments, then the JSON
+itself, then each attachment as a big-endian unsigned 64-bit length followed
+by that many raw bytes. Within the JSON, an attachment is referenced by its
+position as `{"appose_type": "bytes", "index": 0}`, which lets bytes values
+travel without escaping.
+
+### Pickled values
+
+Between Python peers that negotiated pickling, a value JSON cannot represent
+is pickled with protocol 5 and encoded as an object with `appose_type` of
+`pickle`. Its `data` is the pickle stream: a bytes attachment with BINARY
+framing, or a base64 string otherwise. Large out-of-band buffers, such as
+NumPy array data, are not part of the stream; each is placed in its own
+shared memory block, listed in order under `buffers` along with its length:
+
+    {
+       "appose_type" : "pickle",
+       "data" : {"appose_type" : "bytes", "index" : 0},
+       "buffers" : [{
+          "shm" : {"appose_type" : "shm", "name" : "psm_5b2c", "size" : 4000000},
+          "nbytes" : 4000000
+       }]
+    }
 '''
 
-from pathlib import Path
+import importlib
+from typing import TYPE_CHECKING, Any, List, Union
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+    from .environment import Builder, Environment
+    from .types import NDArray, SharedMemory, SharedMemoryPool  # noqa: F401
+
+# The package's classes are imported on first access (see PEP 562), so that
+# a worker process importing appose.python_worker does not pay for modules
+# only a service needs, such as subprocess and http.server.
+_LAZY = {
+    "Builder": "environment",
+    "Environment": "environment",
+    "NDArray": "types",
+    "SharedMemory": "types",
+    "SharedMemoryPool": "types",
+}
+
+
+def __getattr__(name: str) -> Any:
+    module = _LAZY.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> List[str]:
+    return sorted(set(globals()) | set(_LAZY))
+
+
+def _builder() -> "Builder":
+    from .environment import Builder
 
-from .environment import Builder, Environment
-from .types import NDArray, SharedMemory  # noqa: F401
+    return Builder()
 
 
-def base(directory: Path) -> Builder:
-    return Builder().base(directory)
+def base(directory: Union[str, "Path"]) -> "Builder":
+    return _builder().base(directory)
 
 
-def java(vendor: str, version: str) -> Builder:
-    return Builder().java(vendor=vendor, version=version)
+def java(vendor: str, version: str) -> "Builder":
+    return _builder().java(vendor=vendor, version=version)
 
 
-def conda(environment_yaml: Path) -> Builder:
-    return Builder().conda(environment_yaml=environment_yaml)
+def conda(environment_yaml: Union[str, "Path"]) -> "Builder":
+    return _builder().conda(environment_yaml=environment_yaml)
 
 
-def system(directory: Path = Path(".")) -> Environment:
-    return Builder().base(directory).use_system_path().build()
+def system(directory: Union[str, "Path"] = ".") -> "Environment":
+    return _builder().base(directory).use_system_path().build()
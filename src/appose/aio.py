@@ -0,0 +1,487 @@
+###
+# #%L
+# Appose: multi-language interprocess cooperation with shared memory.
+# %%
+# Copyright (C) 2023 - 2024 Appose developers.
+# %%
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDERS OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+# #L%
+###
+
+"""
+The appose.aio package contains asyncio-native variants of services and tasks.
+
+An `AsyncService` drives its worker process with
+`asyncio.create_subprocess_exec` from the running event loop, rather than
+with dedicated threads, and its `AsyncTask` objects can be awaited:
+
+    env = appose.system()
+    async with env.python(service_class=AsyncService) as service:
+        tasks = [service.task(script, {"x": x}) for x in range(100)]
+        for task in await asyncio.gather(*tasks):
+            print(task.outputs)
+
+All methods of these classes must be called from the event loop's thread.
+"""
+
+import asyncio
+from collections import deque
+from itertools import islice
+from pathlib import Path
+from time import monotonic
+from traceback import format_exc
+from typing import (
+    Any,
+    AsyncIterator,
+    Deque,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Union,
+)
+
+from .framing import _ATTACHMENT, _HEADER, Frame, Framing, pack_frame
+from .service import (
+    _MAP_WINDOW,
+    BatchTask,
+    PreparedScript,
+    Service,
+    SessionTask,
+    Task,
+    TaskEvent,
+    TaskStatus,
+)
+from .types import Args, SharedMemory, encode
+
+# Maximum line length when reading TEXT framing; the asyncio default is 64 KiB.
+_STREAM_LIMIT = 2**30
+
+
+class AsyncService(Service):
+    """
+    An Appose *service* whose worker process is managed by asyncio.
+
+    Tasks created by this service are `AsyncTask` objects.
+    """
+
+    def __init__(
+        self,
+        cwd: Union[str, Path],
+        args: Sequence[str],
+        framing: Framing = Framing.TEXT,
+        pickle: bool = False,
+    ) -> None:
+        super().__init__(cwd, args, framing=framing, pickle=pickle)
+        self._aio_process: Optional[asyncio.subprocess.Process] = None
+        self._stdout_task: Optional[asyncio.Task] = None
+        self._monitor_task: Optional[asyncio.Task] = None
+        self._configured_event: Optional[asyncio.Event] = None
+        self._ready_event: Optional[asyncio.Event] = None
+        self._start_lock: Optional[asyncio.Lock] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def start(self, wait: bool = False, timeout: Optional[float] = None) -> None:
+        """
+        Explicitly launch the worker process associated with this service.
+
+        This method is awaited automatically the first time a task is awaited.
+
+        :param wait:
+            Whether to also await the worker's report that it is ready.
+            Only Python workers send such a READY response.
+        :param timeout:
+            Maximum number of seconds to wait for the worker to be ready,
+            or None to wait as long as it takes.
+        :raises RuntimeError:
+            If waiting, and the worker is not a Python worker, failed to warm
+            up, or terminated first.
+        :raises TimeoutError: If waiting, and the timeout elapsed first.
+        """
+        if wait:
+            self._check_announces_ready()
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+        async with self._start_lock:
+            if self._aio_process is None:
+                await self._launch_worker_async()
+        if wait:
+            try:
+                await asyncio.wait_for(self._ready_event.wait(), timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"Worker not ready after {timeout} seconds")
+            self._check_ready()
+
+    async def _launch_worker_async(self) -> None:
+        self.timings["launched"] = monotonic()
+        self._loop = asyncio.get_running_loop()
+        self._ready_event = asyncio.Event()
+        self._aio_process = await asyncio.create_subprocess_exec(
+            *self._args,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            cwd=self._cwd,
+            limit=_STREAM_LIMIT,
+        )
+        prefix = f"Appose-Service-{self._service_id}"
+        self._stdout_task = asyncio.create_task(
+            self._stdout_loop_async(), name=f"{prefix}-Stdout"
+        )
+        self._monitor_task = asyncio.create_task(
+            self._monitor_loop_async(), name=f"{prefix}-Monitor"
+        )
+
+        if self._framing != Framing.TEXT or self._pickle:
+            await self._configure_async()
+
+    def task(
+        self,
+        script: Union[str, PreparedScript],
+        inputs: Optional[Args] = None,
+        session: Optional[str] = None,
+        priority: int = 0,
+    ) -> "AsyncTask":
+        """
+        Create a new task, passing the given script to the worker for execution.
+
+        Unlike `Service.task`, this does not start the worker process;
+        awaiting the task (or the service's `start` method) does that.
+
+        :param script:
+            The script for the worker to execute in its environment,
+            or a handle to a script obtained from the prepare method.
+        :param inputs:
+            Optional list of key/value pairs to feed into the script as inputs.
+        :param session:
+            Optional name of a session whose variables persist across tasks.
+        :param priority:
+            Priority of the task, when the worker has more tasks to execute
+            than threads to execute them. Higher priorities run first.
+        """
+        return AsyncTask(self, script, inputs, session=session, priority=priority)
+
+    async def map(
+        self,
+        script: Union[str, PreparedScript],
+        inputs: Iterable[Args],
+        batch_size: int = 100,
+    ) -> AsyncIterator[Args]:
+        """
+        Execute the given script once per input set, in batches, yielding the
+        outputs of each execution in order. See `Service.map`.
+
+        :raises RuntimeError: If a batch does not complete successfully.
+        """
+        if batch_size < 1:
+            raise ValueError(f"Invalid batch size: {batch_size}")
+        await self.start()
+        it = iter(inputs)
+        pending: Deque[AsyncTask] = deque()
+        while True:
+            # Keep a few batches in flight, so the worker never sits idle.
+            while len(pending) < _MAP_WINDOW:
+                batch = list(islice(it, batch_size))
+                if not batch:
+                    break
+                pending.append(_AsyncBatchTask(self, script, batch).start())
+            if not pending:
+                return
+            task = await pending.popleft()
+            if task.status != TaskStatus.COMPLETE:
+                for other in pending:
+                    other.cancel()
+                raise RuntimeError(f"Batch {task.status.value}: {task.error}")
+            for outputs in task.outputs["results"]:
+                yield outputs
+
+    async def reset_session(self, session: str) -> "AsyncTask":
+        """
+        Discard all variables of the given session in the worker process.
+        See `Service.reset_session`.
+
+        :return: The task which performed the reset.
+        """
+        await self.start()
+        return await _AsyncSessionTask(self, session, "reset")
+
+    async def session_info(self, session: str) -> "AsyncTask":
+        """
+        Report on the variables of the given session in the worker process.
+        See `Service.session_info`.
+
+        :return: The task which gathered the report.
+        """
+        await self.start()
+        return await _AsyncSessionTask(self, session, "info")
+
+    def close(self) -> None:
+        """
+        Close the worker process's input stream, in order to shut it down.
+        """
+        if self._aio_process is not None:
+            self._aio_process.stdin.close()
+
+    async def wait_closed(self) -> None:
+        """
+        Wait until the worker process has terminated.
+        """
+        if self._monitor_task is not None:
+            await self._monitor_task
+
+    async def __aenter__(self) -> "AsyncService":
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, exc_tb) -> None:
+        self.close()
+        await self.wait_closed()
+
+    async def _configure_async(self) -> None:
+        """
+        Negotiate the requested framing and codec with the worker process.
+        """
+        self._configured_event = asyncio.Event()
+        self._write(Framing.TEXT, encode(self._configure_request()), None)
+        await self._configured_event.wait()
+        self._stdin_framing = self._stdout_framing
+        if self._stdin_framing != self._framing:
+            self._debug_service(f"<worker declined {self._framing.value} framing>")
+
+    def _send(
+        self,
+        request: Args,
+        allocations: Optional[List[SharedMemory]] = None,
+        script: Optional[PreparedScript] = None,
+    ) -> None:
+        """
+        Encode the given request and write it to the worker's stdin stream.
+        """
+        if self._aio_process is None:
+            raise RuntimeError("Service is not started")
+        for preamble in (self._take_released(), self._prepare(script)):
+            if preamble is not None:
+                self._write(self._stdin_framing, encode(preamble), None)
+        start = monotonic()
+        framing = self._stdin_framing
+        attachments = [] if framing == Framing.BINARY else None
+        shared: Set[str] = set()
+        encoded = encode(
+            request,
+            attachments,
+            allocations,
+            use_pickle=self._pickle_enabled,
+            shared=shared,
+        )
+        encoded_at = monotonic()
+        self._write(framing, encoded, attachments)
+        self._trace_send(request, start, encoded_at, monotonic())
+        self._record_shared(shared)
+        self._record_staged(allocations)
+
+    def _write(
+        self, framing: Framing, encoded: str, attachments: Optional[List]
+    ) -> None:
+        # NB: The transport buffers the data; await drain() to apply backpressure.
+        parts = pack_frame(framing, encoded, attachments)
+        self._aio_process.stdin.writelines(parts)
+        self.metrics.message_written(sum(memoryview(p).nbytes for p in parts))
+        self._debug_service(encoded)
+
+    def _adopt(self, process) -> bool:
+        # NB: An asyncio subprocess cannot wrap an already-running process.
+        return False
+
+    def _set_launcher(self, launcher) -> bool:
+        return False
+
+    def _worker_pid(self) -> int:
+        return 0 if self._aio_process is None else self._aio_process.pid
+
+    async def _drain(self) -> None:
+        if self._aio_process is not None:
+            await self._aio_process.stdin.drain()
+
+    def _handle(self, response: Args) -> None:
+        super()._handle(response)
+        if self._configured.is_set() and self._configured_event is not None:
+            self._configured_event.set()
+        if self._ready.is_set():
+            self._ready_event.set()
+
+    async def _stdout_loop_async(self) -> None:
+        """
+        Input loop processing messages from the worker's stdout stream.
+        """
+        while True:
+            # noinspection PyBroadException
+            try:
+                frame = await _read_frame(
+                    self._aio_process.stdout, self._stdout_framing
+                )
+            except Exception:
+                # Something went wrong reading the message. Panic!
+                self._debug_service(format_exc())
+                break
+
+            if frame is None:
+                self._debug_service("<worker stdout closed>")
+                return
+
+            self._dispatch(frame)
+
+    async def _monitor_loop_async(self) -> None:
+        # Wait until the worker process terminates and its output is consumed.
+        await self._aio_process.wait()
+        await self._stdout_task
+        self._process_terminated(self._aio_process.returncode)
+        if self._configured_event is not None:
+            self._configured_event.set()
+        self._ready_event.set()
+
+
+# noinspection PyProtectedMember
+class AsyncTask(Task):
+    """
+    An Appose *task* which can be awaited from an asyncio event loop.
+
+    Awaiting the task starts it if needed, then waits for it to finish,
+    evaluating to the task itself.
+    """
+
+    def __init__(
+        self,
+        service: AsyncService,
+        script: Union[str, PreparedScript],
+        inputs: Optional[Args] = None,
+        session: Optional[str] = None,
+        priority: int = 0,
+    ) -> None:
+        super().__init__(service, script, inputs, session=session, priority=priority)
+        self._future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._queues: List[asyncio.Queue] = []
+        self._item_ready = asyncio.Event()
+        self.listeners.append(self._notify)
+
+    def wait_for(self) -> None:
+        raise RuntimeError("Blocking on an AsyncTask would stall the event loop")
+
+    async def events(self) -> AsyncIterator[TaskEvent]:
+        """
+        Iterate over the task's events, until the task finishes.
+
+        The task is started if it has not been already; events
+        occurring before this method is called are not included.
+        """
+        queue = asyncio.Queue()
+        self._queues.append(queue)
+        try:
+            if self.status == TaskStatus.INITIAL:
+                await self.service.start()
+                self.start()
+            while not (self._future.done() and queue.empty()):
+                yield await queue.get()
+        finally:
+            self._queues.remove(queue)
+
+    async def stream(self, window: int = 64) -> AsyncIterator[Any]:
+        """
+        Start the task, then iterate over the items its script emits
+        until the task finishes. See `Task.stream`.
+
+        :raises RuntimeError:
+            If the task is not in the INITIAL state,
+            or if it does not complete successfully.
+        """
+        self._begin_stream(window)
+        await self.service.start()
+        self.start()
+        try:
+            while True:
+                while not self._items and not self.status.is_finished():
+                    self._item_ready.clear()
+                    await self._item_ready.wait()
+                if not self._items:
+                    break
+                yield self._next_item()
+                await self.service._drain()
+        finally:
+            self._end_stream()
+        self._check_stream()
+
+    def __await__(self):
+        return self._wait().__await__()
+
+    async def _wait(self) -> "AsyncTask":
+        if self.status == TaskStatus.INITIAL:
+            await self.service.start()
+            self.start()
+        await self.service._drain()
+        await asyncio.shield(self._future)
+        return self
+
+    def _notify(self, event: TaskEvent) -> None:
+        for queue in self._queues:
+            queue.put_nowait(event)
+        self._item_ready.set()
+        if self.status.is_finished() and not self._future.done():
+            self._future.set_result(None)
+
+
+class _AsyncBatchTask(BatchTask, AsyncTask):
+    pass
+
+
+class _AsyncSessionTask(SessionTask, AsyncTask):
+    pass
+
+
+async def _read_frame(
+    reader: asyncio.StreamReader, framing: Framing
+) -> Optional[Frame]:
+    """
+    Read one message from the given stream, or None upon EOF.
+    """
+    if framing == Framing.TEXT:
+        line = await reader.readline()
+        if not line:
+            return None
+        return Frame(line.decode("utf-8").strip(), [], len(line))
+
+    try:
+        header = await reader.readexactly(_HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None
+        raise EOFError("Stream ended in the middle of a frame")
+    try:
+        length, count = _HEADER.unpack(header)
+        text = (await reader.readexactly(length)).decode("utf-8")
+        attachments = []
+        total = _HEADER.size + length + count * _ATTACHMENT.size
+        for _ in range(count):
+            (size,) = _ATTACHMENT.unpack(await reader.readexactly(_ATTACHMENT.size))
+            attachments.append(await reader.readexactly(size))
+            total += size
+    except asyncio.IncompleteReadError:
+        raise EOFError("Stream ended in the middle of a frame")
+    return Frame(text, attachments, total)
@@ -32,19 +32,37 @@ TODO
 """
 
 import os
+from functools import partial
 from pathlib import Path
-from typing import Dict, List, Optional, Sequence, Union
+from typing import Dict, List, Optional, Sequence, Tuple, Type, Union
 
+from .forkserver import ForkServer
+from .framing import Framing
 from .paths import find_exe
+from .pool import ServicePool
 from .service import Service
+from .standby import Standby
 
 
 class Environment:
     def __init__(self, base: Union[Path, str], use_system_path: bool = False):
         self.base = Path(base).absolute()
         self.use_system_path = use_system_path
+        # Reserves of idle worker processes, keyed by their command line.
+        self._standby: Dict[Tuple[str, ...], Standby] = {}
+        self._fork_server: Optional[ForkServer] = None
 
-    def python(self) -> Service:
+    def python(
+        self,
+        framing: Framing = Framing.TEXT,
+        service_class: Type[Service] = Service,
+        update_interval: float = 0,
+        max_threads: Optional[int] = None,
+        pickle: bool = False,
+        fork: bool = False,
+        preload: Sequence[str] = (),
+        warmup_script: Optional[str] = None,
+    ) -> Service:
         """
         Create a Python script service.
 
@@ -52,22 +70,137 @@ class Environment:
         Python scripts asynchronously on its linked process running a
         `python_worker`.
 
+        :param framing:
+            The framing of messages exchanged with the worker. BINARY framing
+            avoids scanning and escaping lines of text, and lets bytes values
+            travel as raw attachments.
+        :param service_class:
+            The class of service to create; e.g. appose.aio.AsyncService
+            to drive the worker from an asyncio event loop.
+        :param update_interval:
+            Minimum number of seconds between progress updates the worker
+            sends for each task. Updates issued more frequently are coalesced,
+            the latest values winning, and the final values are always sent
+            before the task finishes. Zero (the default) sends every update.
+        :param max_threads:
+            Maximum number of tasks the worker executes concurrently, on
+            reused threads. Further tasks remain QUEUED until a thread frees
+            up, higher priorities first. By default, the number of CPUs plus
+            four, capped at 32.
+        :param pickle:
+            Whether to exchange values JSON cannot represent (e.g. instances
+            of custom classes) with the worker by pickling them. Their large
+            buffers, such as NumPy array data, travel via shared memory.
+        :param fork:
+            Whether to fork the worker from the environment's fork server,
+            started by fork_server() (or upon first use, preloading nothing).
+            Forked workers start almost instantly, with the server's
+            preloaded modules already imported. POSIX platforms only.
+        :param preload:
+            Names of modules for the worker to import when it starts,
+            e.g. ["numpy", "scipy"], before reporting that it is ready.
+        :param warmup_script:
+            Script for the worker to run once when it starts, after importing
+            the preloaded modules and before reporting that it is ready,
+            e.g. to load a model or prime caches. Start the service with
+            `start(wait=True)` to block until the worker is ready.
         :return: The newly created service.
         :see: groovy() To create a service for Groovy script execution.
         :raises IOError: If something goes wrong starting the worker process.
         """
-        python_exes = [
-            "python",
-            "python3",
-            "python.exe",
-            "bin/python",
-            "bin/python.exe",
-        ]
-        return self.service(
-            python_exes,
-            "-c",
-            "import appose.python_worker; appose.python_worker.main()",
-        )
+        args = _python_args(update_interval, max_threads, preload, warmup_script)
+        if not fork:
+            return self.service(
+                _PYTHON_EXES,
+                *args,
+                framing=framing,
+                service_class=service_class,
+                pickle=pickle,
+            )
+
+        server = self._fork_server or self.fork_server()
+        all_args = self._command(_PYTHON_EXES, args)
+        service = service_class(self.base, all_args, framing=framing, pickle=pickle)
+        # NB: The server runs the worker's main function directly,
+        # so it needs only the worker options, not the interpreter's.
+        if not service._set_launcher(partial(server.spawn, self.base, args[2:])):
+            raise ValueError(f"{service_class.__name__} cannot fork its worker")
+        return service
+
+    def fork_server(self, preload: Sequence[str] = ()) -> ForkServer:
+        """
+        Start a fork server for this environment, from which python(fork=True)
+        forks its workers, replacing any fork server started before. Workers
+        forked already keep running.
+
+        :param preload:
+            Names of the modules for the server to import before forking
+            any worker, e.g. ["numpy", "scipy"]. Forked workers share the
+            memory of these modules, copy-on-write.
+        :return: The fork server.
+        :raises RuntimeError: If the platform does not support forking.
+        """
+        if self._fork_server is not None:
+            self._fork_server.close()
+            self._fork_server = None
+        exe = self._command(_PYTHON_EXES, [])[0]
+        self._fork_server = ForkServer(exe, self.base, preload)
+        return self._fork_server
+
+    def standby(
+        self,
+        count: int,
+        update_interval: float = 0,
+        max_threads: Optional[int] = None,
+        preload: Sequence[str] = (),
+        warmup_script: Optional[str] = None,
+    ) -> None:
+        """
+        Keep the given number of idle Python worker processes started and
+        ready. Services created by python() with the same worker options then
+        adopt one of them, rather than paying for the interpreter's startup
+        and imports when they start; a replacement is launched in the
+        background. Standby workers shut down when the count is set back to
+        zero, or when this process exits.
+
+        :param count:
+            The number of idle worker processes to keep ready.
+        :param update_interval:
+            The update_interval option of the services to adopt the workers.
+        :param max_threads:
+            The max_threads option of the services to adopt the workers.
+        :param preload:
+            The preload option of the services to adopt the workers.
+            Standby workers import these modules while idle.
+        :param warmup_script:
+            The warmup_script option of the services to adopt the workers.
+            Standby workers run it while idle.
+        :see: python() To create a service, adopting a standby worker.
+        """
+        args = _python_args(update_interval, max_threads, preload, warmup_script)
+        key = tuple(self._command(_PYTHON_EXES, args))
+        standby = self._standby.get(key)
+        if standby is not None:
+            standby.count = count
+        elif count > 0:
+            self._standby[key] = Standby(self.base, list(key), count)
+
+    def python_pool(self, size: Optional[int] = None, **options) -> ServicePool:
+        """
+        Create a pool of Python script services, each with its own worker
+        process, dispatching tasks to the least loaded one.
+
+        :param size:
+            The number of services in the pool; by default,
+            the number of CPUs in the system.
+        :param options:
+            Keyword arguments passed to python() to create each service.
+        :return: The newly created pool of services.
+        :see: python() To create a single Python script service.
+        """
+        if size is None:
+            size = os.cpu_count() or 1
+        return ServicePool(lambda: self.python(**options), size)
 
     def groovy(
         self,
@@ -134,7 +267,14 @@ class Environment:
         ]
         return self.service(java_exes, *args)
 
-    def service(self, exes: Sequence[str], *args) -> Service:
+    def service(
+        self,
+        exes: Sequence[str],
+        *args,
+        framing: Framing = Framing.TEXT,
+        service_class: Type[Service] = Service,
+        pickle: bool = False,
+    ) -> Service:
         """
         Create a service with the given command line arguments.
 
@@ -148,11 +288,31 @@ class Environment:
         :param args:
             Command line arguments to pass to the worker process
             (e.g. ["-v", "--enable-everything"]).
+        :param framing:
+            The framing to negotiate with the worker process. Only use
+            BINARY framing with workers that support it.
+        :param service_class:
+            The class of service to create; e.g. appose.aio.AsyncService
+            to drive the worker from an asyncio event loop.
+        :param pickle:
+            Whether to negotiate pickling of values JSON cannot represent.
+            Only Python workers support it.
         :return: The newly created service.
         :see: groovy() To create a service for Groovy script execution.
         :see: python() To create a service for Python script execution.
         :raises IOError: If something goes wrong starting the worker process.
         """
+        all_args = self._command(exes, args)
+        service = service_class(self.base, all_args, framing=framing, pickle=pickle)
+        standby = self._standby.get(tuple(all_args))
+        if standby is not None:
+            standby.lend(service)
+        return service
+
+    def _command(self, exes: Sequence[str], args: Sequence[str]) -> List[str]:
+        """
+        Build the command line running the first executable found.
+        """
         if not exes:
             raise ValueError("No executable given")
 
@@ -168,7 +328,37 @@ class Environment:
 
         all_args: List[str] = [str(exe_file)]
         all_args.extend(args)
-        return Service(self.base, all_args)
+        return all_args
+
+
+_PYTHON_EXES = [
+    "python",
+    "python3",
+    "python.exe",
+    "bin/python",
+    "bin/python.exe",
+]
+
+
+def _python_args(
+    update_interval: float,
+    max_threads: Optional[int],
+    preload: Sequence[str],
+    warmup_script: Optional[str],
+) -> List[str]:
+    """
+    Build the command line arguments launching a Python worker.
+    """
+    args = ["-c", "import appose.python_worker; appose.python_worker.main()"]
+    if update_interval > 0:
+        args.extend(["--update-interval", str(update_interval)])
+    if max_threads is not None:
+        args.extend(["--max-threads", str(max_threads)])
+    for name in preload:
+        args.extend(["--preload", name])
+    if warmup_script is not None:
+        args.extend(["--warmup-script", warmup_script])
+    return args
 
 
 class Builder:
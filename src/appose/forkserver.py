@@ -0,0 +1,391 @@
+###
+# #%L
+# Appose: multi-language interprocess cooperation with shared memory.
+# %%
+# Copyright (C) 2023 - 2024 Appose developers.
+# %%
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDERS OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+# #L%
+
+"""
+The appose.forkserver package launches Python workers by forking them from
+a long-lived server process, rather than starting a fresh interpreter each.
+
+The server imports appose and a configurable list of (typically heavy)
+modules once, freezes the garbage collector so that the imported objects
+stay untouched, and then forks one worker per request. Each worker thereby
+starts in about a millisecond, already having every preloaded module
+imported, and shares the memory of those modules with the server and its
+other workers, copy-on-write.
+
+Services request workers over a Unix domain socket, passing along the pipes
+the worker should use as its stdin and stdout. The server reports the pid of
+the worker, and later its exit code, over the same connection. Only POSIX
+platforms are supported.
+"""
+
+import gc
+import importlib
+import json
+import os
+import select
+import selectors
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional, Sequence, Union
+
+# Message the server writes to its stdout once ready to fork workers.
+_READY = b"READY\n"
+
+
+class ForkServer:
+    """
+    A server process forking Python workers with preloaded modules.
+    """
+
+    def __init__(
+        self,
+        exe: Union[str, Path],
+        cwd: Union[str, Path],
+        preload: Sequence[str] = (),
+    ) -> None:
+        """
+        Launch a fork server, and wait until it has imported its modules.
+
+        :param exe: The Python executable to run the server with.
+        :param cwd: The working directory of the server process.
+        :param preload: Names of the modules for the server to import,
+                        e.g. ["numpy", "scipy"], shared by all workers.
+        :raises RuntimeError: If the platform does not support forking,
+                              or if the server fails to start.
+        """
+        if not hasattr(os, "fork") or not hasattr(socket, "AF_UNIX"):
+            raise RuntimeError("Fork server requires a POSIX platform")
+        self._dir = tempfile.mkdtemp(prefix="appose-")
+        self.path = os.path.join(self._dir, "forkserver.sock")
+        self.preload = list(preload)
+        self._process = subprocess.Popen(
+            [
+                str(exe),
+                "-c",
+                "import appose.forkserver; appose.forkserver.main()",
+                self.path,
+                *self.preload,
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            cwd=cwd,
+        )
+        if self._process.stdout.readline() != _READY:
+            self.close()
+            raise RuntimeError(
+                f"Fork server failed to start: exit code {self._process.wait()}"
+            )
+
+    @property
+    def pid(self) -> int:
+        """
+        The process ID of the server.
+        """
+        return self._process.pid
+
+    def spawn(self, cwd: Union[str, Path], args: Sequence[str]) -> "ForkedProcess":
+        """
+        Fork a new Python worker.
+
+        :param cwd: The working directory of the worker.
+        :param args: Command line arguments of the worker,
+                     e.g. ["--max-threads", "4"].
+        :return: A handle to the worker process, akin to subprocess.Popen.
+        :raises OSError: If the server cannot be reached.
+        """
+        control = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stdin_r, stdin_w = os.pipe()
+        stdout_r, stdout_w = os.pipe()
+        try:
+            control.connect(self.path)
+            message = json.dumps({"cwd": str(cwd), "args": list(args)})
+            socket.send_fds(control, [message.encode("utf-8")], [stdin_r, stdout_w])
+        except BaseException:
+            control.close()
+            for fd in (stdin_w, stdout_r):
+                os.close(fd)
+            raise
+        finally:
+            # NB: Only the worker keeps these ends of the pipes open.
+            os.close(stdin_r)
+            os.close(stdout_w)
+        reader = control.makefile("rb")
+        line = reader.readline()
+        if not line:
+            control.close()
+            os.close(stdin_w)
+            os.close(stdout_r)
+            raise OSError("Fork server failed to fork a worker")
+        return ForkedProcess(
+            int(line), os.fdopen(stdin_w, "wb"), os.fdopen(stdout_r, "rb"), reader
+        )
+
+    def close(self) -> None:
+        """
+        Shut the server down. Workers it has forked keep running.
+        """
+        if self._process.stdin is not None and not self._process.stdin.closed:
+            self._process.stdin.close()
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    def __enter__(self) -> "ForkServer":
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb) -> None:
+        self.close()
+
+
+class ForkedProcess:
+    """
+    A worker process forked by a fork server, offering the subset of the
+    subprocess.Popen interface used by services. Its stderr is the one of
+    the server, i.e. the one of the process which launched the server.
+    """
+
+    def __init__(
+        self, pid: int, stdin: BinaryIO, stdout: BinaryIO, control: BinaryIO
+    ) -> None:
+        self.pid = pid
+        self.stdin = stdin
+        self.stdout = stdout
+        self.stderr: Optional[BinaryIO] = None
+        self.returncode: Optional[int] = None
+        self._control = control
+        self._lock = threading.Lock()
+
+    def poll(self) -> Optional[int]:
+        """
+        Check whether the worker has terminated, returning its exit code if so.
+        """
+        # NB: If another thread is waiting, the worker has not yet terminated.
+        if self.returncode is None and self._lock.acquire(blocking=False):
+            try:
+                readable, _, _ = select.select([self._control], [], [], 0)
+                if readable:
+                    self._read_status()
+            finally:
+                self._lock.release()
+        return self.returncode
+
+    def wait(self) -> int:
+        """
+        Wait for the worker to terminate, returning its exit code.
+        """
+        with self._lock:
+            if self.returncode is None:
+                self._read_status()
+        return self.returncode
+
+    def terminate(self) -> None:
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self) -> None:
+        self.send_signal(signal.SIGKILL)
+
+    def send_signal(self, sig: int) -> None:
+        if self.returncode is None:
+            os.kill(self.pid, sig)
+
+    def _read_status(self) -> None:
+        line = self._control.readline()
+        self._control.close()
+        # NB: Without a status, the server itself died; the worker's fate
+        # is unknown, so report it as killed.
+        self.returncode = int(line) if line else -signal.SIGKILL
+
+
+def main() -> None:
+    """
+    Run a fork server: preload the modules named on the command line, then
+    fork workers upon request, until stdin is closed and all workers exit.
+    """
+    path = sys.argv[1]
+    for name in ["appose.python_worker", *sys.argv[2:]]:
+        importlib.import_module(name)
+
+    # NB: Move everything imported so far out of the garbage collector's
+    # reach, so that collections in the workers do not touch (and thereby
+    # copy) the memory pages they share with the server.
+    gc.collect()
+    gc.freeze()
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen()
+
+    # NB: Turn the SIGCHLD signal into an event the selector can wait for.
+    wakeup_r, wakeup_w = os.pipe()
+    os.set_blocking(wakeup_r, False)
+    os.set_blocking(wakeup_w, False)
+    signal.set_wakeup_fd(wakeup_w)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+
+    selector = selectors.DefaultSelector()
+    selector.register(listener, selectors.EVENT_READ, "spawn")
+    selector.register(wakeup_r, selectors.EVENT_READ, "reap")
+    selector.register(sys.stdin.fileno(), selectors.EVENT_READ, "stdin")
+
+    sys.stdout.buffer.write(_READY)
+    sys.stdout.buffer.flush()
+
+    children: Dict[int, socket.socket] = {}
+    listening = True
+    while listening or children:
+        for key, _ in selector.select():
+            if key.data == "spawn":
+                conn, _ = listener.accept()
+                resources = [listener, selector, wakeup_r, wakeup_w]
+                pid = _spawn(conn, resources + list(children.values()))
+                if pid is None:
+                    conn.close()
+                else:
+                    children[pid] = conn
+            elif key.data == "reap":
+                _drain(wakeup_r)
+                _reap(children)
+            elif not os.read(sys.stdin.fileno(), 512):
+                # The launching process is done with the server.
+                selector.unregister(listener)
+                selector.unregister(sys.stdin.fileno())
+                listener.close()
+                _remove(path)
+                listening = False
+        _reap(children)
+
+
+def _spawn(conn: socket.socket, resources: List) -> Optional[int]:
+    """
+    Fork a worker as requested over the given connection.
+    """
+    # noinspection PyBroadException
+    try:
+        message, fds, _, _ = socket.recv_fds(conn, 65536, 2)
+        request = json.loads(message)
+    except Exception:
+        return None
+    if len(fds) != 2:
+        for fd in fds:
+            os.close(fd)
+        return None
+
+    pid = os.fork()
+    if pid == 0:
+        _run_worker(request, fds, conn, resources)
+    for fd in fds:
+        os.close(fd)
+    conn.sendall(f"{pid}\n".encode("utf-8"))
+    return pid
+
+
+def _run_worker(request: Dict, fds: List[int], conn: socket.socket, resources: List):
+    """
+    Become a Python worker, in a freshly forked child of the server.
+    """
+    exit_code = 1
+    try:
+        signal.set_wakeup_fd(-1)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        for resource in resources:
+            if isinstance(resource, int):
+                os.close(resource)
+            else:
+                resource.close()
+        conn.close()
+        stdin_fd, stdout_fd = fds
+        os.dup2(stdin_fd, 0)
+        os.dup2(stdout_fd, 1)
+        os.close(stdin_fd)
+        os.close(stdout_fd)
+        os.chdir(request["cwd"])
+        sys.argv = ["appose.python_worker", *request["args"]]
+
+        from appose import python_worker
+
+        python_worker.main()
+        exit_code = 0
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else int(e.code is not None)
+    except BaseException:
+        import traceback
+
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(exit_code)
+
+
+def _drain(fd: int) -> None:
+    """
+    Read all bytes currently available from a non-blocking file descriptor.
+    """
+    try:
+        while os.read(fd, 512):
+            pass
+    except BlockingIOError:
+        pass
+
+
+def _remove(path: str) -> None:
+    """
+    Remove the socket file, and its directory, unless already removed.
+    """
+    try:
+        os.unlink(path)
+        os.rmdir(os.path.dirname(path))
+    except OSError:
+        pass
+
+
+def _reap(children: Dict[int, socket.socket]) -> None:
+    """
+    Collect the workers which have terminated, reporting their exit codes.
+    """
+    while children:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+        conn = children.pop(pid, None)
+        if conn is None:
+            continue
+        try:
+            conn.sendall(f"{os.waitstatus_to_exitcode(status)}\n".encode("utf-8"))
+        except OSError:
+            pass
+        conn.close()
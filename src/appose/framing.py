@@ -0,0 +1,169 @@
+###
+# #%L
+# Appose: multi-language interprocess cooperation with shared memory.
+# %%
+# Copyright (C) 2023 - 2024 Appose developers.
+# %%
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDERS OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+# #L%
+###
+
+"""
+Utility functions for delimiting Appose messages on a byte stream.
+
+In TEXT framing, each message is a single line of UTF-8 encoded JSON.
+In BINARY framing, each message is a frame consisting of a fixed-size header
+declaring the length of the JSON text and the number of attachments, followed
+by the JSON text itself, followed by each attachment as a length-prefixed
+sequence of raw bytes.
+"""
+
+import struct
+from enum import Enum
+from typing import BinaryIO, List, NamedTuple, Optional, Sequence, Union
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+# Frame header: length of JSON text in bytes, followed by attachment count.
+_HEADER = struct.Struct("!II")
+
+# Attachment header: length of attachment in bytes.
+_ATTACHMENT = struct.Struct("!Q")
+
+
+class Framing(Enum):
+    TEXT = "TEXT"
+    BINARY = "BINARY"
+
+
+class Frame(NamedTuple):
+    text: str
+    attachments: List[bytes]
+    # Number of bytes the message occupied on the stream.
+    size: int = 0
+
+
+def write_frame(
+    stream: BinaryIO,
+    framing: Framing,
+    text: str,
+    attachments: Optional[Sequence[Buffer]] = None,
+) -> int:
+    """
+    Write one message to the given stream, then flush it.
+
+    The caller is responsible for serializing concurrent writes.
+
+    :param stream: The binary stream to write to.
+    :param framing: The framing to use when delimiting the message.
+    :param text: The JSON text of the message.
+    :param attachments: Raw byte payloads referenced by the JSON text.
+                        Only supported with BINARY framing.
+    :return: The number of bytes written.
+    """
+    written = 0
+    for part in pack_frame(framing, text, attachments):
+        stream.write(part)
+        written += memoryview(part).nbytes
+    stream.flush()
+    return written
+
+
+def pack_frame(
+    framing: Framing,
+    text: str,
+    attachments: Optional[Sequence[Buffer]] = None,
+) -> List[Buffer]:
+    """
+    Convert one message to the sequence of buffers making up its frame.
+
+    :param framing: The framing to use when delimiting the message.
+    :param text: The JSON text of the message.
+    :param attachments: Raw byte payloads referenced by the JSON text.
+                        Only supported with BINARY framing.
+    :return: The buffers to write, in order.
+    """
+    data = text.encode("utf-8")
+    if framing == Framing.TEXT:
+        if attachments:
+            raise ValueError("Attachments require BINARY framing")
+        return [data + b"\n"]
+
+    count = 0 if attachments is None else len(attachments)
+    parts = [_HEADER.pack(len(data), count) + data]
+    for attachment in attachments or ():
+        parts.append(_ATTACHMENT.pack(memoryview(attachment).nbytes))
+        parts.append(attachment)
+    return parts
+
+
+def read_frame(stream: BinaryIO, framing: Framing) -> Optional[Frame]:
+    """
+    Read one message from the given stream.
+
+    :param stream: The binary stream to read from.
+    :param framing: The framing used to delimit the message.
+    :return: The message, or None if the stream reached end of file.
+    :raises EOFError: If the stream ends in the middle of a BINARY frame.
+    """
+    if framing == Framing.TEXT:
+        line = stream.readline()
+        if not line:
+            return None
+        return Frame(line.decode("utf-8").strip(), [], len(line))
+
+    header = _read_exactly(stream, _HEADER.size)
+    if header is None:
+        return None
+    length, count = _HEADER.unpack(header)
+    text = _read_required(stream, length).decode("utf-8")
+    attachments = []
+    total = _HEADER.size + length + count * _ATTACHMENT.size
+    for _ in range(count):
+        (size,) = _ATTACHMENT.unpack(_read_required(stream, _ATTACHMENT.size))
+        attachments.append(_read_required(stream, size))
+        total += size
+    return Frame(text, attachments, total)
+
+
+def _read_exactly(stream: BinaryIO, size: int) -> Optional[bytes]:
+    """
+    Read exactly the given number of bytes, or None upon immediate EOF.
+    """
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        chunk = stream.read(remaining)
+        if not chunk:
+            if remaining == size:
+                return None
+            raise EOFError("Stream ended in the middle of a frame")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+
+def _read_required(stream: BinaryIO, size: int) -> bytes:
+    data = _read_exactly(stream, size)
+    if data is None:
+        raise EOFError("Stream ended in the middle of a frame")
+    return data
@@ -0,0 +1,437 @@
+###
+# #%L
+# Appose: multi-language interprocess cooperation with shared memory.
+# %%
+# Copyright (C) 2023 - 2024 Appose developers.
+# %%
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDERS OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+# #L%
+
+"""
+Low-overhead metrics describing the activity of Appose services.
+
+Each `Service` keeps a `ServiceMetrics` instance, updated as it exchanges
+messages with its worker; a `ServicePool` aggregates those of its services.
+The metrics can be read as a snapshot dict, rendered in the Prometheus text
+exposition format, or served to a Prometheus scraper from a local endpoint:
+
+    service = env.python()
+    server = appose.metrics.serve(service, port=9464)
+    ...
+    print(service.metrics.snapshot()["tasks"]["completed"])
+    server.close()
+"""
+
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic
+from typing import Any, Dict, Iterable, List, Mapping, Sequence
+
+# Upper bounds of the latency histogram buckets, in seconds.
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+# Length of the sliding window over which event rates are computed, in seconds.
+RATE_WINDOW = 10
+
+# Ways a task can leave a service: with a final status, or by being
+# moved to another service of a pool after its worker crashed.
+_OUTCOMES = ("completed", "failed", "canceled", "crashed", "rerouted")
+
+
+class Histogram:
+    """
+    A histogram of observed values, with fixed bucket boundaries.
+    Not thread-safe by itself; `ServiceMetrics` serializes access to it.
+    """
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        # NB: The last count is for values above the largest boundary.
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other: "Histogram") -> None:
+        if other.buckets != self.buckets:
+            raise ValueError("Cannot merge histograms with different buckets")
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.count += other.count
+        self.sum += other.sum
+
+    def copy(self) -> "Histogram":
+        histogram = Histogram(self.buckets)
+        histogram.merge(self)
+        return histogram
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Describe the histogram as a dict: the number and sum of observed values,
+        and the cumulative count of values at or below each bucket boundary.
+        """
+        cumulative = []
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            cumulative.append((bound, total))
+        return {"count": self.count, "sum": self.sum, "buckets": cumulative}
+
+
+class _Rate:
+    """
+    Counts events in one-second slots, to report their recent rate.
+    """
+
+    def __init__(self, window: int = RATE_WINDOW) -> None:
+        self._slots = [0] * window
+        self._second = int(monotonic())
+
+    def add(self, now: float, count: int = 1) -> None:
+        self._advance(int(now))
+        self._slots[self._second % len(self._slots)] += count
+
+    def per_second(self, now: float) -> float:
+        self._advance(int(now))
+        # NB: The current slot is still filling up; leave it out.
+        slot = self._second % len(self._slots)
+        return (sum(self._slots) - self._slots[slot]) / (len(self._slots) - 1)
+
+    def merge(self, other: "_Rate") -> None:
+        now = max(self._second, other._second)
+        self._advance(now)
+        other._advance(now)
+        for i, count in enumerate(other._slots):
+            self._slots[i] += count
+
+    def _advance(self, second: int) -> None:
+        elapsed = second - self._second
+        if elapsed <= 0:
+            return
+        window = len(self._slots)
+        for s in range(self._second + 1, self._second + 1 + min(elapsed, window)):
+            self._slots[s % window] = 0
+        self._second = second
+
+
+class ServiceMetrics:
+    """
+    Counters, gauges and histograms describing the activity of a service.
+
+    Updating the metrics takes a lock and a few additions; nothing is
+    formatted until the metrics are read.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._started = 0
+        self._outcomes = dict.fromkeys(_OUTCOMES, 0)
+        self._updates = 0
+        self._update_rate = _Rate()
+        self._bytes_written = 0
+        self._bytes_read = 0
+        self._messages_written = 0
+        self._messages_read = 0
+        self._shm_bytes = 0
+        self._latency = Histogram()
+        self._execution = Histogram()
+
+    def task_started(self) -> None:
+        with self._lock:
+            self._started += 1
+
+    def task_finished(self, outcome: str, timings: Mapping[str, float]) -> None:
+        """
+        Count a task which reached a final status, observing its latencies.
+
+        :param outcome: One of "completed", "failed", "canceled", "crashed",
+                        or "rerouted" for a task moved to another service.
+        :param timings: The timestamps recorded for the task.
+        """
+        sent = timings.get("sent")
+        dispatched = timings.get("dispatched")
+        launched = timings.get("launched")
+        finished = timings.get("finished")
+        with self._lock:
+            self._outcomes[outcome] += 1
+            if sent is not None and dispatched is not None:
+                self._latency.observe(dispatched - sent)
+            if launched is not None and finished is not None:
+                self._execution.observe(finished - launched)
+
+    def task_updated(self) -> None:
+        now = monotonic()
+        with self._lock:
+            self._updates += 1
+            self._update_rate.add(now)
+
+    def message_written(self, size: int) -> None:
+        with self._lock:
+            self._messages_written += 1
+            self._bytes_written += size
+
+    def message_read(self, size: int) -> None:
+        with self._lock:
+            self._messages_read += 1
+            self._bytes_read += size
+
+    def shm_allocated(self, size: int) -> None:
+        with self._lock:
+            self._shm_bytes += size
+
+    @property
+    def in_flight(self) -> int:
+        """
+        The number of tasks sent to the worker which have not yet finished.
+        """
+        with self._lock:
+            return self._in_flight()
+
+    def merge(self, other: "ServiceMetrics") -> None:
+        """
+        Add the metrics of another service to these ones.
+        """
+        with other._lock:
+            other = other._copy()
+        with self._lock:
+            self._started += other._started
+            for outcome, count in other._outcomes.items():
+                self._outcomes[outcome] += count
+            self._updates += other._updates
+            self._update_rate.merge(other._update_rate)
+            self._bytes_written += other._bytes_written
+            self._bytes_read += other._bytes_read
+            self._messages_written += other._messages_written
+            self._messages_read += other._messages_read
+            self._shm_bytes += other._shm_bytes
+            self._latency.merge(other._latency)
+            self._execution.merge(other._execution)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Get the current values of all metrics, as a dict.
+        """
+        now = monotonic()
+        with self._lock:
+            return {
+                "tasks": {
+                    "started": self._started,
+                    **self._outcomes,
+                    "in_flight": self._in_flight(),
+                },
+                "updates": self._updates,
+                "updates_per_second": self._update_rate.per_second(now),
+                "bytes_written": self._bytes_written,
+                "bytes_read": self._bytes_read,
+                "messages_written": self._messages_written,
+                "messages_read": self._messages_read,
+                "shm_bytes_allocated": self._shm_bytes,
+                "latency_seconds": self._latency.snapshot(),
+                "execution_seconds": self._execution.snapshot(),
+            }
+
+    def _in_flight(self) -> int:
+        return max(0, self._started - sum(self._outcomes.values()))
+
+    def _copy(self) -> "ServiceMetrics":
+        metrics = ServiceMetrics()
+        metrics._started = self._started
+        metrics._outcomes = dict(self._outcomes)
+        metrics._updates = self._updates
+        metrics._update_rate.merge(self._update_rate)
+        metrics._bytes_written = self._bytes_written
+        metrics._bytes_read = self._bytes_read
+        metrics._messages_written = self._messages_written
+        metrics._messages_read = self._messages_read
+        metrics._shm_bytes = self._shm_bytes
+        metrics._latency = self._latency.copy()
+        metrics._execution = self._execution.copy()
+        return metrics
+
+
+def prometheus(metrics: Mapping[str, ServiceMetrics]) -> str:
+    """
+    Render the metrics of the given services in the Prometheus text format.
+
+    :param metrics: The metrics to render, keyed by the value of their
+                    "service" label.
+    :return: The text exposition of the metrics.
+    """
+    snapshots = [(name, m.snapshot()) for name, m in metrics.items()]
+    lines: List[str] = []
+
+    def family(name: str, kind: str, help: str) -> None:
+        lines.append(f"# HELP appose_{name} {help}")
+        lines.append(f"# TYPE appose_{name} {kind}")
+
+    def sample(name: str, labels: Dict[str, str], value: Any) -> None:
+        text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+        lines.append(f"appose_{name}{{{text}}} {str(value)}")
+
+    family("tasks_started_total", "counter", "Tasks sent to the worker.")
+    for name, s in snapshots:
+        sample("tasks_started_total", {"service": name}, s["tasks"]["started"])
+    family("tasks_finished_total", "counter", "Tasks finished, by outcome.")
+    for name, s in snapshots:
+        for outcome in _OUTCOMES:
+            labels = {"service": name, "outcome": outcome}
+            sample("tasks_finished_total", labels, s["tasks"][outcome])
+    family("tasks_in_flight", "gauge", "Tasks sent but not yet finished.")
+    for name, s in snapshots:
+        sample("tasks_in_flight", {"service": name}, s["tasks"]["in_flight"])
+
+    counters = [
+        ("updates_total", "updates", "UPDATE events received."),
+        ("bytes_written_total", "bytes_written", "Bytes written to the worker."),
+        ("bytes_read_total", "bytes_read", "Bytes read from the worker."),
+        ("messages_written_total", "messages_written", "Requests sent."),
+        ("messages_read_total", "messages_read", "Responses received."),
+        ("shm_allocated_bytes_total", "shm_bytes_allocated", "Shm bytes created."),
+    ]
+    for metric, key, help in counters:
+        family(metric, "counter", help)
+        for name, s in snapshots:
+            sample(metric, {"service": name}, s[key])
+    family("updates_per_second", "gauge", "Recent rate of UPDATE events.")
+    for name, s in snapshots:
+        sample("updates_per_second", {"service": name}, s["updates_per_second"])
+
+    histograms = [
+        ("latency_seconds", "Time from sending a task to its final status."),
+        ("execution_seconds", "Time the worker spent executing a task."),
+    ]
+    for metric, help in histograms:
+        family(f"task_{metric}", "histogram", help)
+        for name, s in snapshots:
+            h = s[metric]
+            for bound, count in h["buckets"]:
+                labels = {"service": name, "le": str(bound)}
+                sample(f"task_{metric}_bucket", labels, count)
+            sample(f"task_{metric}_bucket", {"service": name, "le": "+Inf"}, h["count"])
+            sample(f"task_{metric}_sum", {"service": name}, h["sum"])
+            sample(f"task_{metric}_count", {"service": name}, h["count"])
+
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """
+    A local HTTP endpoint serving metrics in the Prometheus text format,
+    from a background thread. Any path serves the metrics.
+    """
+
+    def __init__(self, source: Any, host: str = "127.0.0.1", port: int = 0) -> None:
+        """
+        Start serving the metrics of the given service or service pool.
+
+        :param source: The `Service` or `ServicePool` whose metrics to serve.
+        :param host: The address to listen on; by default, only local clients.
+        :param port: The port to listen on; by default, any free port.
+        """
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                body = prometheus(_sources(source)).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="Appose-Metrics", daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def port(self) -> int:
+        """
+        The port the server listens on.
+        """
+        return self._server.server_address[1]
+
+    def close(self) -> None:
+        """
+        Stop serving the metrics.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self) -> "MetricsServer":
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb) -> None:
+        self.close()
+
+
+def serve(source: Any, host: str = "127.0.0.1", port: int = 0) -> MetricsServer:
+    """
+    Serve the metrics of the given service or service pool over HTTP,
+    in the Prometheus text format.
+
+    :param source: The `Service` or `ServicePool` whose metrics to serve.
+    :param host: The address to listen on; by default, only local clients.
+    :param port: The port to listen on; by default, any free port.
+    :return: The running server; close it to stop serving.
+    """
+    return MetricsServer(source, host, port)
+
+
+def _sources(source: Any) -> Dict[str, ServiceMetrics]:
+    """
+    Get the metrics of a service, or of each service of a pool,
+    keyed by service ID.
+    """
+    services: Iterable[Any] = getattr(source, "services", None) or [source]
+    return {str(s._service_id): s.metrics for s in services}
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
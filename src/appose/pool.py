@@ -0,0 +1,233 @@
+###
+# #%L
+# Appose: multi-language interprocess cooperation with shared memory.
+# %%
+# Copyright (C) 2023 - 2024 Appose developers.
+# %%
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDERS OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+# #L%
+###
+
+"""
+The appose.pool package contains a pool of interchangeable services.
+"""
+
+import threading
+from traceback import format_exc
+from typing import Callable, Dict, List, Optional, Union
+
+from .metrics import ServiceMetrics
+from .service import PreparedScript, Service, Task
+from .tracing import Tracer
+from .types import Args
+
+
+class ServicePool:
+    """
+    A pool of equivalent Appose *services*, each linked to its own worker
+    process. Tasks created via the pool are dispatched to whichever service
+    currently has the fewest tasks in flight, which lets CPU-bound scripts
+    scale beyond the one core a single worker's GIL allows.
+
+    If a worker process crashes, tasks it had not yet launched are rerouted
+    to the other services of the pool, and the crashed service is replaced.
+    """
+
+    def __init__(self, factory: Callable[[], Service], size: int) -> None:
+        """
+        Create a pool of services.
+
+        :param factory: Function creating a new service for the pool.
+        :param size: The number of services in the pool.
+        """
+        if size < 1:
+            raise ValueError(f"Invalid pool size: {size}")
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._closed = False
+        self._debug_callback: Optional[Callable[[str], None]] = None
+        self._tracer: Optional[Tracer] = None
+        self._sessions: Dict[str, Service] = {}
+        # Metrics of the services which have been replaced.
+        self._retired: List[ServiceMetrics] = []
+        self._services: List[Service] = [self._create() for _ in range(size)]
+
+    @property
+    def services(self) -> List[Service]:
+        """
+        The services currently making up the pool.
+        """
+        with self._lock:
+            return self._services[:]
+
+    @property
+    def metrics(self) -> ServiceMetrics:
+        """
+        The metrics of all services of the pool combined, including
+        those of services which were replaced after crashing.
+        """
+        with self._lock:
+            sources = self._retired + [s.metrics for s in self._services]
+        metrics = ServiceMetrics()
+        for source in sources:
+            metrics.merge(source)
+        return metrics
+
+    def debug(self, debug_callback: Callable[[str], None]) -> None:
+        """
+        Register a callback function to receive debug messages from all
+        services of the pool, including ones replacing crashed services.
+        """
+        self._debug_callback = debug_callback
+        for service in self.services:
+            service.debug(debug_callback)
+
+    def trace(self, tracer: Optional[Tracer]) -> None:
+        """
+        Record spans describing the tasks of all services of the pool,
+        including ones replacing crashed services, with the given tracer;
+        or stop recording them if None.
+        """
+        self._tracer = tracer
+        for service in self.services:
+            service.trace(tracer)
+
+    def start(self) -> None:
+        """
+        Explicitly launch the worker processes of all services in the pool.
+        """
+        for service in self.services:
+            service.start()
+
+    def task(
+        self,
+        script: Union[str, PreparedScript],
+        inputs: Optional[Args] = None,
+        session: Optional[str] = None,
+        priority: int = 0,
+    ) -> Task:
+        """
+        Create a new task on the least loaded service of the pool.
+
+        :param script:
+            The script for the worker to execute in its environment,
+            or a handle to a script obtained from the prepare method.
+        :param inputs:
+            Optional list of key/value pairs to feed into the script as inputs.
+        :param session:
+            Optional name of a session whose variables persist across tasks.
+            All tasks of a session are sent to the same service.
+        :param priority:
+            Priority of the task, when its worker has more tasks to execute
+            than threads to execute them. Higher priorities run first.
+        """
+        with self._lock:
+            service = self._least_loaded()
+            if session is not None:
+                bound = self._sessions.get(session)
+                if bound in self._services:
+                    service = bound
+                else:
+                    self._sessions[session] = service
+        return service.task(script, inputs, session=session, priority=priority)
+
+    def prepare(self, script: str) -> PreparedScript:
+        """
+        Register a script for repeated execution, returning a handle to it
+        which can be passed to the task method in place of the script.
+        The script is sent to each worker the first time it is needed there.
+
+        :param script:
+            The script for the worker to execute in its environment.
+        """
+        return PreparedScript(script)
+
+    def close(self) -> None:
+        """
+        Shut down the worker processes of all services in the pool.
+        """
+        with self._lock:
+            self._closed = True
+            services = self._services[:]
+        for service in services:
+            if service._process is not None:
+                service.close()
+
+    def __enter__(self) -> "ServicePool":
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb) -> None:
+        self.close()
+
+    def _create(self) -> Service:
+        service = self._factory()
+        service._reroute = self._reroute
+        if self._debug_callback is not None:
+            service.debug(self._debug_callback)
+        if self._tracer is not None:
+            service.trace(self._tracer)
+        return service
+
+    def _replace(self, i: int) -> None:
+        """
+        Replace the i-th service of the pool with a new one.
+
+        Must be called while holding the pool's lock.
+        """
+        self._retired.append(self._services[i].metrics)
+        self._services[i] = self._create()
+
+    def _least_loaded(self) -> Service:
+        """
+        Find the live service with the fewest tasks in flight,
+        replacing any services whose worker process has terminated.
+
+        Must be called while holding the pool's lock.
+        """
+        for i, service in enumerate(self._services):
+            if _terminated(service):
+                self._replace(i)
+        return min(self._services, key=lambda s: len(s._tasks))
+
+    def _reroute(self, dead: Service, task: Task) -> bool:
+        """
+        Move a queued task off a crashed service onto a live one.
+        """
+        # noinspection PyBroadException
+        try:
+            with self._lock:
+                if self._closed:
+                    return False
+                if dead in self._services:
+                    self._replace(self._services.index(dead))
+                service = self._least_loaded()
+            dead._debug_service(f"<rerouting task {task.uuid}>")
+            task._resubmit(service)
+            return True
+        except Exception:
+            dead._debug_service(format_exc())
+            return False
+
+
+def _terminated(service: Service) -> bool:
+    process = service._process
+    return process is not None and process.poll() is not None
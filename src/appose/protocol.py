@@ -0,0 +1,93 @@
+###
+# #%L
+# Appose: multi-language interprocess cooperation with shared memory.
+# %%
+# Copyright (C) 2023 - 2024 Appose developers.
+# %%
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDERS OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+# #L%
+###
+
+"""
+The message types of the Appose protocol, and the statuses of its tasks.
+
+This module is kept free of heavy imports, since every worker process
+needs it before it can read its first request.
+"""
+
+from enum import Enum
+
+
+class TaskStatus(Enum):
+    INITIAL = "INITIAL"
+    QUEUED = "QUEUED"
+    RUNNING = "RUNNING"
+    COMPLETE = "COMPLETE"
+    CANCELED = "CANCELED"
+    FAILED = "FAILED"
+    CRASHED = "CRASHED"
+
+    def is_finished(self):
+        """
+        True iff status is COMPLETE, CANCELED, FAILED, or CRASHED.
+        """
+        return self in (
+            TaskStatus.COMPLETE,
+            TaskStatus.CANCELED,
+            TaskStatus.FAILED,
+            TaskStatus.CRASHED,
+        )
+
+
+class RequestType(Enum):
+    EXECUTE = "EXECUTE"
+    CANCEL = "CANCEL"
+    BATCH = "BATCH"
+    PREPARE = "PREPARE"
+    SESSION = "SESSION"
+    ACKNOWLEDGE = "ACKNOWLEDGE"
+    RELEASE = "RELEASE"
+    CONFIGURE = "CONFIGURE"
+
+
+class ResponseType(Enum):
+    LAUNCH = "LAUNCH"
+    UPDATE = "UPDATE"
+    RESULT = "RESULT"
+    COMPLETION = "COMPLETION"
+    CANCELATION = "CANCELATION"
+    FAILURE = "FAILURE"
+    CRASH = "CRASH"
+    CONFIGURED = "CONFIGURED"
+    READY = "READY"
+
+    """
+    True iff response type is COMPLETE, CANCELED, FAILED, or CRASHED.
+    """
+
+    def is_terminal(self):
+        return self in (
+            ResponseType.COMPLETION,
+            ResponseType.CANCELATION,
+            ResponseType.FAILURE,
+            ResponseType.CRASH,
+        )
@@ -38,24 +38,118 @@ For details, see the Appose README:
 https://github.com/apposed/appose/blob/-/README.md#workers
 """
 
+import argparse
 import ast
+import importlib
+import os
 import sys
 import traceback
-from threading import Thread
-from time import sleep
-from typing import Optional
+from collections import OrderedDict, deque
+from functools import partial
+from hashlib import sha256
+from itertools import count
+from queue import PriorityQueue
+from threading import Condition, Lock, Thread, Timer, current_thread
+from time import monotonic
+from types import CodeType
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Tuple
 
 # NB: Avoid relative imports so that this script can be run standalone.
-from appose.service import RequestType, ResponseType
-from appose.types import Args, _set_worker, decode, encode
+from appose.framing import Framing, read_frame, write_frame
+from appose.protocol import RequestType, ResponseType
+from appose.types import (
+    Args,
+    SharedMemory,
+    _LazySharedMemory,
+    _set_worker,
+    decode,
+    encode,
+    get_codec,
+)
+
+# A script's compiled block, plus its compiled last expression (if any).
+CompiledScript = Tuple[CodeType, Optional[CodeType]]
+
+
+def _compile(script: str) -> CompiledScript:
+    # NB: Execute the block, except for the last statement,
+    # which we evaluate instead to get its return value.
+    # Credit: https://stackoverflow.com/a/39381428/1207769
+
+    block = ast.parse(script, mode="exec")
+    last = None
+    if (
+        len(block.body) > 0
+        and hasattr(block.body[-1], "value")
+        and not isinstance(block.body[-1], ast.Assign)
+    ):
+        # Last statement of the script looks like an expression. Evaluate!
+        last = ast.Expression(block.body.pop().value)
+
+    return (
+        compile(block, "<string>", mode="exec"),
+        None if last is None else compile(last, "<string>", mode="eval"),
+    )
 
 
 class Task:
-    def __init__(self, uuid: str) -> None:
+    def __init__(self, worker: "Worker", uuid: str) -> None:
+        self._worker = worker
         self.uuid = uuid
         self.outputs = {}
         self.finished = False
         self.cancel_requested = False
+        self.session: Optional[str] = None
+        self.priority = 0
+        # Monotonic timestamps of the task's progress through the worker.
+        self.timings: Dict[str, float] = {}
+        # Trace context of the task, if the service traces it. Scripts
+        # can use it to make their own spans part of the task's trace.
+        self.trace: Optional[Args] = None
+        # Names of the cached shared memory blocks the task's inputs refer to.
+        self._shm_refs: List[str] = []
+
+        # Whether the task's script has begun execution on a worker thread.
+        self.started = False
+        self._launch_lock = Lock()
+
+        # Minimum number of seconds between UPDATE responses. Updates issued
+        # more frequently are coalesced, with the latest values winning.
+        self.update_interval = worker.update_interval
+        self._update_lock = Lock()
+        self._pending_update: Optional[Args] = None
+        self._last_update = float("-inf")
+        self._update_timer: Optional[Timer] = None
+
+        # Number of RESULT items the service is still willing to buffer,
+        # or None if emitted items are not flow-controlled.
+        self._credits: Optional[int] = None
+        self._credit_cv = Condition()
+
+    def emit(self, item: Any) -> None:
+        """
+        Send one partial result to the service right away, rather than
+        waiting for the script to finish. If the service has bounded the
+        number of items in flight, block until it has consumed enough of them.
+        """
+        with self._credit_cv:
+            while self._credits == 0 and not self.cancel_requested:
+                self._credit_cv.wait()
+            if self._credits is not None and self._credits > 0:
+                self._credits -= 1
+        self._respond(ResponseType.RESULT, {"item": item})
+
+    def _acknowledge(self, count: int) -> None:
+        """
+        Grant the task credit to emit more items; a negative count
+        lifts the limit altogether.
+        """
+        with self._credit_cv:
+            if count < 0:
+                self._credits = None
+            elif self._credits is not None:
+                self._credits += count
+            self._credit_cv.notify_all()
 
     def update(
         self,
@@ -76,7 +170,28 @@ class Task:
                 args["maximum"] = int(maximum)
             except ValueError:
                 pass
-        self._respond(ResponseType.UPDATE, args)
+        if self.update_interval <= 0:
+            self._respond(ResponseType.UPDATE, args)
+            return
+
+        with self._update_lock:
+            if self._pending_update is not None:
+                # Merge with the pending update such that the service ends up
+                # in the same state as if both had been sent: the message is
+                # replaced outright, whereas progress values are retained.
+                pending = self._pending_update
+                pending.pop("message", None)
+                pending.update(args)
+                args = pending
+            self._pending_update = args
+
+            wait = self._last_update + self.update_interval - monotonic()
+            if wait <= 0:
+                self._flush_update()
+            elif self._update_timer is None:
+                self._update_timer = Timer(wait, self._flush_update_later)
+                self._update_timer.daemon = True
+                self._update_timer.start()
 
     def cancel(self) -> None:
         self._respond(ResponseType.CANCELATION, None)
@@ -85,68 +200,125 @@ class Task:
         args = None if error is None else {"error": error}
         self._respond(ResponseType.FAILURE, args)
 
-    def _start(self, script: str, inputs: Optional[Args]) -> None:
+    def _start(
+        self,
+        script: Optional[str],
+        inputs: Optional[Args],
+        script_id: Optional[str] = None,
+    ) -> None:
         def execute_script():
-            # Populate script bindings.
-            binding = {"task": self}
-            if inputs is not None:
-                binding.update(inputs)
-
             # Inform the calling process that the script is launching.
             self._report_launch()
 
             # Execute the script.
-            # result = exec(script, locals=binding)
-            result = None
             try:
-                # NB: Execute the block, except for the last statement,
-                # which we evaluate instead to get its return value.
-                # Credit: https://stackoverflow.com/a/39381428/1207769
-
-                block = ast.parse(script, mode="exec")
-                last = None
-                if (
-                    len(block.body) > 0
-                    and hasattr(block.body[-1], "value")
-                    and not isinstance(block.body[-1], ast.Assign)
-                ):
-                    # Last statement of the script looks like an expression. Evaluate!
-                    last = ast.Expression(block.body.pop().value)
-
-                # NB: When `exec` gets two separate objects as *globals* and
-                # *locals*, the code will be executed as if it were embedded in
-                # a class definition. This means functions and classes defined
-                # in the executed code will not be able to access variables
-                # assigned at the top level, because the "top level" variables
-                # are treated as class variables in a class definition.
-                # See: https://docs.python.org/3/library/functions.html#exec
-                _globals = binding
-                exec(compile(block, "<string>", mode="exec"), _globals, binding)
-                if last is not None:
-                    result = eval(
-                        compile(last, "<string>", mode="eval"), _globals, binding
-                    )
+                self._run(self._worker._compile(script, script_id), inputs)
             except Exception:
+                self.timings["finished"] = monotonic()
                 self.fail(traceback.format_exc())
                 return
 
-            # Report the results to the Appose calling process.
-            if isinstance(result, dict):
-                # Script produced a dict; add all entries to the outputs.
-                self.outputs.update(result)
-            elif result is not None:
-                # Script produced a non-dict; add it alone to the outputs.
-                self.outputs["result"] = result
+            self.timings["finished"] = monotonic()
+            self._report_completion()
+
+        self._launch(execute_script)
+
+    def _start_batch(
+        self,
+        script: Optional[str],
+        batch: List[Args],
+        script_id: Optional[str] = None,
+    ) -> None:
+        def execute_batch():
+            # Inform the calling process that the batch is launching.
+            self._report_launch()
+
+            # Execute the script once per input set, compiling it only once.
+            results = []
+            try:
+                code = self._worker._compile(script, script_id)
+                for inputs in batch:
+                    self.outputs = {}
+                    self._run(code, inputs)
+                    results.append(self.outputs)
+            except Exception:
+                self.timings["finished"] = monotonic()
+                self.fail(f"Batch item {len(results)}:\n{traceback.format_exc()}")
+                return
 
+            self.timings["finished"] = monotonic()
+            self.outputs = {"results": results}
             self._report_completion()
 
-        # Create a thread and save a reference to it, in case its script
-        # ends up killing the thread. This happens e.g. if it calls sys.exit.
-        self.thread = Thread(target=execute_script, name=f"Appose-{self.uuid}")
-        self.thread.start()
+        self._launch(execute_batch)
+
+    def _launch(self, target: Callable[[], None]) -> None:
+        if self.session is None:
+            self._worker._executor.submit(self, target)
+        else:
+            self._worker._submit_to_session(self, target)
+
+    def _run(self, code: "CompiledScript", inputs: Optional[Args]) -> None:
+        """
+        Execute a compiled script, adding its results to the task outputs.
+        """
+        # Populate script bindings. Tasks of a session share their bindings,
+        # so that anything a script defines is available to subsequent tasks.
+        # NB: Including the `task` variable and the inputs; this is why the
+        # worker runs the tasks of a session one at a time.
+        binding = {} if self.session is None else self._worker._session(self.session)
+        binding["task"] = self
+        if inputs is not None:
+            binding.update(inputs)
+
+        # NB: When `exec` gets two separate objects as *globals* and
+        # *locals*, the code will be executed as if it were embedded in
+        # a class definition. This means functions and classes defined
+        # in the executed code will not be able to access variables
+        # assigned at the top level, because the "top level" variables
+        # are treated as class variables in a class definition.
+        # See: https://docs.python.org/3/library/functions.html#exec
+        _globals = binding
+        block, last = code
+        exec(block, _globals, binding)
+        result = None if last is None else eval(last, _globals, binding)
+
+        # Report the results to the Appose calling process.
+        if isinstance(result, dict):
+            # Script produced a dict; add all entries to the outputs.
+            self.outputs.update(result)
+        elif result is not None:
+            # Script produced a non-dict; add it alone to the outputs.
+            self.outputs["result"] = result
+
+    def _flush_update(self) -> None:
+        """
+        Send the pending UPDATE response, if any.
+
+        Must be called while holding the task's update lock.
+        """
+        if self._update_timer is not None:
+            self._update_timer.cancel()
+            self._update_timer = None
+        if self._pending_update is None:
+            return
+        args = self._pending_update
+        self._pending_update = None
+        self._last_update = monotonic()
+        self._respond(ResponseType.UPDATE, args)
+
+    def _flush_update_later(self) -> None:
+        with self._update_lock:
+            self._update_timer = None
+            if not self.finished:
+                self._flush_update()
 
     def _report_launch(self) -> None:
-        self._respond(ResponseType.LAUNCH, None)
+        self.timings["launched"] = monotonic()
+        args = {"timings": dict(self.timings)}
+        if self.trace is not None:
+            args["thread"] = current_thread().name
+        self._respond(ResponseType.LAUNCH, args)
 
     def _report_completion(self) -> None:
         args = None if self.outputs is None else {"outputs": self.outputs}
@@ -155,6 +327,10 @@ class Task:
     def _respond(self, response_type: ResponseType, args: Optional[Args]) -> None:
         already_terminated = False
         if response_type.is_terminal():
+            # Always report the final progress before the terminal response.
+            if self._pending_update is not None:
+                with self._update_lock:
+                    self._flush_update()
             if self.finished:
                 # This is not the first terminal response. Let's
                 # remember, in case an exception is generated below,
@@ -165,9 +341,17 @@ class Task:
         response = {"task": self.uuid, "responseType": response_type.value}
         if args is not None:
             response.update(args)
-        # NB: Flush is necessary to ensure service receives the data!
+        if response_type.is_terminal():
+            # The response carries its own timings, so it can only report
+            # when its encoding began, not when it was written.
+            now = monotonic()
+            self.timings.setdefault("finished", now)
+            self.timings["encoding"] = now
+            response["timings"] = {
+                key: self.timings[key] for key in ("finished", "encoding")
+            }
         try:
-            print(encode(response), flush=True)
+            self._worker._respond(response)
         except Exception:
             if already_terminated:
                 # An exception triggered a failure response which
@@ -180,55 +364,575 @@ class Task:
             self.fail(traceback.format_exc())
 
 
-def main() -> None:
-    _set_worker(True)
-
-    tasks = {}
-    running = True
+class Worker:
+    def __init__(
+        self,
+        update_interval: float = 0,
+        compile_cache_size: int = 128,
+        max_threads: Optional[int] = None,
+        max_idle_blocks: int = 64,
+        max_idle_bytes: int = 1 << 30,
+    ) -> None:
+        """
+        Create a worker.
+
+        :param update_interval:
+            Default minimum number of seconds between UPDATE responses of each
+            task; more frequent updates are coalesced. Tasks can override it by
+            setting their `update_interval` attribute. Zero disables coalescing.
+        :param compile_cache_size:
+            Maximum number of compiled scripts to keep for reuse,
+            keyed by the SHA-256 hash of their source.
+        :param max_threads:
+            Maximum number of tasks executing concurrently; further tasks wait
+            in a queue, ordered by priority, then by arrival. By default,
+            the number of CPUs plus four, capped at 32.
+        :param max_idle_blocks:
+            Maximum number of shared memory blocks to keep attached once no
+            task refers to them anymore, so that tasks receiving the same
+            blocks again reuse their mappings.
+        :param max_idle_bytes:
+            Maximum total size of the shared memory blocks kept attached
+            once no task refers to them anymore.
+        """
+        if max_threads is None:
+            max_threads = min(32, (os.cpu_count() or 1) + 4)
+        self._executor = _Executor(max_threads, self._reap)
+        self.update_interval = update_interval
+        self.compile_cache_size = compile_cache_size
+        self.scripts: Dict[str, str] = {}
+        self.sessions: Dict[str, Args] = {}
+        self._sessions_lock = Lock()
+        # Tasks waiting for the previous task of their session to finish, by
+        # session. A session has an entry while one of its tasks is submitted.
+        self._session_queues: Dict[str, Deque[Tuple[Task, Callable[[], None]]]] = {}
+        self._compiled: OrderedDict[str, CompiledScript] = OrderedDict()
+        self._compiled_lock = Lock()
+
+        # Shared memory handed over to the service, kept open on Windows.
+        self._retained: List[SharedMemory] = []
+        self._attachments = _AttachmentCache(max_idle_blocks, max_idle_bytes)
+        self.tasks: Dict[str, Task] = {}
+        self.framing = Framing.TEXT
+        # Whether values JSON cannot represent are pickled in responses.
+        self.pickle = False
+        self._stdin = sys.stdin.buffer
+        self._stdout = sys.stdout.buffer
+        self._stdout_lock = Lock()
+
+    def run(self) -> None:
+        while True:
+            try:
+                frame = read_frame(self._stdin, self.framing)
+            except EOFError:
+                break
+            if frame is None or not frame.text:
+                break
+            received = monotonic()
+
+            # NB: Tasks share the mappings of the shared memory blocks
+            # they are sent, holding on to them until they are done.
+            shm_refs: List[str] = []
+            attach = partial(self._attachments.acquire, refs=shm_refs)
+            request = decode(frame.text, frame.attachments, attach)
+            decoded = monotonic()
+            uuid = request.get("task")
+            request_type = request.get("requestType")
+
+            match RequestType(request_type):
+                case RequestType.EXECUTE:
+                    script, script_id = self._script(request)
+                    inputs = request.get("inputs")
+                    task = Task(self, uuid)
+                    task.session = request.get("session")
+                    task.priority = request.get("priority", 0)
+                    task._credits = request.get("window")
+                    task._shm_refs, shm_refs = shm_refs, []
+                    task.timings.update(received=received, decoded=decoded)
+                    task.trace = request.get("trace")
+                    self.tasks[uuid] = task
+                    task._start(script, inputs, script_id)
+
+                case RequestType.BATCH:
+                    script, script_id = self._script(request)
+                    batch = request.get("inputs")
+                    task = Task(self, uuid)
+                    task.priority = request.get("priority", 0)
+                    task._shm_refs, shm_refs = shm_refs, []
+                    task.timings.update(received=received, decoded=decoded)
+                    task.trace = request.get("trace")
+                    self.tasks[uuid] = task
+                    task._start_batch(script, batch, script_id)
+
+                case RequestType.PREPARE:
+                    self.scripts[request["scriptId"]] = request["script"]
+                    # The service decides which prepared scripts to keep.
+                    for script_id in request.get("forget", []):
+                        self.scripts.pop(script_id, None)
+
+                case RequestType.SESSION:
+                    task = Task(self, uuid)
+                    task.timings.update(received=received, decoded=decoded)
+                    task.trace = request.get("trace")
+                    self._manage_session(
+                        task, request.get("session"), request.get("action")
+                    )
 
-    def cleanup_threads():
-        while running:
-            sleep(0.05)
-            dead = {
-                uuid: task for uuid, task in tasks.items() if not task.thread.is_alive()
+                case RequestType.CANCEL:
+                    task = self.tasks.get(uuid)
+                    if task is None:
+                        print(f"No such task: {uuid}", file=sys.stderr)
+                        continue
+                    task.cancel_requested = True
+                    # Wake the script if it is blocked emitting an item.
+                    task._acknowledge(0)
+                    with task._launch_lock:
+                        if not task.started:
+                            # Still queued; cancel it without running it.
+                            task.cancel()
+                            self.tasks.pop(uuid, None)
+                            self._release_blocks(task)
+
+                case RequestType.ACKNOWLEDGE:
+                    task = self.tasks.get(uuid)
+                    if task is not None:
+                        task._acknowledge(request.get("count", 0))
+
+                case RequestType.RELEASE:
+                    self._attachments.forget(request.get("shm", []))
+
+                case RequestType.CONFIGURE:
+                    self._configure(request)
+
+            # Blocks referenced outside of any task are not held on to.
+            self._attachments.release(shm_refs)
+
+        self._executor.shutdown()
+
+    def _configure(self, request: Args) -> None:
+        try:
+            framing = Framing(request.get("framing", "TEXT"))
+        except ValueError:
+            # Unknown framing; decline by acknowledging the current one.
+            framing = self.framing
+
+        # NB: The acknowledgment is sent using the old framing.
+        # Afterwards, both directions switch to the new framing.
+        with self._stdout_lock:
+            self.pickle = bool(request.get("pickle", False))
+            response = {
+                "responseType": ResponseType.CONFIGURED.value,
+                "framing": framing.value,
+                "pickle": self.pickle,
             }
-            for uuid, task in dead.items():
-                tasks.pop(uuid)
-                if not task.finished:
-                    # The task died before reporting a terminal status.
-                    # We report this situation as failure by thread death.
-                    task.fail("thread death")
-
-    Thread(target=cleanup_threads, name="Appose-Janitor").start()
-
-    while True:
+            write_frame(self._stdout, self.framing, encode(response))
+            if framing == Framing.BINARY:
+                # Anything scripts print to stdout would now corrupt the
+                # frames sent to the service, so we redirect it to stderr.
+                sys.stdout = sys.stderr
+            self.framing = framing
+
+    def _session(self, name: str) -> Args:
+        """
+        Get the persistent bindings of the given session, creating them if needed.
+        """
+        with self._sessions_lock:
+            return self.sessions.setdefault(name, {})
+
+    def _submit_to_session(self, task: Task, target: Callable[[], None]) -> None:
+        """
+        Submit a task of a session for execution once the previous tasks of
+        its session are done, as they share the session's bindings.
+        """
+        with self._sessions_lock:
+            waiting = self._session_queues.get(task.session)
+            if waiting is not None:
+                waiting.append((task, target))
+                return
+            self._session_queues[task.session] = deque()
+        self._executor.submit(task, target)
+
+    def _submit_next_in_session(self, name: str) -> None:
+        """
+        Submit the next task of the given session, if any, for execution.
+        """
+        with self._sessions_lock:
+            waiting = self._session_queues[name]
+            # Skip the tasks canceled while waiting.
+            while waiting and waiting[0][0].finished:
+                waiting.popleft()
+            if not waiting:
+                del self._session_queues[name]
+                return
+            task, target = waiting.popleft()
+        self._executor.submit(task, target)
+
+    def _manage_session(self, task: Task, name: str, action: str) -> None:
+        """
+        Reset the given session, or report on its size, as the given task.
+        """
+        with self._sessions_lock:
+            match action:
+                case "reset":
+                    self.sessions.pop(name, None)
+                case "info":
+                    binding = self.sessions.get(name, {})
+                    variables = {
+                        k: v
+                        for k, v in binding.items()
+                        if k not in ("task", "__builtins__")
+                    }
+                    task.outputs["exists"] = name in self.sessions
+                    task.outputs["variables"] = len(variables)
+                    # NB: A shallow estimate; referenced objects are not counted.
+                    task.outputs["size"] = sum(
+                        sys.getsizeof(v) for v in variables.values()
+                    )
+                case _:
+                    task.fail(f"Invalid session action: {action}")
+                    return
+        task._report_completion()
+
+    def _script(self, request: Args) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Get the source and ID of the script a request executes.
+        """
+        # NB: Look up a prepared script right away, as a later PREPARE
+        # request may tell the worker to forget it before the task runs.
+        script_id = request.get("scriptId")
+        script = request.get("script")
+        if script is None:
+            script = self.scripts.get(script_id)
+        return script, script_id
+
+    def _compile(
+        self, script: Optional[str], script_id: Optional[str]
+    ) -> CompiledScript:
+        """
+        Compile the given script, with the given ID if it is a prepared one,
+        reusing a previous compilation of the same source if possible.
+        """
+        if script is None:
+            raise KeyError(f"No such prepared script: {script_id}")
+        if script_id is None:
+            script_id = sha256(script.encode("utf-8")).hexdigest()
+
+        with self._compiled_lock:
+            code = self._compiled.get(script_id)
+            if code is not None:
+                self._compiled.move_to_end(script_id)
+                return code
+
+        code = _compile(script)
+        with self._compiled_lock:
+            self._compiled[script_id] = code
+            while len(self._compiled) > self.compile_cache_size:
+                self._compiled.popitem(last=False)
+        return code
+
+    def _respond(self, response: Args) -> None:
+        # NumPy arrays in the response are copied into new shared memory,
+        # which the service takes ownership of.
+        allocations: List[SharedMemory] = []
+        with self._stdout_lock:
+            framing = self.framing
+            attachments = [] if framing == Framing.BINARY else None
+            try:
+                encoded = encode(
+                    response, attachments, allocations, use_pickle=self.pickle
+                )
+            except BaseException:
+                # The service will never hear of these blocks.
+                for shm in allocations:
+                    shm.unlink()
+                raise
+            # NB: write_frame flushes, so the service receives the data.
+            write_frame(self._stdout, framing, encoded, attachments)
+        for shm in allocations:
+            if os.name == "nt":
+                # Windows destroys shared memory once no process has it
+                # open, so keep it open until the service attaches to it.
+                self._retained.append(shm)
+            else:
+                shm.close()
+
+    def warm_up(
+        self,
+        preload: Sequence[str] = (),
+        warmup_script: Optional[str] = None,
+        started: Optional[float] = None,
+    ) -> None:
+        """
+        Import the given modules and run the warm-up script, then send a READY
+        response reporting the worker's capabilities and startup timings.
+
+        Failures do not stop the worker; the READY response reports them.
+
+        :param preload: Names of the modules to import, e.g. ["numpy"].
+        :param warmup_script: Optional script to run once, e.g. to prime caches.
+        :param started: Monotonic timestamp of when the worker started.
+        """
+        timings = {"started": monotonic() if started is None else started}
+        response: Args = {"responseType": ResponseType.READY.value}
+        try:
+            for name in preload:
+                importlib.import_module(name)
+            timings["imported"] = monotonic()
+            if warmup_script is not None:
+                exec(compile(warmup_script, "<warmup>", "exec"), {})
+            timings["warmed"] = monotonic()
+        except Exception:
+            response["error"] = traceback.format_exc()
+        response["capabilities"] = {
+            "language": "python",
+            "version": ".".join(map(str, sys.version_info[:3])),
+            "pid": os.getpid(),
+            "framing": [f.value for f in Framing],
+            "pickle": True,
+            "codec": get_codec().name,
+            "maxThreads": self._executor.max_threads,
+            "preloaded": [name for name in preload if name in sys.modules],
+        }
+        timings["ready"] = monotonic()
+        response["timings"] = timings
+        try:
+            self._respond(response)
+        except BrokenPipeError:
+            # NB: The service is gone already, e.g. this idle standby worker
+            # was dismissed; the worker then stops upon reading end of file.
+            pass
+
+    def _reap(self, task: Task) -> None:
+        """
+        Forget a task whose execution has ended, reporting it if it died,
+        and submit the next task of its session, if any.
+        """
+        self.tasks.pop(task.uuid, None)
+        self._release_blocks(task)
+        if not task.finished:
+            # The task died before reporting a terminal status.
+            # We report this situation as failure by thread death.
+            task.fail("thread death")
+        if task.session is not None:
+            self._submit_next_in_session(task.session)
+
+    def _release_blocks(self, task: Task) -> None:
+        refs, task._shm_refs = task._shm_refs, []
+        self._attachments.release(refs)
+
+
+class _CachedSharedMemory(_LazySharedMemory):
+    """
+    A shared memory block attached by the worker, whose mapping is shared by
+    all tasks referring to the block. Scripts closing it have no effect; the
+    cache closes it once it is no longer needed.
+    """
+
+    def __init__(self, name: str = None, create: bool = False, size: int = 0):
+        super().__init__(name=name, create=create, size=size)
+        self._shared = True
+        self._cached = True
+
+    def close(self) -> None:
+        if not self._cached:
+            super().close()
+
+    def _uncache(self) -> None:
+        """
+        Close the mapping, unless it is still in use, e.g. by a NumPy array.
+        Should the block be needed again, it is attached anew.
+        """
+        self._cached = False
         try:
-            line = input().strip()
-        except EOFError:
-            break
-        if not line:
-            break
-
-        request = decode(line)
-        uuid = request.get("task")
-        request_type = request.get("requestType")
-
-        match RequestType(request_type):
-            case RequestType.EXECUTE:
-                script = request.get("script")
-                inputs = request.get("inputs")
-                task = Task(uuid)
-                tasks[uuid] = task
-                task._start(script, inputs)
-
-            case RequestType.CANCEL:
-                task = tasks.get(uuid)
-                if task is None:
-                    print(f"No such task: {uuid}", file=sys.stderr)
+            self.close()
+        except BufferError:
+            return
+        self._attached = False
+
+
+class _AttachmentCache:
+    """
+    The shared memory blocks attached by the worker, by name, each with the
+    number of tasks referring to it. Blocks no task refers to anymore stay
+    attached within a budget, least recently used ones being closed first,
+    until the service reports them unlinked.
+    """
+
+    def __init__(self, max_idle_blocks: int, max_idle_bytes: int) -> None:
+        self.max_idle_blocks = max_idle_blocks
+        self.max_idle_bytes = max_idle_bytes
+        self._blocks: Dict[str, _CachedSharedMemory] = {}
+        self._refcounts: Dict[str, int] = {}
+        self._idle: OrderedDict[str, None] = OrderedDict()
+        self._idle_bytes = 0
+        self._lock = Lock()
+
+    def acquire(self, name: str, size: int, refs: List[str]) -> SharedMemory:
+        """
+        Get the block of the given name, recording the reference in refs.
+        """
+        stale = None
+        with self._lock:
+            shm = self._blocks.get(name)
+            if shm is not None and shm._lazy_size != size:
+                # A different block of the same name.
+                stale = self._remove(name)
+                shm = None
+            if shm is None:
+                shm = _CachedSharedMemory(name=name, size=size)
+                self._blocks[name] = shm
+                self._refcounts[name] = 0
+            elif name in self._idle:
+                del self._idle[name]
+                self._idle_bytes -= size
+            self._refcounts[name] += 1
+        if stale is not None:
+            stale._uncache()
+        refs.append(name)
+        return shm
+
+    def release(self, refs: List[str]) -> None:
+        """
+        Drop the given references to blocks, closing idle blocks over budget.
+        """
+        evicted = []
+        with self._lock:
+            for name in refs:
+                count = self._refcounts.get(name)
+                if count is None:
+                    # Already forgotten.
                     continue
-                task.cancel_requested = True
+                self._refcounts[name] = count - 1
+                if count == 1:
+                    self._idle[name] = None
+                    self._idle_bytes += self._blocks[name]._lazy_size
+            while self._idle and (
+                len(self._idle) > self.max_idle_blocks
+                or self._idle_bytes > self.max_idle_bytes
+            ):
+                evicted.append(self._remove(next(iter(self._idle))))
+        for shm in evicted:
+            shm._uncache()
+
+    def forget(self, names: List[str]) -> None:
+        """
+        Stop caching the given blocks, which no longer exist. Their mappings
+        are closed right away if idle, or else once no longer used.
+        """
+        forgotten = []
+        with self._lock:
+            for name in names:
+                if name in self._blocks:
+                    idle = name in self._idle
+                    shm = self._remove(name)
+                    if idle:
+                        forgotten.append(shm)
+                    else:
+                        # NB: Closed when collected, after its last use.
+                        shm._cached = False
+        for shm in forgotten:
+            shm._uncache()
+
+    def _remove(self, name: str) -> _CachedSharedMemory:
+        if name in self._idle:
+            del self._idle[name]
+            self._idle_bytes -= self._blocks[name]._lazy_size
+        del self._refcounts[name]
+        return self._blocks.pop(name)
+
+
+class _Executor:
+    """
+    A bounded pool of reusable threads executing tasks from a priority queue.
+    """
+
+    def __init__(self, max_threads: int, on_done: Callable[[Task], None]) -> None:
+        """
+        Create an executor.
+
+        :param max_threads: Maximum number of threads executing tasks.
+        :param on_done:
+            Function called on the executing thread once a task's
+            execution has ended, however it ended, or once the task
+            was skipped, having been canceled while queued.
+        """
+        if max_threads < 1:
+            raise ValueError(f"Invalid thread count: {max_threads}")
+        self.max_threads = max_threads
+        self._on_done = on_done
+        self._queue: PriorityQueue = PriorityQueue()
+        self._counter = count()
+        self._threads: List[Thread] = []
+        self._idle = 0
+        # Number of tasks queued but not yet taken by any thread.
+        self._pending = 0
+        self._lock = Lock()
+
+    def submit(self, task: Task, target: Callable[[], None]) -> None:
+        with self._lock:
+            # NB: Higher priorities run first; equal priorities in order of arrival.
+            self._queue.put((-task.priority, next(self._counter), task, target))
+            self._pending += 1
+            # NB: An idle thread counts as such until it has taken a task, so
+            # compare with the tasks not yet taken, rather than with zero.
+            if self._pending > self._idle and len(self._threads) < self.max_threads:
+                name = f"Appose-Executor-{len(self._threads)}"
+                thread = Thread(target=self._work, name=name)
+                self._threads.append(thread)
+                thread.start()
+
+    def shutdown(self) -> None:
+        """
+        Let the threads exit once all queued tasks have been executed.
+        """
+        with self._lock:
+            for _ in self._threads:
+                self._queue.put((float("inf"), next(self._counter), None, None))
+
+    def _work(self) -> None:
+        while True:
+            with self._lock:
+                self._idle += 1
+            _, _, task, target = self._queue.get()
+            with self._lock:
+                self._idle -= 1
+                if task is not None:
+                    self._pending -= 1
+            if task is None:
+                break
+
+            with task._launch_lock:
+                canceled = task.finished
+                task.started = not canceled
+            if canceled:
+                # Canceled while still queued.
+                self._on_done(task)
+                continue
+
+            # noinspection PyBroadException
+            try:
+                target()
+            except BaseException:
+                # The script killed its thread, e.g. by calling sys.exit.
+                # The task is reported as failed by thread death when done.
+                pass
+            finally:
+                self._on_done(task)
+
 
-    running = False
+def main() -> None:
+    started = monotonic()
+    parser = argparse.ArgumentParser(prog="appose.python_worker")
+    parser.add_argument("--update-interval", type=float, default=0)
+    parser.add_argument("--max-threads", type=int, default=None)
+    parser.add_argument("--preload", action="append", default=[])
+    parser.add_argument("--warmup-script", default=None)
+    args = parser.parse_args(sys.argv[1:])
+
+    _set_worker(True)
+    worker = Worker(update_interval=args.update_interval, max_threads=args.max_threads)
+    worker.warm_up(args.preload, args.warmup_script, started)
+    worker.run()
 
 
 if __name__ == "__main__":
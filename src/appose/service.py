@@ -33,13 +33,40 @@ The appose.service package contains classes for services and tasks.
 
 import subprocess
 import threading
-from enum import Enum
+from collections import OrderedDict, deque
+from hashlib import sha256
+from itertools import islice
 from pathlib import Path
+from time import monotonic
 from traceback import format_exc
-from typing import Any, Callable, Dict, List, Optional, Sequence, Union
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Union,
+)
 from uuid import uuid4
 
-from .types import Args, decode, encode
+from .framing import Frame, Framing, read_frame, write_frame
+from .metrics import ServiceMetrics
+from .protocol import RequestType, ResponseType, TaskStatus
+from .tracing import Tracer, new_context
+from .types import (
+    Args,
+    SharedMemory,
+    SharedMemoryPool,
+    _add_unlink_listener,
+    _destroy,
+    decode,
+    encode,
+)
 
 
 class Service:
@@ -52,17 +79,87 @@ class Service:
 
     _service_count = 0
 
-    def __init__(self, cwd: Union[str, Path], args: Sequence[str]) -> None:
+    def __init__(
+        self,
+        cwd: Union[str, Path],
+        args: Sequence[str],
+        framing: Framing = Framing.TEXT,
+        pickle: bool = False,
+    ) -> None:
+        """
+        Create a service for the worker process launched by the given arguments.
+
+        :param cwd: The working directory of the worker process.
+        :param args: The command line arguments launching the worker process.
+        :param framing:
+            The framing to negotiate with the worker when it starts.
+            TEXT framing (one line of JSON per message) is understood by
+            all workers; BINARY framing (length-prefixed frames, with raw
+            byte attachments) must be supported by the worker.
+        :param pickle:
+            Whether to negotiate the exchange of values JSON cannot represent
+            as pickles (protocol 5, with large buffers in shared memory).
+            Only Python workers support it.
+        """
         self._cwd = cwd
         self._args = args[:]
         self._tasks: Dict[str, "Task"] = {}
         self._service_id = Service._service_count
         Service._service_count += 1
         self._process: Optional[subprocess.Popen] = None
+        # Idle worker process taken from a standby reserve, used upon start.
+        self._adopted: Optional[subprocess.Popen] = None
+        # Function launching the worker process, in place of the command line.
+        self._launcher: Optional[Callable[[], subprocess.Popen]] = None
         self._stdout_thread: Optional[threading.Thread] = None
         self._stderr_thread: Optional[threading.Thread] = None
         self._monitor_thread: Optional[threading.Thread] = None
         self._debug_callback: Optional[Callable[[Any], Any]] = None
+        self._framing = framing
+        self._stdin_framing = Framing.TEXT
+        self._stdout_framing = Framing.TEXT
+        self._pickle = pickle
+        self._pickle_enabled = False
+        self._stdin_lock = threading.Lock()
+        self._configured = threading.Event()
+        self._ready = threading.Event()
+        self._ready_error: Optional[str] = None
+        # What the worker reported it supports, in its READY response.
+        self.capabilities: Optional[Args] = None
+        # Monotonic timestamps of the worker's startup. Service stamps:
+        # - launched: the service launched (or adopted) the worker process.
+        # - returned: the worker's READY response was read.
+        # Worker stamps, reported in its READY response:
+        # - started: the worker's main function began.
+        # - imported: the worker imported its preloaded modules.
+        # - warmed: the worker ran its warm-up script.
+        # - ready: the worker sent its READY response.
+        self.timings: Dict[str, float] = {}
+        # IDs of the scripts prepared by the worker, least recently used first.
+        self._prepared: "OrderedDict[str, None]" = OrderedDict()
+        self._reroute: Optional[Callable[["Service", "Task"], bool]] = None
+        self._shm_pool: Optional[SharedMemoryPool] = None
+        # Names of the shared memory blocks sent to the worker. Once such a
+        # block is unlinked, the worker is told, so it can detach from it.
+        self._shared: Set[str] = set()
+        # Names of such blocks unlinked since the last request was sent.
+        self._released: List[str] = []
+        self._shared_lock = threading.Lock()
+        _add_unlink_listener(self._shm_unlinked)
+        self.metrics = ServiceMetrics()
+        self._tracer: Optional[Tracer] = None
+
+    @property
+    def shm_pool(self) -> SharedMemoryPool:
+        """
+        A pool of shared memory blocks for exchanging data with this service's
+        worker, e.g. via `NDArray(dtype, shape, pool=service.shm_pool)`.
+        The pool is closed, destroying its blocks, once the worker terminates.
+        """
+        if self._shm_pool is None:
+            self._shm_pool = SharedMemoryPool()
+            self._shm_pool._on_allocate = self.metrics.shm_allocated
+        return self._shm_pool
 
     def debug(self, debug_callback: Callable[[Any], Any]) -> None:
         """
@@ -74,7 +171,18 @@ class Service:
         """
         self._debug_callback = debug_callback
 
-    def start(self) -> None:
+    def trace(self, tracer: Optional[Tracer]) -> None:
+        """
+        Record spans describing the journey of this service's tasks through
+        the service and its worker, or stop recording them if None.
+        Tasks already started when tracing begins are not traced.
+
+        :param tracer:
+            The tracer to record spans with; it can be shared across services.
+        """
+        self._tracer = tracer
+
+    def start(self, wait: bool = False, timeout: Optional[float] = None) -> None:
         """
         Explicitly launch the worker process associated with this service.
 
@@ -83,19 +191,62 @@ class Service:
         get going asynchronously before running the first task, or if you
         want to register a debug callback before the process starts to ensure
         you don't miss any events that occur early in the worker execution.
+
+        :param wait:
+            Whether to block until the worker reports that it is ready, having
+            imported its preloaded modules and run its warm-up script. Only
+            Python workers send such a READY response.
+        :param timeout:
+            Maximum number of seconds to wait for the worker to be ready,
+            or None to wait as long as it takes.
+        :raises RuntimeError:
+            If waiting, and the worker is not a Python worker, failed to warm
+            up, or terminated first.
+        :raises TimeoutError: If waiting, and the timeout elapsed first.
         """
-        if self._process is not None:
-            # Already started.
-            return
+        if wait:
+            self._check_announces_ready()
+        if self._process is None:
+            self._launch_worker()
+        if wait:
+            self.wait_ready(timeout)
+
+    def wait_ready(self, timeout: Optional[float] = None) -> None:
+        """
+        Block until the worker reports that it is ready.
+
+        :param timeout:
+            Maximum number of seconds to wait, or None to wait as long as it takes.
+        :raises RuntimeError:
+            If the worker is not a Python worker, failed to warm up,
+            or terminated before being ready.
+        :raises TimeoutError: If the timeout elapsed first.
+        """
+        self._check_announces_ready()
+        if not self._ready.wait(timeout):
+            raise TimeoutError(f"Worker not ready after {timeout} seconds")
+        self._check_ready()
+
+    def _check_announces_ready(self) -> None:
+        # NB: Only Python workers send a READY response; others never would.
+        if not any("appose.python_worker" in arg for arg in self._args):
+            raise RuntimeError("Only Python workers report when they are ready")
 
+    def _check_ready(self) -> None:
+        if self.capabilities is None:
+            raise RuntimeError("Worker terminated before being ready")
+        if self._ready_error is not None:
+            raise RuntimeError(f"Worker failed to warm up: {self._ready_error}")
+
+    def _launch_worker(self) -> None:
+        self.timings["launched"] = monotonic()
         prefix = f"Appose-Service-{self._service_id}"
-        self._process = subprocess.Popen(
-            self._args,
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            cwd=self._cwd,
-            text=True,
-        )
+        if self._adopted is not None:
+            self._process, self._adopted = self._adopted, None
+        elif self._launcher is not None:
+            self._process = self._launcher()
+        else:
+            self._process = _launch(self._cwd, self._args)
         self._stdout_thread = threading.Thread(
             target=self._stdout_loop, name=f"{prefix}-Stdout"
         )
@@ -109,21 +260,128 @@ class Service:
         self._stderr_thread.start()
         self._monitor_thread.start()
 
-    def task(self, script: str, inputs: Optional[Args] = None) -> "Task":
+        if self._framing != Framing.TEXT or self._pickle:
+            self._configure()
+
+    def task(
+        self,
+        script: Union[str, "PreparedScript"],
+        inputs: Optional[Args] = None,
+        session: Optional[str] = None,
+        priority: int = 0,
+    ) -> "Task":
         """
         Create a new task, passing the given script to the worker for execution.
         :param script:
-            The script for the worker to execute in its environment.
+            The script for the worker to execute in its environment,
+            or a handle to a script obtained from the prepare method.
         :param inputs:
             Optional list of key/value pairs to feed into the script as inputs.
+        :param session:
+            Optional name of a session whose variables persist across tasks:
+            anything the script defines (e.g. a loaded model) remains available
+            to later tasks of the same session, until the session is reset.
+            The worker executes the tasks of a session one at a time.
+        :param priority:
+            Priority of the task, when the worker has more tasks to execute
+            than threads to execute them. Higher priorities run first.
+        """
+        self.start()
+        return Task(self, script, inputs, session=session, priority=priority)
+
+    def reset_session(self, session: str) -> "Task":
+        """
+        Discard all variables of the given session in the worker process.
+
+        :param session: The name of the session to reset.
+        :return: The task performing the reset, already started.
         """
         self.start()
-        return Task(self, script, inputs)
+        return SessionTask(self, session, "reset").start()
+
+    def session_info(self, session: str) -> "Task":
+        """
+        Report on the variables of the given session in the worker process.
+
+        Upon completion, the task's `exists` output tells whether the session
+        exists, its `variables` output holds the number of variables, and its
+        `size` output holds their approximate size in bytes, not counting
+        objects they reference.
+
+        :param session: The name of the session to report on.
+        :return: The task gathering the report, already started.
+        """
+        self.start()
+        return SessionTask(self, session, "info").start()
+
+    def prepare(self, script: str) -> "PreparedScript":
+        """
+        Register a script for repeated execution, returning a handle to it
+        which can be passed to the task and map methods in place of the script.
+
+        The script's source is sent to the worker only once, when the first
+        task using the handle is started; later tasks reference it by its
+        content hash, and the worker reuses its compiled form when possible.
+
+        :param script:
+            The script for the worker to execute in its environment.
+        """
+        return PreparedScript(script)
+
+    def map(
+        self,
+        script: Union[str, "PreparedScript"],
+        inputs: Iterable[Args],
+        batch_size: int = 100,
+    ) -> Iterator[Args]:
+        """
+        Execute the given script once per input set, in batches, yielding the
+        outputs of each execution in order.
+
+        Each batch is sent to the worker as a single BATCH request, and its
+        results come back in a single response, which amortizes the protocol
+        overhead of many small tasks.
+
+        :param script:
+            The script for the worker to execute in its environment,
+            or a handle to a script obtained from the prepare method.
+        :param inputs:
+            The input sets to feed into the script, one per execution.
+        :param batch_size:
+            The maximum number of input sets per batch.
+        :raises RuntimeError: If a batch does not complete successfully.
+        """
+        if batch_size < 1:
+            raise ValueError(f"Invalid batch size: {batch_size}")
+        self.start()
+        it = iter(inputs)
+        pending: Deque[BatchTask] = deque()
+        while True:
+            # Keep a few batches in flight, so the worker never sits idle.
+            while len(pending) < _MAP_WINDOW:
+                batch = list(islice(it, batch_size))
+                if not batch:
+                    break
+                pending.append(BatchTask(self, script, batch).start())
+            if not pending:
+                return
+            task = pending.popleft()
+            task.wait_for()
+            if task.status != TaskStatus.COMPLETE:
+                for other in pending:
+                    other.cancel()
+                raise RuntimeError(f"Batch {task.status.value}: {task.error}")
+            yield from task.outputs["results"]
 
     def close(self) -> None:
         """
         Close the worker process's input stream, in order to shut it down.
         """
+        if self._process is None and self._adopted is not None:
+            # Never started; shut down the adopted standby worker instead.
+            self._adopted.stdin.close()
+            self._adopted = None
+            return
         self._process.stdin.close()
 
     def __enter__(self) -> "Service":
@@ -132,42 +390,244 @@ class Service:
     def __exit__(self, exc_type, exc_value, exc_tb) -> None:
         self.close()
 
+    def _adopt(self, process: subprocess.Popen) -> bool:
+        """
+        Take over an idle worker process, launched by this service's command
+        line, to use upon start instead of launching a new one.
+
+        :return: True iff the process was adopted.
+        """
+        if self._process is not None or self._adopted is not None:
+            return False
+        self._adopted = process
+        return True
+
+    def _set_launcher(self, launcher: Callable[[], subprocess.Popen]) -> bool:
+        """
+        Launch the worker process upon start by calling the given function,
+        e.g. to fork it from a fork server, instead of running the command
+        line. The function returns a subprocess.Popen, or a look-alike.
+
+        :return: True iff the launcher will be used.
+        """
+        self._launcher = launcher
+        return True
+
+    def _configure(self) -> None:
+        """
+        Negotiate the requested framing and codec with the worker process.
+
+        The CONFIGURE request is always sent as a line of text; the worker
+        acknowledges it with a CONFIGURED response, also as a line of text,
+        after which both directions switch to the agreed-upon framing.
+        """
+        with self._stdin_lock:
+            encoded = encode(self._configure_request())
+            written = write_frame(self._process.stdin, Framing.TEXT, encoded)
+            self.metrics.message_written(written)
+            self._debug_service(encoded)
+
+            # NB: The stdout loop, or the monitor loop if the worker dies,
+            # signals us once the worker has replied.
+            self._configured.wait()
+            self._stdin_framing = self._stdout_framing
+        if self._stdin_framing != self._framing:
+            self._debug_service(f"<worker declined {self._framing.value} framing>")
+
+    def _configure_request(self) -> Args:
+        request = {
+            "requestType": RequestType.CONFIGURE.value,
+            "framing": self._framing.value,
+        }
+        if self._pickle:
+            request["pickle"] = True
+        return request
+
+    def _prepare(self, script: Optional["PreparedScript"]) -> Optional[Args]:
+        """
+        Get the PREPARE request to send ahead of a request executing the given
+        script, unless the worker has it already.
+
+        The worker keeps only the most recently used prepared scripts, and
+        forgets those this request tells it to. This must be called in the
+        order the requests are written, so both sides agree on what it has.
+        """
+        if script is None:
+            return None
+        if script.id in self._prepared:
+            self._prepared.move_to_end(script.id)
+            return None
+        self._prepared[script.id] = None
+        request = {
+            "requestType": RequestType.PREPARE.value,
+            "scriptId": script.id,
+            "script": script.script,
+        }
+        forget = []
+        while len(self._prepared) > _MAX_PREPARED:
+            forget.append(self._prepared.popitem(last=False)[0])
+        if forget:
+            request["forget"] = forget
+        return request
+
+    def _send(
+        self,
+        request: Args,
+        allocations: Optional[List[SharedMemory]] = None,
+        script: Optional["PreparedScript"] = None,
+    ) -> None:
+        """
+        Encode the given request and write it to the worker's stdin stream.
+
+        :param request: The request to send.
+        :param allocations: Optional list to receive the shared memory
+                            blocks created to stage NumPy arrays.
+        :param script: The prepared script the request executes, if any.
+        """
+        shared: Set[str] = set()
+        with self._stdin_lock:
+            for preamble in (self._take_released(), self._prepare(script)):
+                if preamble is not None:
+                    encoded = encode(preamble)
+                    written = write_frame(
+                        self._process.stdin, self._stdin_framing, encoded
+                    )
+                    self.metrics.message_written(written)
+                    self._debug_service(encoded)
+            start = monotonic()
+            framing = self._stdin_framing
+            attachments = [] if framing == Framing.BINARY else None
+            encoded = encode(
+                request,
+                attachments,
+                allocations,
+                use_pickle=self._pickle_enabled,
+                shared=shared,
+            )
+            encoded_at = monotonic()
+            written = write_frame(self._process.stdin, framing, encoded, attachments)
+        self._trace_send(request, start, encoded_at, monotonic())
+        self.metrics.message_written(written)
+        self._record_shared(shared)
+        self._record_staged(allocations)
+        self._debug_service(encoded)
+
+    def _record_shared(self, names: Set[str]) -> None:
+        if names:
+            with self._shared_lock:
+                self._shared.update(names)
+
+    def _trace_send(
+        self, request: Args, start: float, encoded: float, written: float
+    ) -> None:
+        """
+        Record the spans of encoding and writing a request of a traced task.
+        """
+        context = request.get("trace")
+        tracer = self._tracer
+        if context is None or tracer is None:
+            return
+        attributes = {"requestType": request["requestType"]}
+        tracer.record("encode", context, start, encoded, attributes=attributes)
+        tracer.record("write", context, encoded, written, attributes=attributes)
+
+    def _record_staged(self, allocations: Optional[List[SharedMemory]]) -> None:
+        for shm in allocations or ():
+            self.metrics.shm_allocated(shm.size)
+
+    def _shm_unlinked(self, name: str) -> None:
+        """
+        Note that a shared memory block the worker was sent is gone.
+
+        The worker is told along with the next request: the block is often
+        unlinked by the stdout thread, which must never block writing to the
+        worker, lest neither process drain the other's output.
+        """
+        with self._shared_lock:
+            if name not in self._shared:
+                return
+            self._shared.discard(name)
+            self._released.append(name)
+
+    def _take_released(self) -> Optional[Args]:
+        """
+        Build a RELEASE request for the blocks unlinked since the last one.
+        """
+        with self._shared_lock:
+            names, self._released = self._released, []
+        if not names:
+            return None
+        return {"requestType": RequestType.RELEASE.value, "shm": names}
+
     def _stdout_loop(self) -> None:
         """
-        Input loop processing lines from the worker's stdout stream.
+        Input loop processing messages from the worker's stdout stream.
         """
         while True:
             stdout = self._process.stdout
             # noinspection PyBroadException
             try:
-                line = None if stdout is None else stdout.readline()
+                frame = (
+                    None if stdout is None else read_frame(stdout, self._stdout_framing)
+                )
             except Exception:
-                # Something went wrong reading the line. Panic!
+                # Something went wrong reading the message. Panic!
                 self._debug_service(format_exc())
                 break
 
-            if not line:  # readline returns empty string upon EOF
+            if frame is None:  # read_frame returns None upon EOF
                 self._debug_service("<worker stdout closed>")
                 return
 
-            # noinspection PyBroadException
-            try:
-                response = decode(line)
-                self._debug_service(line)  # Echo the line to the debug listener.
-                uuid = response.get("task")
-                if uuid is None:
-                    self._debug_service("Invalid service message: {line}")
-                    continue
-                task = self._tasks.get(uuid)
-                if task is None:
-                    self._debug_service(f"No such task: {uuid}")
-                    continue
-                # noinspection PyProtectedMember
-                task._handle(response)
-            except Exception:
-                # Something went wrong decoding the line of JSON.
-                # Skip it and keep going, but log it first.
-                self._debug_service(f"<INVALID> {line}")
+            self._dispatch(frame)
+
+    def _dispatch(self, frame: Frame) -> None:
+        """
+        Decode a message from the worker and pass it to its task.
+        """
+        returned = monotonic()
+        self.metrics.message_read(frame.size)
+        line = frame.text
+        # noinspection PyBroadException
+        try:
+            response = decode(line, frame.attachments)
+            decoded = monotonic()
+            self._debug_service(line)  # Echo the line to the debug listener.
+            uuid = response.get("task")
+            if uuid is None:
+                self._handle(response)
+                return
+            task = self._tasks.get(uuid)
+            if task is None:
+                self._debug_service(f"No such task: {uuid}")
+                return
+            # noinspection PyProtectedMember
+            task._handle(response, returned)
+            if self._tracer is not None and task.trace is not None:
+                task._trace_response(response, returned, decoded, monotonic())
+        except Exception:
+            # Something went wrong decoding the line of JSON.
+            # Skip it and keep going, but log it first.
+            self._debug_service(f"<INVALID> {line}")
+
+    def _handle(self, response: Args) -> None:
+        """
+        Handle a response from the worker not associated with any task.
+        """
+        response_type = response.get("responseType")
+        if response_type == ResponseType.CONFIGURED.value:
+            self._stdout_framing = Framing(response.get("framing", "TEXT"))
+            self._pickle_enabled = bool(response.get("pickle", False))
+            self._configured.set()
+            return
+        if response_type == ResponseType.READY.value:
+            self.timings.update(response.get("timings") or {})
+            self.timings["returned"] = monotonic()
+            self._ready_error = response.get("error")
+            self.capabilities = response.get("capabilities") or {}
+            self._ready.set()
+            return
+        self._debug_service(f"Invalid service message: {response}")
 
     def _stderr_loop(self) -> None:
         """
@@ -188,9 +648,13 @@ class Service:
     def _monitor_loop(self) -> None:
         # Wait until the worker process terminates.
         self._process.wait()
+        self._process_terminated(self._process.returncode)
 
+    def _process_terminated(self, exit_code: int) -> None:
+        """
+        Clean up after the worker process has terminated.
+        """
         # Do some sanity checks.
-        exit_code = self._process.returncode
         if exit_code != 0:
             self._debug_service(
                 f"<worker process terminated with exit code {exit_code}>"
@@ -201,12 +665,31 @@ class Service:
                 f"<worker process terminated with {task_count} pending tasks>"
             )
 
-        # Notify any remaining tasks about the process crash.
-        for task in self._tasks.values():
+        # Notify any remaining tasks about the process crash. Tasks which
+        # were still queued may instead be rerouted to another service.
+        for task in list(self._tasks.values()):
+            if (
+                task.status == TaskStatus.QUEUED
+                and self._reroute is not None
+                and self._reroute(self, task)
+            ):
+                self.metrics.task_finished("rerouted", {})
+                continue
             task._crash()
 
         self._tasks.clear()
 
+        # The worker no longer needs any pooled shared memory.
+        if self._shm_pool is not None:
+            self._shm_pool.close()
+
+        # Unblock any pending framing negotiation, or wait for readiness.
+        self._configured.set()
+        self._ready.set()
+
+    def _worker_pid(self) -> int:
+        return 0 if self._process is None else self._process.pid
+
     def _debug_service(self, message: str) -> None:
         self._debug("SERVICE", message)
 
@@ -222,57 +705,53 @@ class Service:
         self._debug_callback(f"[{prefix}-{self._service_id}] {message}")
 
 
-class TaskStatus(Enum):
-    INITIAL = "INITIAL"
-    QUEUED = "QUEUED"
-    RUNNING = "RUNNING"
-    COMPLETE = "COMPLETE"
-    CANCELED = "CANCELED"
-    FAILED = "FAILED"
-    CRASHED = "CRASHED"
-
-    def is_finished(self):
-        """
-        True iff status is COMPLETE, CANCELED, FAILED, or CRASHED.
-        """
-        return self in (
-            TaskStatus.COMPLETE,
-            TaskStatus.CANCELED,
-            TaskStatus.FAILED,
-            TaskStatus.CRASHED,
-        )
-
+class PreparedScript:
+    """
+    A handle to a script registered for repeated execution,
+    identified by the SHA-256 hash of its source.
+    """
 
-class RequestType(Enum):
-    EXECUTE = "EXECUTE"
-    CANCEL = "CANCEL"
+    def __init__(self, script: str) -> None:
+        self.script = script
+        self.id = sha256(script.encode("utf-8")).hexdigest()
 
+    def __str__(self):
+        return f"PreparedScript({self.id})"
 
-class ResponseType(Enum):
-    LAUNCH = "LAUNCH"
-    UPDATE = "UPDATE"
-    COMPLETION = "COMPLETION"
-    CANCELATION = "CANCELATION"
-    FAILURE = "FAILURE"
-    CRASH = "CRASH"
 
+def _launch(cwd: Union[str, Path], args: Sequence[str]) -> subprocess.Popen:
     """
-    True iff response type is COMPLETE, CANCELED, FAILED, or CRASHED.
+    Launch a worker process, with pipes for exchanging messages with it.
     """
+    return subprocess.Popen(
+        args,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        cwd=cwd,
+    )
 
-    def is_terminal(self):
-        return self in (
-            ResponseType.COMPLETION,
-            ResponseType.CANCELATION,
-            ResponseType.FAILURE,
-            ResponseType.CRASH,
-        )
+
+# Names under which the metrics count tasks finishing with each final status.
+_OUTCOMES = {
+    TaskStatus.COMPLETE: "completed",
+    TaskStatus.CANCELED: "canceled",
+    TaskStatus.FAILED: "failed",
+    TaskStatus.CRASHED: "crashed",
+}
+
+
+# Request types which submit a task for execution.
+_SUBMISSIONS = (RequestType.EXECUTE, RequestType.BATCH, RequestType.SESSION)
 
 
 class TaskEvent:
-    def __init__(self, task: "Task", response_type: ResponseType) -> None:
+    def __init__(
+        self, task: "Task", response_type: ResponseType, item: Any = None
+    ) -> None:
         self.task: "Task" = task
         self.response_type: ResponseType = response_type
+        # The emitted item, for RESULT events.
+        self.item: Any = item
 
     def __str__(self):
         return f"[{self.response_type}] {self.task}"
@@ -286,11 +765,18 @@ class Task:
     """
 
     def __init__(
-        self, service: Service, script: str, inputs: Optional[Args] = None
+        self,
+        service: Service,
+        script: Union[str, "PreparedScript"],
+        inputs: Optional[Args] = None,
+        session: Optional[str] = None,
+        priority: int = 0,
     ) -> None:
         self.uuid = uuid4().hex
         self.service = service
         self.script = script
+        self.session = session
+        self.priority = priority
         self.inputs: Args = {}
         if inputs is not None:
             self.inputs.update(inputs)
@@ -302,6 +788,30 @@ class Task:
         self.error: Optional[str] = None
         self.listeners: List[Callable[["TaskEvent"], None]] = []
         self.cv = threading.Condition()
+        # Monotonic timestamps (in seconds, as by time.monotonic) of the task's
+        # progress, for analyzing where its latency goes. Service stamps:
+        # - created: the task was created.
+        # - sent: the request executing the task was written to the worker.
+        # - returned: the worker's terminal response was read...
+        # - dispatched: ...then decoded and passed to all listeners.
+        # Worker stamps (on the same clock, the processes sharing a machine):
+        # - received: the worker read the request.
+        # - decoded: the worker decoded the request.
+        # - launched: a worker thread began executing the task.
+        # - finished: the task's script ended.
+        # - encoding: the worker began encoding its terminal response, so the
+        #   interval up to `returned` includes encoding and writing it.
+        self.timings: Dict[str, float] = {"created": monotonic()}
+        # Trace context of the task's span, sent along with its requests, if
+        # its service is traced. Set it before starting the task, e.g. via
+        # appose.tracing.new_context(parent), to make it part of another trace.
+        self.trace: Optional[Args] = None
+        self._worker_thread: Optional[str] = None
+        self._window: Optional[int] = None
+        self._items: Deque[Any] = deque()
+        self._consumed = 0
+        # Shared memory staging the task's NumPy inputs, until it finishes.
+        self._staged: List[SharedMemory] = []
         self.service._tasks[self.uuid] = self
 
     def start(self) -> "Task":
@@ -310,9 +820,17 @@ class Task:
                 raise RuntimeError("Task is not in the INITIAL state")
 
             self.status = TaskStatus.QUEUED
+            self.service._tasks[self.uuid] = self
 
-        args = {"script": self.script, "inputs": self.inputs}
-        self._request(RequestType.EXECUTE, args)
+        try:
+            self._submit()
+        except BaseException:
+            # Nothing reached the worker; let the task be fixed and restarted,
+            # rather than count as in flight forever.
+            self.service._tasks.pop(self.uuid, None)
+            with self.cv:
+                self.status = TaskStatus.INITIAL
+            raise
 
         return self
 
@@ -331,10 +849,36 @@ class Task:
             if self.status == TaskStatus.INITIAL:
                 self.start()
 
-            if self.status not in (TaskStatus.QUEUED, TaskStatus.RUNNING):
-                return
+            while self.status in (TaskStatus.QUEUED, TaskStatus.RUNNING):
+                self.cv.wait()
+
+    def stream(self, window: int = 64) -> Iterator[Any]:
+        """
+        Start the task, then iterate over the items its script emits via
+        `task.emit(item)` as they arrive, until the task finishes.
 
-            self.cv.wait()
+        At most `window` items are in flight between worker and service at
+        any time: the worker's `emit` blocks until the service has consumed
+        enough earlier items. This bounds memory usage on both sides.
+
+        :param window: Maximum number of items buffered at once.
+        :raises RuntimeError:
+            If the task is not in the INITIAL state,
+            or if it does not complete successfully.
+        """
+        self._begin_stream(window)
+        self.start()
+        try:
+            while True:
+                with self.cv:
+                    while not self._items and not self.status.is_finished():
+                        self.cv.wait()
+                    if not self._items:
+                        break
+                yield self._next_item()
+        finally:
+            self._end_stream()
+        self._check_stream()
 
     def cancel(self) -> None:
         """
@@ -342,6 +886,77 @@ class Task:
         """
         self._request(RequestType.CANCEL, {})
 
+    def _submit(self) -> None:
+        """
+        Send the request executing this task to the worker process.
+        """
+        args = {**self._script_args(), "inputs": self.inputs}
+        if self.session is not None:
+            args["session"] = self.session
+        if self.priority != 0:
+            args["priority"] = self.priority
+        if self._window is not None:
+            args["window"] = self._window
+        self._request(RequestType.EXECUTE, args)
+
+    def _begin_stream(self, window: int) -> None:
+        if window < 1:
+            raise ValueError(f"Invalid window: {window}")
+        with self.cv:
+            if self.status != TaskStatus.INITIAL:
+                raise RuntimeError("Task is not in the INITIAL state")
+            self._window = window
+
+    def _next_item(self) -> Any:
+        """
+        Take the next buffered item, granting the worker more
+        credit once half of the window has been consumed.
+        """
+        with self.cv:
+            item = self._items.popleft()
+            self._consumed += 1
+            consumed = self._consumed
+            if consumed < max(1, self._window // 2) or self.status.is_finished():
+                consumed = 0
+            else:
+                self._consumed = 0
+        if consumed > 0:
+            self._request(RequestType.ACKNOWLEDGE, {"count": consumed})
+        return item
+
+    def _end_stream(self) -> None:
+        """
+        Stop buffering items; if the task is still going, lift its window,
+        so that its script does not block forever on unconsumed items.
+        """
+        with self.cv:
+            self._window = None
+            self._items.clear()
+            finished = self.status.is_finished()
+        if not finished:
+            self._request(RequestType.ACKNOWLEDGE, {"count": -1})
+
+    def _check_stream(self) -> None:
+        if self.status != TaskStatus.COMPLETE:
+            raise RuntimeError(f"Task {self.status.value}: {self.error}")
+
+    def _script_args(self) -> Args:
+        """
+        Get the request arguments identifying the script to execute.
+        """
+        if isinstance(self.script, PreparedScript):
+            return {"scriptId": self.script.id}
+        return {"script": self.script}
+
+    def _resubmit(self, service: Service) -> None:
+        """
+        Move this queued task to another service, and execute it there.
+        """
+        self.service = service
+        service._tasks[self.uuid] = self
+        service.start()
+        self._submit()
+
     def _request(self, request_type: RequestType, args: Args) -> None:
         """
         Send a request to the worker process.
@@ -349,13 +964,31 @@ class Task:
         request = {"task": self.uuid, "requestType": request_type.value}
         if args is not None:
             request.update(args)
+        if request_type in _SUBMISSIONS and self.service._tracer is not None:
+            if self.trace is None:
+                self.trace = new_context()
+        if self.trace is not None:
+            request["trace"] = self.trace
+        script = self.script if "scriptId" in request else None
+        staged: List[SharedMemory] = []
+        try:
+            self.service._send(request, staged, script)
+        except BaseException:
+            for shm in staged:
+                _destroy(shm)
+            raise
+        if request_type in _SUBMISSIONS:
+            self.timings["sent"] = monotonic()
+            self.service.metrics.task_started()
+        with self.cv:
+            if not self.status.is_finished():
+                self._staged.extend(staged)
+                staged = []
+        # NB: Any blocks left are for a task which finished in the meantime.
+        for shm in staged:
+            _destroy(shm)
 
-        encoded = encode(request)
-        # NB: Flush is necessary to ensure worker receives the data!
-        print(encoded, file=self.service._process.stdin, flush=True)
-        self.service._debug_service(encoded)
-
-    def _handle(self, response: Args) -> None:
+    def _handle(self, response: Args, returned: Optional[float] = None) -> None:
         maybe_response_type = response.get("responseType")
         if maybe_response_type is None:
             self.service._debug_service("Message type not specified")
@@ -365,7 +998,19 @@ class Task:
         match response_type:
             case ResponseType.LAUNCH:
                 self.status = TaskStatus.RUNNING
+                self._worker_thread = response.get("thread")
+            case ResponseType.RESULT:
+                item = response.get("item")
+                with self.cv:
+                    if self._window is not None:
+                        self._items.append(item)
+                        self.cv.notify_all()
+                event = TaskEvent(self, response_type, item)
+                for listener in self.listeners:
+                    listener(event)
+                return
             case ResponseType.UPDATE:
+                self.service.metrics.task_updated()
                 self.message = response.get("message")
                 current = response.get("current")
                 maximum = response.get("maximum")
@@ -392,17 +1037,80 @@ class Task:
                 )
                 return
 
+        timings = response.get("timings")
+        if timings is not None:
+            self.timings.update(timings)
+        if returned is not None and response_type.is_terminal():
+            self.timings["returned"] = returned
+
         event = TaskEvent(self, response_type)
         for listener in self.listeners:
             listener(event)
 
         if self.status.is_finished():
+            self.timings["dispatched"] = monotonic()
+            self.service.metrics.task_finished(_OUTCOMES[self.status], self.timings)
+            self._free_staged()
             with self.cv:
                 self.cv.notify_all()
 
+    def _trace_response(
+        self, response: Args, returned: float, decoded: float, handled: float
+    ) -> None:
+        """
+        Record the spans of receiving a response of this task, and of the
+        whole task, along with its steps through the worker, once finished.
+        """
+        tracer = self.service._tracer
+        if tracer is None:
+            return
+        attributes = {"responseType": response.get("responseType")}
+        tracer.record("decode", self.trace, returned, decoded, attributes=attributes)
+        tracer.record("dispatch", self.trace, decoded, handled, attributes=attributes)
+        if self.status.is_finished():
+            self._trace_task(tracer, handled)
+
+    def _trace_task(self, tracer: Tracer, end: float) -> None:
+        """
+        Record the span of the whole task, and those of its worker stamps.
+        """
+        service = self.service
+        t = self.timings
+        pid = service._worker_pid()
+        tracer.name_process(pid, f"Appose worker {service._service_id}")
+        thread = self._worker_thread or "worker"
+        steps = [
+            ("decode", "received", "decoded", "MainThread"),
+            ("queue", "decoded", "launched", "queue"),
+            ("exec", "launched", "finished", thread),
+            ("respond", "finished", "encoding", thread),
+        ]
+        for name, begin, finish, on in steps:
+            if begin in t and finish in t:
+                tracer.record(name, self.trace, t[begin], t[finish], pid, on)
+        if "encoding" in t and "returned" in t:
+            tracer.record("transit", self.trace, t["encoding"], t["returned"])
+        attributes = {"task": self.uuid, "status": self.status.value}
+        start = t.get("sent", t["created"])
+        tracer.record_context("task", self.trace, start, end, attributes)
+
+    def _free_staged(self) -> None:
+        """
+        Destroy the shared memory blocks staging the task's NumPy inputs.
+        """
+        with self.cv:
+            staged, self._staged = self._staged, []
+        for shm in staged:
+            _destroy(shm)
+
     def _crash(self):
         event = TaskEvent(self, ResponseType.CRASH)
         self.status = TaskStatus.CRASHED
+        self.service.metrics.task_finished("crashed", self.timings)
+        tracer = self.service._tracer
+        if tracer is not None and self.trace is not None:
+            self._trace_task(tracer, monotonic())
+        self._free_staged()
         for listener in self.listeners:
             listener(event)
         with self.cv:
@@ -413,3 +1121,44 @@ class Task:
             f"{self.uuid=}, {self.status=}, {self.message=}, "
             f"{self.current=}, {self.maximum=}, {self.error=}"
         )
+
+
+class BatchTask(Task):
+    """
+    A task executing its script once per input set of a batch.
+    Upon completion, its `results` output lists the outputs of each execution.
+    """
+
+    def __init__(
+        self,
+        service: Service,
+        script: Union[str, "PreparedScript"],
+        batch: List[Args],
+    ) -> None:
+        super().__init__(service, script)
+        self.batch = batch
+
+    def _submit(self) -> None:
+        args = {**self._script_args(), "inputs": self.batch}
+        self._request(RequestType.BATCH, args)
+
+
+class SessionTask(Task):
+    """
+    A task managing a session of the worker, rather than executing a script.
+    """
+
+    def __init__(self, service: Service, session: str, action: str) -> None:
+        super().__init__(service, "", session=session)
+        self.action = action
+
+    def _submit(self) -> None:
+        args = {"session": self.session, "action": self.action}
+        self._request(RequestType.SESSION, args)
+
+
+# Number of batches Service.map keeps in flight at once.
+_MAP_WINDOW = 2
+
+# Number of prepared scripts a worker keeps at once: the most recently used.
+_MAX_PREPARED = 128
@@ -0,0 +1,160 @@
+###
+# #%L
+# Appose: multi-language interprocess cooperation with shared memory.
+# %%
+# Copyright (C) 2023 - 2024 Appose developers.
+# %%
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDERS OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+# #L%
+
+"""
+The appose.standby package keeps idle worker processes ready for services.
+"""
+
+import subprocess
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Deque, List, Optional, Union
+
+from .service import Service, _launch
+
+
+class Standby:
+    """
+    A reserve of idle, already-started worker processes, all launched by the
+    same command line. A new service adopts one of them instead of launching
+    its own worker when it starts, skipping the interpreter's startup and the
+    worker's imports; a replacement is then launched in the background.
+
+    Idle workers wait for their first request on stdin. They shut down when
+    the reserve is closed, or when the calling process exits.
+    """
+
+    def __init__(self, cwd: Union[str, Path], args: List[str], count: int) -> None:
+        """
+        Create a reserve of worker processes, launching them right away.
+
+        :param cwd: The working directory of the worker processes.
+        :param args: The command line arguments launching each worker process.
+        :param count: The number of idle worker processes to keep ready.
+        """
+        if count < 0:
+            raise ValueError(f"Invalid standby count: {count}")
+        self._cwd = cwd
+        self._args = args[:]
+        self._count = count
+        self._idle: Deque[subprocess.Popen] = deque()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._fill()
+
+    @property
+    def count(self) -> int:
+        """
+        The number of idle worker processes to keep ready.
+        """
+        return self._count
+
+    @count.setter
+    def count(self, count: int) -> None:
+        if count < 0:
+            raise ValueError(f"Invalid standby count: {count}")
+        with self._lock:
+            self._count = count
+            surplus = []
+            while len(self._idle) > count:
+                surplus.append(self._idle.pop())
+        for process in surplus:
+            _dismiss(process)
+        self._fill_later()
+
+    def lend(self, service: Service) -> bool:
+        """
+        Hand an idle worker process over to the given service, if there is
+        one and the service can adopt it, launching a replacement in the
+        background.
+
+        :param service: The service to adopt the worker process.
+        :return: True iff the service adopted a worker process.
+        """
+        process = self._take()
+        if process is None:
+            return False
+        if not service._adopt(process):
+            with self._lock:
+                self._idle.appendleft(process)
+            return False
+        self._fill_later()
+        return True
+
+    def close(self) -> None:
+        """
+        Shut down the idle worker processes, and stop launching new ones.
+        """
+        with self._lock:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+        for process in idle:
+            _dismiss(process)
+
+    def _take(self) -> Optional[subprocess.Popen]:
+        """
+        Remove the longest-waiting live worker process from the reserve.
+        """
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                process = self._idle.popleft()
+            if process.poll() is None:
+                return process
+            # NB: The worker died while waiting; try the next one.
+
+    def _fill(self) -> None:
+        """
+        Launch worker processes until the reserve is full.
+        """
+        while True:
+            with self._lock:
+                if self._closed or len(self._idle) >= self._count:
+                    return
+            process = _launch(self._cwd, self._args)
+            with self._lock:
+                if not self._closed and len(self._idle) < self._count:
+                    self._idle.append(process)
+                    continue
+            _dismiss(process)
+            return
+
+    def _fill_later(self) -> None:
+        threading.Thread(target=self._fill, name="Appose-Standby", daemon=True).start()
+
+
+def _dismiss(process: subprocess.Popen) -> None:
+    """
+    Shut down an idle worker process, by closing its input stream.
+    """
+    try:
+        process.stdin.close()
+    except OSError:
+        pass
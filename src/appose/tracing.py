@@ -0,0 +1,291 @@
+###
+# #%L
+# Appose: multi-language interprocess cooperation with shared memory.
+# %%
+# Copyright (C) 2023 - 2024 Appose developers.
+# %%
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDERS OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+# #L%
+
+"""
+Tracing of Appose tasks across the service and its worker processes.
+
+Once a `Tracer` is attached to a service (or a pool of services), each task
+request carries a trace context, and the steps of the task's journey are
+recorded as spans: encoding and writing the request, waiting in the worker's
+queue, executing the script, sending the response back, then decoding and
+dispatching it to the task's listeners. Spans of the worker are timed by the
+worker itself and reported along with its responses.
+
+The recorded spans can be exported as OpenTelemetry-compatible span dicts
+(following the OTLP JSON encoding), or as a Chrome trace-event file, which
+shows the tasks of all services and workers on one timeline, e.g. in
+chrome://tracing or https://ui.perfetto.dev:
+
+    tracer = appose.tracing.Tracer()
+    service = env.python()
+    service.trace(tracer)
+    ...
+    tracer.export_chrome("appose-trace.json")
+"""
+
+import json
+import os
+import threading
+from collections import deque
+from pathlib import Path
+from time import monotonic, time
+from typing import Any, Deque, Dict, List, NamedTuple, Optional, Union
+
+Args = Dict[str, Any]
+
+
+class Span(NamedTuple):
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    # Monotonic timestamps, in seconds.
+    start: float
+    end: float
+    # Process and thread which performed the work.
+    pid: int
+    thread: str
+    attributes: Args
+
+
+def new_context(parent: Optional[Args] = None) -> Args:
+    """
+    Create the trace context of a new span: a fresh span ID, within the
+    trace of the given parent context, or within a fresh trace otherwise.
+
+    :param parent: Optional context of the parent span, with the same
+                   "traceId" and "spanId" keys as the result.
+    :return: The context, as a dict carrying "traceId", "spanId" and,
+             if there is a parent, "parentId".
+    """
+    if parent is None:
+        return {"traceId": os.urandom(16).hex(), "spanId": _span_id()}
+    return {
+        "traceId": parent["traceId"],
+        "spanId": _span_id(),
+        "parentId": parent["spanId"],
+    }
+
+
+class Tracer:
+    """
+    A thread-safe recorder of spans, shared by any number of services.
+    """
+
+    def __init__(self, max_spans: int = 100_000) -> None:
+        """
+        Create a tracer.
+
+        :param max_spans: Maximum number of spans to keep;
+                          the oldest spans are dropped beyond it.
+        """
+        self._spans: Deque[Span] = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+        # Offset converting monotonic timestamps to seconds since the epoch.
+        self._epoch = time() - monotonic()
+        # Display names of the processes spans were recorded for.
+        self._processes: Dict[int, str] = {os.getpid(): "Appose service"}
+
+    def record(
+        self,
+        name: str,
+        context: Args,
+        start: float,
+        end: float,
+        pid: Optional[int] = None,
+        thread: Optional[str] = None,
+        attributes: Optional[Args] = None,
+    ) -> Span:
+        """
+        Record a span as a child of the given context.
+
+        :param name: The name of the span.
+        :param context: The trace context of the parent span.
+        :param start: Monotonic timestamp of the start of the span.
+        :param end: Monotonic timestamp of the end of the span.
+        :param pid: The process which did the work; by default, this one.
+        :param thread: The thread which did the work; by default, this one.
+        :param attributes: Optional key/value pairs describing the span.
+        """
+        span = Span(
+            name,
+            context["traceId"],
+            _span_id(),
+            context["spanId"],
+            start,
+            end,
+            os.getpid() if pid is None else pid,
+            threading.current_thread().name if thread is None else thread,
+            attributes or {},
+        )
+        self._append(span)
+        return span
+
+    def record_context(
+        self,
+        name: str,
+        context: Args,
+        start: float,
+        end: float,
+        attributes: Optional[Args] = None,
+    ) -> Span:
+        """
+        Record the span identified by the given context itself,
+        e.g. the span of a whole task, once it has ended.
+        """
+        span = Span(
+            name,
+            context["traceId"],
+            context["spanId"],
+            context.get("parentId"),
+            start,
+            end,
+            os.getpid(),
+            threading.current_thread().name,
+            attributes or {},
+        )
+        self._append(span)
+        return span
+
+    def name_process(self, pid: int, name: str) -> None:
+        """
+        Set the name under which the given process appears on the timeline.
+        """
+        with self._lock:
+            self._processes[pid] = name
+
+    def spans(self) -> List[Span]:
+        """
+        Get the spans recorded so far, in the order they were recorded.
+        """
+        with self._lock:
+            return list(self._spans)
+
+    def clear(self) -> None:
+        """
+        Discard the spans recorded so far.
+        """
+        with self._lock:
+            self._spans.clear()
+
+    def otel(self) -> List[Args]:
+        """
+        Export the recorded spans as OpenTelemetry spans,
+        in the OTLP JSON encoding.
+        """
+        spans = []
+        for span in self.spans():
+            attributes = {
+                **span.attributes,
+                "process.pid": span.pid,
+                "thread.name": span.thread,
+            }
+            otel = {
+                "traceId": span.trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                "kind": 1,  # SPAN_KIND_INTERNAL
+                "startTimeUnixNano": str(self._nanos(span.start)),
+                "endTimeUnixNano": str(self._nanos(span.end)),
+                "attributes": [
+                    {"key": k, "value": _otel_value(v)} for k, v in attributes.items()
+                ],
+            }
+            if span.parent_id is not None:
+                otel["parentSpanId"] = span.parent_id
+            spans.append(otel)
+        return spans
+
+    def chrome(self) -> Args:
+        """
+        Export the recorded spans as a Chrome trace-event document,
+        with one timeline row per process and thread.
+        """
+        spans = self.spans()
+        with self._lock:
+            processes = dict(self._processes)
+        events: List[Args] = []
+        threads: Dict[tuple, int] = {}
+        for span in spans:
+            key = (span.pid, span.thread)
+            tid = threads.setdefault(key, len(threads) + 1)
+            args = {**span.attributes, "traceId": span.trace_id}
+            events.append(
+                {
+                    "name": span.name,
+                    "cat": "appose",
+                    "ph": "X",
+                    "ts": self._micros(span.start),
+                    "dur": max(0.0, (span.end - span.start) * 1e6),
+                    "pid": span.pid,
+                    "tid": tid,
+                    "args": args,
+                }
+            )
+        for pid in {pid for pid, _ in threads}:
+            name = processes.get(pid, f"Process {pid}")
+            events.append(_metadata("process_name", pid, 0, name))
+        for (pid, thread), tid in threads.items():
+            events.append(_metadata("thread_name", pid, tid, thread))
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export_chrome(self, path: Union[str, Path]) -> None:
+        """
+        Write the recorded spans to the given file as a Chrome trace-event
+        document, loadable by chrome://tracing or https://ui.perfetto.dev.
+        """
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.chrome(), f)
+
+    def _append(self, span: Span) -> None:
+        with self._lock:
+            self._spans.append(span)
+
+    def _micros(self, timestamp: float) -> float:
+        return (self._epoch + timestamp) * 1e6
+
+    def _nanos(self, timestamp: float) -> int:
+        return int((self._epoch + timestamp) * 1e9)
+
+
+def _span_id() -> str:
+    return os.urandom(8).hex()
+
+
+def _metadata(name: str, pid: int, tid: int, value: str) -> Args:
+    return {"name": name, "ph": "M", "pid": pid, "tid": tid, "args": {"name": value}}
+
+
+def _otel_value(value: Any) -> Args:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
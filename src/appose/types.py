@@ -28,10 +28,16 @@
 ###
 
 import json
+import mmap
+import os
 import re
-from math import ceil, prod
+import sys
+import threading
+import weakref
+from functools import partial
+from math import ceil, isfinite, prod
 from multiprocessing import resource_tracker, shared_memory
-from typing import Any, Dict, Sequence, Union
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Union
 
 Args = Dict[str, Any]
 
@@ -48,6 +54,10 @@ class SharedMemory(shared_memory.SharedMemory):
     def __init__(self, name: str = None, create: bool = False, size: int = 0):
         super().__init__(name=name, create=create, size=size)
         self._unlink_on_dispose = create
+        self._pool: Optional["SharedMemoryPool"] = None
+        _buffers[id(self._mmap)] = self
+        if not _is_worker and shared_memory._USE_POSIX:
+            _registered.add(self._name)
         if _is_worker:
             # HACK: Remove this shared memory block from the resource_tracker,
             # which would otherwise want to clean up shared memory blocks
@@ -92,6 +102,11 @@ class SharedMemory(shared_memory.SharedMemory):
                 # See also: https://github.com/imglib/imglib2-appose/issues/1
                 pass
 
+    def unlink(self) -> None:
+        super().unlink()
+        _registered.discard(self._name)
+        _notify_unlinked(self.name)
+
     def unlink_on_dispose(self, value: bool) -> None:
         """
         Set whether the `unlink()` method should be invoked to destroy
@@ -107,7 +122,10 @@ class SharedMemory(shared_memory.SharedMemory):
         self._unlink_on_dispose = value
 
     def dispose(self) -> None:
-        if self._unlink_on_dispose:
+        if self._pool is not None:
+            # Give the block back to its pool, for reuse.
+            self._pool.release(self)
+        elif self._unlink_on_dispose:
             self.unlink()
         else:
             self.close()
@@ -119,12 +137,439 @@ class SharedMemory(shared_memory.SharedMemory):
         self.dispose()
 
 
-def encode(data: Args) -> str:
-    return json.dumps(data, cls=_ApposeJSONEncoder, separators=(",", ":"))
+class _LazySharedMemory(SharedMemory):
+    """
+    A SharedMemory attaching to its existing block only once its buffer is
+    first accessed, so that merely decoding or passing along a reference to
+    a block costs no system calls and no address space.
+
+    Like attaching, registering the block with the resource tracker is
+    deferred until first access, so a block which is never accessed is not
+    cleaned up at exit; unlink it, or dispose of it if it is to be unlinked.
+    """
+
+    def __init__(self, name: str = None, create: bool = False, size: int = 0):
+        # NB: Do not attach yet.
+        self._shared = False
+        self._lazy_name = name
+        self._lazy_size = size
+        self._attach_lock = threading.Lock()
+        self._attached = False
+        self._unlink_on_dispose = False
+        self._pool = None
+
+    def _attach(self) -> None:
+        with self._attach_lock:
+            if self._attached:
+                return
+            # NB: This also registers the block with the resource tracker.
+            unlink_on_dispose = self._unlink_on_dispose
+            super().__init__(name=self._lazy_name, size=self._lazy_size)
+            self._unlink_on_dispose = unlink_on_dispose
+            self._attached = True
+
+    @property
+    def buf(self) -> memoryview:
+        self._attach()
+        return super().buf
+
+    @property
+    def name(self) -> str:
+        return self._lazy_name
+
+    @property
+    def size(self) -> int:
+        return super().size if self._attached else self._lazy_size
+
+    def close(self) -> None:
+        if self._attached:
+            super().close()
+
+    def unlink(self) -> None:
+        with self._attach_lock:
+            attached = self._attached
+            if not attached and shared_memory._USE_POSIX:
+                # NB: Unlink by name, rather than mapping the block to do so.
+                name = f"/{self._lazy_name}"
+                shared_memory._posixshmem.shm_unlink(name)
+                if name in _registered:
+                    # Registered by another SharedMemory of this process.
+                    resource_tracker.unregister(name, "shared_memory")
+                    _registered.discard(name)
+        if attached:
+            super().unlink()
+        else:
+            _notify_unlinked(self._lazy_name)
+
+
+class SharedMemoryPool:
+    """
+    A pool of reusable shared memory blocks, grouped by size class.
+
+    Creating a shared memory block costs several system calls, plus page
+    faults when its memory is first touched, and destroying it costs more.
+    Programs allocating many similarly sized blocks can instead acquire them
+    from a pool: disposing of a pooled block gives it back to the pool rather
+    than destroying it, so the next acquisition of that size class reuses it,
+    already mapped into memory.
+
+    Block sizes are rounded up to the next power of two (of at least one
+    page), so every block is still a whole, separately named shared memory
+    block, which other processes attach to as usual. Reused blocks are not
+    cleared: they contain whatever data they last held.
+    """
+
+    def __init__(self, max_free_bytes: int = 1 << 30) -> None:
+        """
+        Create a shared memory pool.
+
+        :param max_free_bytes:
+            Maximum total size of the idle blocks kept for reuse. Blocks
+            given back beyond this limit are destroyed straight away.
+        """
+        self.max_free_bytes = max_free_bytes
+        self._free: Dict[int, List[SharedMemory]] = {}
+        self._free_bytes = 0
+        self._blocks: Dict[str, SharedMemory] = {}
+        self._in_use: Set[str] = set()
+        self._lock = threading.Lock()
+        self._closed = False
+        # Called with the size of each block the pool creates.
+        self._on_allocate: Optional[Callable[[int], None]] = None
+
+    @staticmethod
+    def size_class(size: int) -> int:
+        """
+        Get the size of the blocks in which an allocation of the given size
+        is served: the next power of two, and at least one page.
+        """
+        return max(mmap.PAGESIZE, 1 << (max(size, 1) - 1).bit_length())
+
+    def acquire(self, size: int) -> SharedMemory:
+        """
+        Get a shared memory block of at least the given size, reusing an
+        idle block of the matching size class if there is one. Dispose of
+        the block when done with it, to give it back to the pool.
+
+        :param size: Minimum size of the block, in bytes.
+        :raises RuntimeError: If the pool has been closed.
+        """
+        block_size = SharedMemoryPool.size_class(size)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Shared memory pool is closed")
+            free = self._free.get(block_size)
+            if free:
+                shm = free.pop()
+                self._free_bytes -= block_size
+                self._in_use.add(shm.name)
+                return shm
+        shm = SharedMemory(create=True, size=block_size)
+        shm._pool = self
+        if self._on_allocate is not None:
+            self._on_allocate(block_size)
+        with self._lock:
+            self._blocks[shm.name] = shm
+            self._in_use.add(shm.name)
+        return shm
+
+    def release(self, shm: SharedMemory) -> None:
+        """
+        Give a block acquired from this pool back to it. This is what
+        disposing of a pooled block does; releasing it again has no effect.
+        """
+        with self._lock:
+            if shm.name not in self._in_use:
+                return
+            self._in_use.discard(shm.name)
+            block_size = SharedMemoryPool.size_class(shm.size)
+            if not self._closed and (
+                self._free_bytes + block_size <= self.max_free_bytes
+            ):
+                self._free.setdefault(block_size, []).append(shm)
+                self._free_bytes += block_size
+                return
+            del self._blocks[shm.name]
+            closed = self._closed
+        if closed:
+            # Already unlinked when the pool was closed.
+            _close(shm)
+        else:
+            _destroy(shm)
+
+    def close(self) -> None:
+        """
+        Destroy all idle blocks of the pool, and make sure blocks still in
+        use are destroyed once they are given back. Blocks created by the
+        pool are also unlinked right away, so none outlives the program,
+        although processes which already attached to them may keep using
+        them until they detach.
+        """
+        with self._lock:
+            self._closed = True
+            free = [shm for blocks in self._free.values() for shm in blocks]
+            self._free.clear()
+            self._free_bytes = 0
+            in_use = [self._blocks[name] for name in self._in_use]
+            for shm in free:
+                del self._blocks[shm.name]
+        for shm in free:
+            _destroy(shm)
+        for shm in in_use:
+            _unlink(shm)
+
+    def __enter__(self) -> "SharedMemoryPool":
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb) -> None:
+        self.close()
+
+
+def encode(
+    data: Args,
+    attachments: Optional[List[Any]] = None,
+    allocations: Optional[List[SharedMemory]] = None,
+    use_pickle: bool = False,
+    shared: Optional[Set[str]] = None,
+) -> str:
+    """
+    Encode the given data to a string of JSON.
+
+    NumPy scalars are encoded as the equivalent Python numbers. NumPy arrays
+    wrapping the memory of an NDArray (see `NDArray.ndarray()`) are encoded
+    as that NDArray, without copying any data.
+
+    :param data: The data to encode.
+    :param attachments: Optional list to receive raw byte payloads.
+                        If given, bytes-like values are appended to it
+                        and encoded as references, rather than failing.
+    :param allocations: Optional list to receive newly created shared memory.
+                        If given, other NumPy arrays are copied into new
+                        shared memory blocks, which are appended to it, and
+                        encoded as NDArrays. When a worker sends them,
+                        their ownership passes to the receiving service:
+                        disposing of them there destroys their memory.
+    :param use_pickle: Whether to pickle values JSON cannot represent, rather
+                       than failing. Only Python peers can decode the result.
+                       Pickle protocol 5 is used, with large buffers (e.g. of
+                       NumPy arrays) placed in new shared memory blocks if
+                       the allocations list is given.
+    :param shared: Optional set to receive the names of all shared memory
+                   blocks referenced by the encoded data.
+    """
+    encoder = _ApposeJSONEncoder(attachments, allocations, use_pickle, shared)
+    codec = get_codec()
+    if codec.name == "json":
+        return codec.dumps(data, encoder.default)
+
+    attachment_count = 0 if attachments is None else len(attachments)
+    allocation_count = 0 if allocations is None else len(allocations)
+    try:
+        return codec.dumps(data, encoder.default)
+    except Exception:
+        # The codec may reject data the standard library accepts, e.g.
+        # integers beyond 64 bits. Undo what the attempt did, then retry.
+        if attachments is not None:
+            del attachments[attachment_count:]
+        if allocations is not None:
+            for shm in allocations[allocation_count:]:
+                _destroy(shm)
+            del allocations[allocation_count:]
+    return _codecs["json"]().dumps(data, encoder.default)
+
+
+def decode(
+    the_json: str,
+    attachments: Optional[Sequence[bytes]] = None,
+    attach: Optional[Callable[[str, int], SharedMemory]] = None,
+) -> Args:
+    """
+    Decode the given string of JSON.
+
+    :param the_json: The JSON to decode.
+    :param attachments: Raw byte payloads referenced by the JSON, if any.
+    :param attach: Optional function providing the SharedMemory for a
+                   referenced shared memory block, given its name and size.
+                   By default, each reference gets its own SharedMemory.
+    """
+    # Fast path: without any Appose types, no object needs converting.
+    hook = (
+        partial(_appose_object_hook, attachments=attachments, attach=attach)
+        if "appose_type" in the_json
+        else None
+    )
+    codec = get_codec()
+    try:
+        return codec.loads(the_json, hook)
+    except ValueError:
+        if codec.name == "json":
+            raise
+    # The codec may reject JSON the standard library accepts, e.g. NaN.
+    return _codecs["json"]().loads(the_json, hook)
+
+
+class Codec:
+    """
+    A JSON backend, which encode() and decode() use to convert between
+    Python objects and strings of JSON.
+
+    Codecs only deal with plain JSON values; Appose converts its own types
+    (shared memory, NDArrays, bytes attachments, pickles) via the callbacks
+    it passes along.
+    """
+
+    # The name under which the codec is registered.
+    name: str = ""
+
+    def dumps(self, data: Any, default: Callable[[Any], Any]) -> str:
+        """
+        Encode the given data to a compact string of JSON.
+
+        :param data: The data to encode.
+        :param default: Function converting any object the codec cannot
+                        encode itself to one it can, or raising TypeError.
+        """
+        raise NotImplementedError()
+
+    def loads(
+        self, the_json: str, object_hook: Optional[Callable[[Dict], Any]] = None
+    ) -> Any:
+        """
+        Decode the given string of JSON.
+
+        :param the_json: The JSON to decode.
+        :param object_hook: Optional function to replace each decoded object,
+                            innermost objects first, by its return value.
+        """
+        raise NotImplementedError()
+
+
+class JsonCodec(Codec):
+    """
+    The codec of Python's standard json module, always available.
+    """
+
+    name = "json"
+
+    def dumps(self, data: Any, default: Callable[[Any], Any]) -> str:
+        return json.dumps(data, separators=(",", ":"), default=default)
+
+    def loads(
+        self, the_json: str, object_hook: Optional[Callable[[Dict], Any]] = None
+    ) -> Any:
+        return json.loads(the_json, object_hook=object_hook)
 
 
-def decode(the_json: str) -> Args:
-    return json.loads(the_json, object_hook=_appose_object_hook)
+class OrjsonCodec(Codec):
+    """
+    The codec of the orjson package, which is several times faster.
+
+    Unlike the standard library, orjson does not escape non-ASCII characters.
+    Data orjson cannot encode or decode faithfully, such as integers beyond
+    64 bits or non-finite floats (which orjson would turn into null), falls
+    back to the standard library.
+    """
+
+    name = "orjson"
+
+    def __init__(self) -> None:
+        import orjson
+
+        self._orjson = orjson
+        # NB: Pass dataclasses and datetimes to the default function, rather
+        # than encoding them natively, for the same results as the json codec.
+        self._options = (
+            orjson.OPT_NON_STR_KEYS
+            | orjson.OPT_PASSTHROUGH_DATACLASS
+            | orjson.OPT_PASSTHROUGH_DATETIME
+        )
+
+    def dumps(self, data: Any, default: Callable[[Any], Any]) -> str:
+        text = self._orjson.dumps(data, default=default, option=self._options)
+        # NB: orjson silently encodes NaN and infinities as null. Only scan
+        # for them when the output has a null which might stand for one.
+        if b"null" in text and _has_nonfinite(data):
+            raise ValueError("Non-finite floats are not supported by orjson")
+        return text.decode("utf-8")
+
+    def loads(
+        self, the_json: str, object_hook: Optional[Callable[[Dict], Any]] = None
+    ) -> Any:
+        data = self._orjson.loads(the_json)
+        return data if object_hook is None else _apply_hook(data, object_hook)
+
+
+def _has_nonfinite(data: Any) -> bool:
+    """
+    Check whether the given data contains NaN or infinite floats.
+    """
+    if isinstance(data, float):
+        return not isfinite(data)
+    if isinstance(data, dict):
+        return any(_has_nonfinite(value) for value in data.values())
+    if isinstance(data, (list, tuple)):
+        return any(_has_nonfinite(value) for value in data)
+    np = sys.modules.get("numpy")
+    if np is not None and isinstance(data, np.floating):
+        return not np.isfinite(data)
+    return False
+
+
+def register_codec(codec_class: Callable[[], Codec], name: str) -> None:
+    """
+    Make a codec available under the given name. It is only instantiated
+    when first selected; if that raises ImportError, it is unavailable.
+
+    :param codec_class: The codec class, or another function creating the codec.
+    :param name: The name of the codec, for use with set_codec().
+    """
+    _codecs[name] = codec_class
+
+
+def set_codec(name: Optional[str]) -> Codec:
+    """
+    Select the codec encode() and decode() use, within this process.
+
+    :param name: The name of a registered codec, or None to select
+                 the fastest available one again.
+    :raises ValueError: If no such codec is registered, or it is unavailable.
+    :return: The selected codec.
+    """
+    global _codec
+    if name is None:
+        _codec = None
+        return get_codec()
+    factory = _codecs.get(name)
+    if factory is None:
+        raise ValueError(f"No such codec: {name}")
+    try:
+        _codec = factory()
+    except ImportError as e:
+        raise ValueError(f"Codec {name} is unavailable: {e}")
+    return _codec
+
+
+def get_codec() -> Codec:
+    """
+    Get the codec encode() and decode() use. Unless selected via set_codec(),
+    it is the one named by the APPOSE_CODEC environment variable if set,
+    or else the fastest one available.
+    """
+    global _codec
+    if _codec is None:
+        preferred = os.environ.get("APPOSE_CODEC")
+        for name in [preferred] if preferred else _CODEC_PREFERENCE:
+            factory = _codecs.get(name)
+            if factory is None:
+                continue
+            try:
+                _codec = factory()
+                break
+            except ImportError:
+                continue
+        else:
+            _codec = JsonCodec()
+    return _codec
 
 
 class NDArray:
@@ -134,23 +579,33 @@ class NDArray:
     a particular shape, and flattened into SharedMemory.
     """
 
-    def __init__(self, dtype: str, shape: Sequence[int], shm: SharedMemory = None):
+    def __init__(
+        self,
+        dtype: str,
+        shape: Sequence[int],
+        shm: SharedMemory = None,
+        pool: Optional[SharedMemoryPool] = None,
+    ):
         """
         Create an NDArray.
         :param dtype: The type of the data elements; e.g. int8, uint8, float32, float64.
         :param shape: The dimensional extents; e.g. a stack of 7 image planes
                       with resolution 512x512 would have shape [7, 512, 512].
         :param shm: The SharedMemory containing the array data, or None to create it.
+        :param pool: The pool from which to acquire the SharedMemory, if it is
+                     to be created; disposing of the array then gives it back.
         """
         self.dtype = dtype
         self.shape = shape
-        self.shm = (
-            SharedMemory(
-                create=True, size=ceil(prod(shape) * _bytes_per_element(dtype))
+        if shm is None:
+            # NB: Shared memory cannot be empty, even for an empty array.
+            size = max(1, ceil(prod(shape) * _bytes_per_element(dtype)))
+            shm = (
+                SharedMemory(create=True, size=size)
+                if pool is None
+                else pool.acquire(size)
             )
-            if shm is None
-            else shm
-        )
+        self.shm = shm
 
     def __str__(self):
         return (
@@ -182,14 +637,47 @@ class NDArray:
         self.shm.dispose()
 
 
-class _ApposeJSONEncoder(json.JSONEncoder):
+class _ApposeJSONEncoder:
+    def __init__(
+        self,
+        attachments: Optional[List[Any]] = None,
+        allocations: Optional[List[SharedMemory]] = None,
+        use_pickle: bool = False,
+        shared: Optional[Set[str]] = None,
+    ):
+        self._attachments = attachments
+        self._allocations = allocations
+        self._use_pickle = use_pickle
+        self._shared = shared
+
     def default(self, obj):
+        if self._attachments is not None and isinstance(
+            obj, (bytes, bytearray, memoryview)
+        ):
+            self._attachments.append(obj)
+            return {"appose_type": "bytes", "index": len(self._attachments) - 1}
+        # NB: If NumPy was never imported, obj cannot be a NumPy object.
+        numpy = sys.modules.get("numpy")
+        if numpy is not None:
+            if isinstance(obj, numpy.generic):
+                return obj.item()
+            if isinstance(obj, numpy.ndarray):
+                ndarray = _shared_ndarray(obj)
+                if ndarray is None and self._allocations is not None:
+                    ndarray = _stage_ndarray(obj, self._allocations)
+                if ndarray is not None:
+                    return ndarray
         if isinstance(obj, SharedMemory):
-            return {
+            if self._shared is not None:
+                self._shared.add(obj.name)
+            encoded = {
                 "appose_type": "shm",
                 "name": obj.name,
                 "size": obj.size,
             }
+            if getattr(obj, "_transfer", False):
+                encoded["transfer"] = True
+            return encoded
         if isinstance(obj, NDArray):
             return {
                 "appose_type": "ndarray",
@@ -197,20 +685,180 @@ class _ApposeJSONEncoder(json.JSONEncoder):
                 "shape": obj.shape,
                 "shm": obj.shm,
             }
-        return super().default(obj)
-
-
-def _appose_object_hook(obj: Dict):
+        if self._use_pickle:
+            return self._pickle(obj)
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+    def _pickle(self, obj) -> Args:
+        # NB: Imported here, as only peers which negotiated pickling need it.
+        import base64
+        import pickle
+
+        buffers: List[pickle.PickleBuffer] = []
+
+        def out_of_band(buffer: pickle.PickleBuffer) -> bool:
+            # NB: Returning True serializes the buffer in-band after all.
+            if (
+                self._allocations is None
+                or buffer.raw().nbytes < _PICKLE_BUFFER_THRESHOLD
+            ):
+                return True
+            buffers.append(buffer)
+            return False
+
+        data = pickle.dumps(obj, protocol=5, buffer_callback=out_of_band)
+        blocks = []
+        for buffer in buffers:
+            raw = buffer.raw()
+            shm = SharedMemory(create=True, size=raw.nbytes)
+            shm._transfer = _is_worker
+            self._allocations.append(shm)
+            shm.buf[: raw.nbytes] = raw
+            blocks.append({"shm": shm, "nbytes": raw.nbytes})
+        return {
+            "appose_type": "pickle",
+            "data": (
+                data
+                if self._attachments is not None
+                else base64.b64encode(data).decode("ascii")
+            ),
+            "buffers": blocks,
+        }
+
+
+def _appose_object_hook(
+    obj: Dict,
+    attachments: Optional[Sequence[bytes]] = None,
+    attach: Optional[Callable[[str, int], SharedMemory]] = None,
+):
     atype = obj.get("appose_type")
-    if atype == "shm":
-        # Attach to existing shared memory block.
-        return SharedMemory(name=(obj["name"]), size=(obj["size"]))
+    if atype == "bytes" and attachments is not None:
+        return attachments[obj["index"]]
+    elif atype == "shm":
+        if attach is not None:
+            return attach(obj["name"], obj["size"])
+        # Refer to existing shared memory block, attaching upon first use.
+        shm = _LazySharedMemory(name=(obj["name"]), size=(obj["size"]))
+        if obj.get("transfer"):
+            # The sender handed the block over to us.
+            shm.unlink_on_dispose(True)
+        return shm
     elif atype == "ndarray":
         return NDArray(obj["dtype"], obj["shape"], obj["shm"])
+    elif atype == "pickle":
+        import pickle
+
+        data = obj["data"]
+        if isinstance(data, str):
+            import base64
+
+            data = base64.b64decode(data)
+        buffers = [
+            memoryview(_detach(block["shm"]))[: block["nbytes"]]
+            for block in obj["buffers"]
+        ]
+        return pickle.loads(data, buffers=buffers)
     else:
         return obj
 
 
+def _detach(shm: SharedMemory) -> mmap.mmap:
+    """
+    Take over the memory map of the given shared memory block, closing the
+    block otherwise. The memory stays mapped for as long as the map, or any
+    object unpickled on top of it, is referenced.
+    """
+    if isinstance(shm, _LazySharedMemory):
+        if shm._shared:
+            # Others use the block too; map it separately.
+            shm = _LazySharedMemory(name=shm.name, size=shm._lazy_size)
+        shm._attach()
+    if shm._unlink_on_dispose:
+        # The block was handed over to us. Now that it is mapped, its
+        # name is no longer needed: destroy it once unreferenced.
+        _unlink(shm)
+    buf, memory = shm._buf, shm._mmap
+    shm._buf = shm._mmap = None
+    buf.release()
+    if getattr(shm, "_fd", -1) >= 0:
+        os.close(shm._fd)
+        shm._fd = -1
+    return memory
+
+
+def _apply_hook(data: Any, object_hook: Callable[[Dict], Any]) -> Any:
+    """
+    Replace each dict in the given data by the result of the given hook,
+    innermost first, the way json.loads does with its object_hook.
+    """
+    if isinstance(data, dict):
+        for key, value in data.items():
+            if isinstance(value, (dict, list)):
+                data[key] = _apply_hook(value, object_hook)
+        return object_hook(data)
+    if isinstance(data, list):
+        for i, value in enumerate(data):
+            if isinstance(value, (dict, list)):
+                data[i] = _apply_hook(value, object_hook)
+    return data
+
+
+def _shared_ndarray(array) -> Optional[NDArray]:
+    """
+    Get an NDArray sharing the memory of the given NumPy array, if the
+    array spans a shared memory block from its start, contiguously.
+    """
+    if not array.flags.c_contiguous:
+        return None
+    # Find the array created directly on top of the memory map.
+    root = array
+    while type(root.base) is type(array):
+        root = root.base
+    shm = _buffers.get(id(root.base))
+    if shm is None or shm._mmap is not root.base:
+        return None
+    if array.ctypes.data != root.ctypes.data:
+        return None
+    if array.dtype.kind not in _NDARRAY_KINDS or not array.dtype.isnative:
+        return None
+    return NDArray(array.dtype.name, list(array.shape), shm)
+
+
+def _stage_ndarray(array, allocations: List[SharedMemory]) -> NDArray:
+    """
+    Copy the given NumPy array into a new NDArray, recording its
+    shared memory block in the given list.
+    """
+    if array.dtype.kind not in _NDARRAY_KINDS or not array.dtype.isnative:
+        raise TypeError(f"Unsupported NumPy dtype: {array.dtype}")
+    ndarray = NDArray(array.dtype.name, list(array.shape))
+    # The service always cleans up, so blocks of workers are handed over.
+    ndarray.shm._transfer = _is_worker
+    allocations.append(ndarray.shm)
+    ndarray.ndarray()[...] = array
+    return ndarray
+
+
+def _unlink(shm: SharedMemory) -> None:
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def _close(shm: SharedMemory) -> None:
+    try:
+        shm.close()
+    except BufferError:
+        # Still exported, e.g. by a NumPy array; unmapped once collected.
+        pass
+
+
+def _destroy(shm: SharedMemory) -> None:
+    _unlink(shm)
+    _close(shm)
+
+
 def _bytes_per_element(dtype: str) -> Union[int, float]:
     try:
         bits = int(re.sub("[^0-9]", "", dtype))
@@ -219,6 +867,46 @@ def _bytes_per_element(dtype: str) -> Union[int, float]:
     return bits / 8
 
 
+# Available codecs, by name, and which to select by default, fastest first.
+_codecs: Dict[str, Callable[[], Codec]] = {
+    "json": JsonCodec,
+    "orjson": OrjsonCodec,
+}
+_CODEC_PREFERENCE = ["orjson", "json"]
+_codec: Optional[Codec] = None
+
+# Buffers smaller than this many bytes are pickled in-band.
+_PICKLE_BUFFER_THRESHOLD = 1 << 16
+
+# NumPy dtype kinds which NDArray supports: integers, floats and complexes.
+_NDARRAY_KINDS = "iufc"
+
+# Weak references to methods called with the name of each unlinked block.
+_unlink_listeners: List[weakref.WeakMethod] = []
+
+# Names of the shared memory blocks registered with this process's resource
+# tracker, so that unlinking a block it never attached to can unregister it.
+_registered: Set[str] = set()
+
+
+def _add_unlink_listener(method: Callable[[str], None]) -> None:
+    _unlink_listeners.append(weakref.WeakMethod(method))
+
+
+def _notify_unlinked(name: str) -> None:
+    for listener in list(_unlink_listeners):
+        method = listener()
+        if method is not None:
+            method(name)
+        elif listener in _unlink_listeners:
+            _unlink_listeners.remove(listener)
+
+
+# Open shared memory blocks, by the identity of their memory map.
+_buffers: "weakref.WeakValueDictionary[int, SharedMemory]" = (
+    weakref.WeakValueDictionary()
+)
+
 _is_worker = False
 
 
@@ -0,0 +1,119 @@
+###
+# #%L
+# Appose: multi-language interprocess cooperation with shared memory.
+# %%
+# Copyright (C) 2023 - 2024 Appose developers.
+# %%
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDERS OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+# #L%
+###
+
+import asyncio
+
+from test_appose import collatz_python
+
+import appose
+from appose.aio import AsyncService
+from appose.framing import Framing
+from appose.service import ResponseType, TaskStatus
+
+
+def test_await_task():
+    async def run():
+        env = appose.system()
+        async with env.python(service_class=AsyncService) as service:
+            task = service.task("task.outputs['result'] = x * 2", {"x": 21})
+            await task
+            assert TaskStatus.COMPLETE == task.status
+            assert 42 == task.outputs["result"]
+
+    asyncio.run(run())
+
+
+def test_gather_tasks():
+    async def run():
+        env = appose.system()
+        service = env.python(framing=Framing.BINARY, service_class=AsyncService)
+        async with service:
+            tasks = [service.task("x * x", {"x": x}) for x in range(20)]
+            done = await asyncio.gather(*tasks)
+            assert [x * x for x in range(20)] == [t.outputs["result"] for t in done]
+
+    asyncio.run(run())
+
+
+def test_task_events():
+    async def run():
+        env = appose.system()
+        async with env.python(service_class=AsyncService) as service:
+            task = service.task(collatz_python)
+            events = [event.response_type async for event in task.events()]
+            assert ResponseType.LAUNCH == events[0]
+            assert 91 == events.count(ResponseType.UPDATE)
+            assert ResponseType.COMPLETION == events[-1]
+            assert 91 == task.outputs["result"]
+
+    asyncio.run(run())
+
+
+def test_map_and_session():
+    async def run():
+        env = appose.system()
+        async with env.python(service_class=AsyncService) as service:
+            results = service.map("x + 1", [{"x": x} for x in range(10)], 3)
+            assert [{"result": x + 1} for x in range(10)] == [r async for r in results]
+
+            await service.task("total = 5", session="s")
+            task = await service.task("total * 2", session="s")
+            assert 10 == task.outputs["result"]
+            info = await service.session_info("s")
+            assert 1 == info.outputs["variables"]
+
+    asyncio.run(run())
+
+
+def test_stream():
+    async def run():
+        env = appose.system()
+        async with env.python(service_class=AsyncService) as service:
+            task = service.task("for i in range(50):\n    task.emit({'i': i})\n")
+            items = [item async for item in task.stream(window=4)]
+            assert [{"i": i} for i in range(50)] == items
+            assert TaskStatus.COMPLETE == task.status
+
+    asyncio.run(run())
+
+
+def test_start_wait():
+    async def run():
+        env = appose.system()
+        service = env.python(
+            framing=Framing.BINARY, service_class=AsyncService, preload=["decimal"]
+        )
+        async with service:
+            await service.start(wait=True, timeout=30)
+            assert ["decimal"] == service.capabilities["preloaded"]
+            assert "ready" in service.timings
+            task = await service.task("6 * 7")
+            assert 42 == task.outputs["result"]
+
+    asyncio.run(run())
@@ -27,7 +27,18 @@
 # #L%
 ###
 
+import os
+import subprocess
+import sys
+from threading import Barrier, Event, Lock
+from time import sleep
+from types import SimpleNamespace
+
+import pytest
+
 import appose
+from appose.framing import Framing
+from appose.python_worker import _Executor
 from appose.service import ResponseType, Service, TaskStatus
 
 collatz_groovy = """
@@ -77,6 +88,20 @@ def test_python():
         execute_and_assert(service, collatz_python)
 
 
+def test_python_binary_framing():
+    env = appose.system()
+    with env.python(framing=Framing.BINARY) as service:
+        execute_and_assert(service, collatz_python)
+
+        # Bytes values travel as raw attachments in both directions.
+        task = service.task(
+            "task.outputs['data'] = data[::-1]", {"data": b"\x00\n\xff"}
+        )
+        task.wait_for()
+        assert TaskStatus.COMPLETE == task.status
+        assert b"\xff\n\x00" == task.outputs["data"]
+
+
 def test_service_startup_failure():
     env = appose.base("no-java-to-be-found-here").build()
     try:
@@ -155,3 +180,485 @@ def execute_and_assert(service: Service, script: str):
     assert 90 == completion.current
     assert 1 == completion.maximum
     assert completion.error is None
+
+
+def test_python_pool():
+    env = appose.system()
+    with env.python_pool(size=3) as pool:
+        tasks = [pool.task("import os; os.getpid()") for _ in range(9)]
+        for task in tasks:
+            task.wait_for()
+            assert TaskStatus.COMPLETE == task.status
+        # Tasks were spread evenly across the workers.
+        assert 3 == len({task.outputs["result"] for task in tasks})
+        assert {3} == {sum(task.service is s for task in tasks) for s in pool.services}
+
+
+def test_map():
+    env = appose.system()
+    with env.python() as service:
+        results = service.map("x * x", ({"x": x} for x in range(250)), batch_size=32)
+        assert [{"result": x * x} for x in range(250)] == list(results)
+
+        failing = service.map("1 / x", [{"x": 1}, {"x": 0}])
+        try:
+            list(failing)
+            raise AssertionError("Batch with failing item succeeded!?")
+        except RuntimeError as e:
+            assert "Batch item 1" in str(e)
+            assert "ZeroDivisionError" in str(e)
+
+
+def test_update_interval():
+    env = appose.system()
+    with env.python(update_interval=60) as service:
+        task = service.task(collatz_python)
+        updates = []
+        task.listen(
+            lambda e: e.response_type == ResponseType.UPDATE
+            and updates.append((e.task.message, e.task.current))
+        )
+        task.wait_for()
+        assert TaskStatus.COMPLETE == task.status
+        assert 91 == task.outputs["result"]
+
+        # The first update goes out right away; the rest are coalesced
+        # into one final update, sent just before the completion.
+        assert [("[0] -> 29998", 0), ("[90] -> 1", 90)] == updates
+
+
+def test_prepare():
+    env = appose.system()
+    with env.python() as service:
+        script = service.prepare(sqrt_import)
+        for age in (4, 9, 16):
+            task = service.task(script, {"age": age})
+            task.wait_for()
+            assert TaskStatus.COMPLETE == task.status
+            assert age**0.5 == task.outputs["result"]
+
+        # Prepared scripts can be mapped too.
+        results = service.map(script, [{"age": 25}, {"age": 36}])
+        assert [{"result": 5}, {"result": 6}] == list(results)
+
+
+def test_prepared_script_limit(monkeypatch):
+    monkeypatch.setattr(appose.service, "_MAX_PREPARED", 2)
+    env = appose.system()
+    with env.python() as service:
+        scripts = [
+            service.prepare(f"len(task._worker.scripts) + {i}") for i in range(3)
+        ]
+        # The worker keeps only the most recently used prepared scripts...
+        for i, script in enumerate(scripts):
+            task = service.task(script)
+            task.wait_for()
+            assert TaskStatus.COMPLETE == task.status, task.error
+            assert min(i + 1, 2) + i == task.outputs["result"]
+        # ...and is sent those it discarded again when they are reused.
+        task = service.task(scripts[0])
+        task.wait_for()
+        assert TaskStatus.COMPLETE == task.status, task.error
+        assert 2 == task.outputs["result"]
+
+
+def test_session():
+    env = appose.system()
+    with env.python() as service:
+        # Variables defined by a session's tasks persist across them.
+        service.task("cache = [1, 2, 3]", session="s").wait_for()
+        task = service.task("sum(cache) + x", {"x": 4}, session="s")
+        task.wait_for()
+        assert TaskStatus.COMPLETE == task.status
+        assert 10 == task.outputs["result"]
+
+        # But not beyond their session.
+        task = service.task("'cache' in dir()")
+        task.wait_for()
+        assert task.outputs["result"] is False
+
+        info = service.session_info("s")
+        info.wait_for()
+        assert info.outputs["exists"] is True
+        assert 2 == info.outputs["variables"]  # cache and x
+        assert info.outputs["size"] > 0
+
+        service.reset_session("s").wait_for()
+        task = service.task("'cache' in dir()", session="s")
+        task.wait_for()
+        assert task.outputs["result"] is False
+
+
+def test_session_concurrency():
+    env = appose.system()
+    with env.python() as service:
+        # Tasks of a session run one at a time, each with its own task and inputs.
+        script = """
+import time
+time.sleep(0.05)
+task.outputs["mine"] = x
+x * 2
+"""
+        tasks = [service.task(script, {"x": i}, session="s").start() for i in range(8)]
+        for i, task in enumerate(tasks):
+            task.wait_for()
+            assert TaskStatus.COMPLETE == task.status
+            assert i == task.outputs["mine"]
+            assert 2 * i == task.outputs["result"]
+
+
+def test_session_scheduling():
+    env = appose.system()
+    with env.python(max_threads=2) as service:
+        sleeper = "import time\ntime.sleep(0.5)"
+        first = service.task(sleeper, session="s").start()
+        second = service.task(sleeper, session="s").start()
+        other = service.task("1").start()
+
+        # A session waiting on its previous task does not hold up other tasks,
+        # and its next task is not reported running before it actually runs.
+        other.wait_for()
+        assert TaskStatus.COMPLETE == other.status
+        assert not first.status.is_finished()
+        assert TaskStatus.QUEUED == second.status
+
+        first.wait_for()
+        second.wait_for()
+        assert TaskStatus.COMPLETE == second.status
+        assert second.timings["launched"] >= first.timings["finished"]
+
+        # Canceling a waiting task of a session does not hold up the next one.
+        first = service.task(sleeper, session="s").start()
+        second = service.task(sleeper, session="s").start()
+        third = service.task("2", session="s").start()
+        second.cancel()
+        third.wait_for()
+        assert TaskStatus.CANCELED == second.status
+        assert TaskStatus.COMPLETE == third.status
+        assert 2 == third.outputs["result"]
+
+
+blocker = """
+import time
+while not task.cancel_requested:
+    time.sleep(0.01)
+task.cancel()
+"""
+
+
+def test_queued_priority():
+    env = appose.system()
+    with env.python(max_threads=1) as service:
+        launched = []
+
+        def launch_recorder(name):
+            def record(event):
+                if event.response_type == ResponseType.LAUNCH:
+                    launched.append(name)
+
+            return record
+
+        first = service.task(blocker)
+        first.listen(launch_recorder("first"))
+        first.start()
+        while first.status != TaskStatus.RUNNING:
+            sleep(0.01)
+        tasks = {}
+        for name, priority in (("low", 0), ("doomed", 1), ("high", 5)):
+            tasks[name] = service.task("1", priority=priority)
+            tasks[name].listen(launch_recorder(name))
+            tasks[name].start()
+
+        # A queued task can be canceled without ever launching.
+        tasks["doomed"].cancel()
+        tasks["doomed"].wait_for()
+        assert TaskStatus.CANCELED == tasks["doomed"].status
+        assert TaskStatus.QUEUED == tasks["low"].status
+        assert TaskStatus.QUEUED == tasks["high"].status
+
+        first.cancel()
+        for task in (first, tasks["low"], tasks["high"]):
+            task.wait_for()
+        assert ["first", "high", "low"] == launched
+
+
+def test_pool_reroute():
+    env = appose.system()
+    with env.python_pool(size=2, max_threads=1) as pool:
+        crasher = pool.task("import os, time; time.sleep(0.5); os._exit(1)").start()
+        other = pool.task("2").start()
+        queued = pool.task("3").start()
+        assert crasher.service is queued.service
+        for task in (crasher, other, queued):
+            task.wait_for()
+        assert TaskStatus.CRASHED == crasher.status
+        assert TaskStatus.COMPLETE == queued.status
+        assert 3 == queued.outputs["result"]
+        assert crasher.service is not queued.service
+
+
+def test_thread_death():
+    env = appose.system()
+    with env.python(max_threads=1) as service:
+        task = service.task("import sys; sys.exit(0)")
+        task.wait_for()
+        assert TaskStatus.FAILED == task.status
+        assert "thread death" == task.error
+
+        # The worker thread survives, and keeps executing tasks.
+        task = service.task("7")
+        task.wait_for()
+        assert 7 == task.outputs["result"]
+
+
+def test_executor_growth():
+    # Tasks submitted back to back while a single thread is idle
+    # must not queue behind one another, while below max_threads.
+    executor = _Executor(4, lambda task: None)
+    try:
+        warmup = Event()
+        executor.submit(_stub_task(), warmup.set)
+        assert warmup.wait(5)
+        while executor._idle < 1:
+            sleep(0.01)
+
+        barrier = Barrier(2, timeout=5)
+        passed = []
+
+        def meet():
+            barrier.wait()
+            passed.append(True)
+
+        for _ in range(2):
+            executor.submit(_stub_task(), meet)
+        # NB: The barrier breaks after its timeout, unless both tasks run at once.
+        while len(passed) < 2 and not barrier.broken:
+            sleep(0.01)
+        assert 2 == len(passed)
+    finally:
+        executor.shutdown()
+
+
+def _stub_task():
+    return SimpleNamespace(
+        priority=0, finished=False, started=False, _launch_lock=Lock()
+    )
+
+
+def test_stream():
+    env = appose.system()
+    with env.python() as service:
+        script = "for i in range(200):\n    task.emit(i * i)\n'done'\n"
+        task = service.task(script)
+        assert [i * i for i in range(200)] == list(task.stream(window=8))
+        assert "done" == task.outputs["result"]
+
+        # Abandoning the stream early lets the script run to completion.
+        task = service.task(script)
+        for i, item in enumerate(task.stream(window=2)):
+            if i == 3:
+                break
+        task.wait_for()
+        assert TaskStatus.COMPLETE == task.status
+
+        task = service.task("task.emit(1)\nraise ValueError('boom')\n")
+        with pytest.raises(RuntimeError, match="boom"):
+            list(task.stream())
+
+
+def test_pickle():
+    from fractions import Fraction
+    from types import SimpleNamespace
+
+    import numpy
+
+    env = appose.system()
+    for framing in (Framing.TEXT, Framing.BINARY):
+        with env.python(framing=framing, pickle=True) as service:
+            # Large array buffers travel via shared memory, the rest in-band.
+            frames = SimpleNamespace(a=numpy.ones((300, 300)), b=numpy.arange(3))
+            task = service.task(
+                "from types import SimpleNamespace\n"
+                "task.outputs['frames'] = SimpleNamespace(\n"
+                "    a=frames.a * 2, b=frames.b * 2\n"
+                ")\n"
+                "half * 2\n",
+                {"frames": frames, "half": Fraction(1, 2)},
+            )
+            task.wait_for()
+            assert TaskStatus.COMPLETE == task.status, task.error
+            assert Fraction(1) == task.outputs["result"]
+            doubled = task.outputs["frames"]
+            assert 2 * 300 * 300 == doubled.a.sum()
+            assert [0, 2, 4] == doubled.b.tolist()
+            assert [] == task._staged
+
+
+def test_nonfinite_outputs():
+    env = appose.system()
+    with env.python() as service:
+        task = service.task("[float('nan'), float('inf')]")
+        task.wait_for()
+        nan, inf = task.outputs["result"]
+        assert nan != nan
+        assert float("inf") == inf
+
+
+def test_timings():
+    env = appose.system()
+    with env.python() as service:
+        task = service.task("sum(range(1000))")
+        task.wait_for()
+        assert TaskStatus.COMPLETE == task.status
+        # NB: Listeners may still be running when wait_for returns.
+        while "dispatched" not in task.timings:
+            sleep(0.01)
+        stamps = [
+            "created",
+            "sent",
+            "received",
+            "launched",
+            "finished",
+            "encoding",
+            "returned",
+            "dispatched",
+        ]
+        times = [task.timings[stamp] for stamp in stamps]
+        assert times == sorted(times)
+
+
+def test_standby():
+    env = appose.system()
+    env.standby(2)
+    try:
+        # NB: Standby workers are launched with the same command line.
+        standby = next(iter(env._standby.values()))
+        idle = {p.pid for p in standby._idle}
+        assert 2 == len(idle)
+
+        with env.python() as service:
+            task = service.task("import os\nos.getpid()")
+            task.wait_for()
+            assert TaskStatus.COMPLETE == task.status
+            assert task.outputs["result"] in idle
+
+        # A replacement is launched in the background.
+        while len(standby._idle) < 2:
+            sleep(0.01)
+
+        # Services with other worker options do not adopt standby workers.
+        with env.python(max_threads=1) as service:
+            task = service.task("import os\nos.getpid()")
+            task.wait_for()
+            assert task.outputs["result"] not in {p.pid for p in standby._idle}
+    finally:
+        env.standby(0)
+    assert 0 == len(standby._idle)
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires fork")
+def test_fork():
+    env = appose.system()
+    server = env.fork_server(preload=["decimal"])
+    try:
+        # Forked workers inherit the modules preloaded by the fork server...
+        script = "import os, sys\n(os.getppid(), 'decimal' in sys.modules)"
+        with env.python(fork=True) as service:
+            task = service.task(script)
+            task.wait_for()
+            assert TaskStatus.COMPLETE == task.status
+            assert [server.pid, True] == task.outputs["result"]
+
+        # ...which a worker launched from scratch does not load.
+        with env.python() as service:
+            task = service.task(script)
+            task.wait_for()
+            assert TaskStatus.COMPLETE == task.status
+            assert task.outputs["result"][0] != server.pid
+            assert task.outputs["result"][1] is False
+
+        # The exit code of a forked worker is reported, like a regular one's.
+        service._monitor_thread.join()
+        assert 0 == service._process.returncode
+
+        with env.python(fork=True) as service:
+            task = service.task("import os\nos._exit(3)")
+            task.wait_for()
+            assert TaskStatus.CRASHED == task.status
+        assert 3 == service._process.wait()
+    finally:
+        server.close()
+
+
+def test_ready():
+    env = appose.system()
+    warmup = "import fractions\nWARM = fractions.Fraction(1, 3)"
+    with env.python(preload=["decimal"], warmup_script=warmup) as service:
+        service.start(wait=True)
+        capabilities = service.capabilities
+        assert "python" == capabilities["language"]
+        assert ["decimal"] == capabilities["preloaded"]
+        assert service._process.pid == capabilities["pid"]
+        stamps = ["launched", "started", "imported", "warmed", "ready", "returned"]
+        times = [service.timings[stamp] for stamp in stamps]
+        assert times == sorted(times)
+
+        task = service.task("import sys\n'decimal' in sys.modules")
+        task.wait_for()
+        assert task.outputs["result"] is True
+
+
+def test_ready_binary_pickle():
+    env = appose.system()
+    with env.python(framing=Framing.BINARY, pickle=True) as service:
+        service.start(wait=True)
+        assert Framing.BINARY == service._stdin_framing
+        assert service._pickle_enabled
+        task = service.task("complex(1, 2)")
+        task.wait_for()
+        assert TaskStatus.COMPLETE == task.status
+        assert complex(1, 2) == task.outputs["result"]
+
+
+def test_ready_failures():
+    env = appose.system()
+
+    # A failing warm-up is reported, but the worker keeps serving.
+    with env.python(warmup_script="raise ValueError('cold')") as service:
+        with pytest.raises(RuntimeError, match="ValueError: cold"):
+            service.start(wait=True)
+        task = service.task("1 + 1")
+        task.wait_for()
+        assert TaskStatus.COMPLETE == task.status
+
+    # A worker exiting during warm-up never becomes ready.
+    service = env.python(warmup_script="import os\nos._exit(2)")
+    with pytest.raises(RuntimeError, match="terminated before being ready"):
+        service.start(wait=True)
+
+    # A slow warm-up exceeds the timeout.
+    with env.python(warmup_script="import time\ntime.sleep(5)") as service:
+        with pytest.raises(TimeoutError):
+            service.start(wait=True, timeout=0.2)
+
+    # Other workers never report being ready, so waiting is refused.
+    service = Service(".", ["java", "-version"])
+    with pytest.raises(RuntimeError, match="Only Python workers"):
+        service.start(wait=True)
+    assert service._process is None
+
+
+def test_worker_imports():
+    # The worker loads only what its protocol loop needs, not the service side.
+    script = "import sys, appose.python_worker; print(sorted(sys.modules))"
+    output = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, text=True, check=True
+    ).stdout
+    for module in ("appose.environment", "appose.service", "http.server", "uuid"):
+        assert repr(module) not in output
+
+    # The package's classes are still importable from it, on first access.
+    assert appose.Builder is appose.environment.Builder
+    assert "SharedMemoryPool" in dir(appose)
+    with pytest.raises(AttributeError):
+        appose.nonexistent
@@ -0,0 +1,117 @@
+###
+# #%L
+# Appose: multi-language interprocess cooperation with shared memory.
+# %%
+# Copyright (C) 2023 - 2024 Appose developers.
+# %%
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDERS OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+# #L%
+###
+
+from time import sleep
+from urllib.request import urlopen
+
+import appose
+from appose.metrics import Histogram, ServiceMetrics, prometheus, serve
+from appose.pool import ServicePool
+from appose.service import TaskStatus
+
+updates_python = """
+for i in range(5):
+    task.update(current=i)
+task.outputs["result"] = i
+"""
+
+
+def test_histogram():
+    histogram = Histogram((1.0, 2.0))
+    for value in (0.5, 1.0, 1.5, 3.0):
+        histogram.observe(value)
+    snapshot = histogram.snapshot()
+    assert 4 == snapshot["count"]
+    assert 6.0 == snapshot["sum"]
+    assert [(1.0, 2), (2.0, 3)] == snapshot["buckets"]
+
+
+def test_service_metrics():
+    env = appose.system()
+    with env.python() as service:
+        service.task(updates_python).wait_for()
+        service.task("raise ValueError('oops')").wait_for()
+        snapshot = _settled(service.metrics)
+
+    tasks = snapshot["tasks"]
+    assert 2 == tasks["started"]
+    assert 1 == tasks["completed"]
+    assert 1 == tasks["failed"]
+    assert 0 == tasks["in_flight"]
+    assert 5 == snapshot["updates"]
+    assert snapshot["bytes_written"] > 0
+    assert snapshot["bytes_read"] > 0
+    assert 2 == snapshot["latency_seconds"]["count"]
+    assert 2 == snapshot["execution_seconds"]["count"]
+
+
+def test_prometheus():
+    env = appose.system()
+    with env.python() as service:
+        task = service.task("1 + 1")
+        task.wait_for()
+        assert TaskStatus.COMPLETE == task.status
+        _settled(service.metrics)
+        with serve(service) as server:
+            url = f"http://127.0.0.1:{server.port}/metrics"
+            with urlopen(url) as response:
+                text = response.read().decode("utf-8")
+
+    label = f'service="{service._service_id}"'
+    assert f"appose_tasks_started_total{{{label}}} 1" in text
+    assert f'appose_tasks_finished_total{{{label},outcome="completed"}} 1' in text
+    assert f'appose_task_latency_seconds_bucket{{{label},le="+Inf"}} 1' in text
+    assert "# TYPE appose_tasks_in_flight gauge" in text
+
+
+def test_pool_metrics():
+    env = appose.system()
+    with ServicePool(env.python, 2) as pool:
+        tasks = [pool.task("1 + 1") for _ in range(4)]
+        for task in tasks:
+            task.wait_for()
+        for service in pool.services:
+            _settled(service.metrics)
+        snapshot = pool.metrics.snapshot()
+        text = prometheus({str(i): s.metrics for i, s in enumerate(pool.services)})
+
+    assert 4 == snapshot["tasks"]["started"]
+    assert 4 == snapshot["tasks"]["completed"]
+    assert 'service="0"' in text and 'service="1"' in text
+
+
+def _settled(metrics: ServiceMetrics):
+    """
+    Wait for the metrics to count every started task as finished.
+    """
+    # NB: Tasks are counted as finished after their listeners have run,
+    # which may happen after wait_for returns.
+    while metrics.in_flight > 0:
+        sleep(0.01)
+    return metrics.snapshot()
@@ -27,6 +27,10 @@
 # #L%
 ###
 
+from threading import Thread
+
+import pytest
+
 import appose
 from appose.service import TaskStatus
 
@@ -58,3 +62,201 @@ def test_ndarray():
             assert "uint16" == task.outputs["dtype"]
             assert [2, 20, 25] == task.outputs["shape"]
             assert 123 + 78 + 210 == task.outputs["sum"]
+
+
+def test_shm_pool():
+    with appose.SharedMemoryPool(max_free_bytes=8192) as pool:
+        assert 4096 == pool.size_class(1)
+        assert 8192 == pool.size_class(4097)
+
+        # Disposed blocks are reused for allocations of the same size class.
+        with appose.NDArray("uint8", [3000], pool=pool) as a:
+            name = a.shm.name
+        with appose.NDArray("uint16", [1500], pool=pool) as b:
+            assert name == b.shm.name
+            with appose.NDArray("uint8", [3000], pool=pool) as c:
+                assert name != c.shm.name
+            b.shm.dispose()  # Giving a block back twice is harmless.
+
+        # Idle blocks beyond the limit are destroyed.
+        blocks = [pool.acquire(4096) for _ in range(3)]
+        for shm in blocks:
+            shm.dispose()
+        assert 8192 == pool._free_bytes
+        assert 2 == len(pool._blocks)
+    assert 0 == len(pool._blocks)
+
+
+def test_service_shm_pool():
+    env = appose.system()
+    with env.python() as service:
+        for value in range(3):
+            with appose.NDArray("uint8", [100], pool=service.shm_pool) as data:
+                data.shm.buf[:100] = bytes([value]) * 100
+                task = service.task(ndarray_inspect, {"data": data})
+                task.wait_for()
+                assert TaskStatus.COMPLETE == task.status
+                assert 4096 == task.outputs["size"]
+                assert 100 * value == task.outputs["sum"]
+        assert 1 == len(service.shm_pool._blocks)
+        pool = service.shm_pool
+    service._monitor_thread.join()
+    assert 0 == len(pool._blocks)
+
+
+def test_numpy_outputs():
+    env = appose.system()
+    with env.python() as service:
+        script = (
+            "import numpy\n"
+            "task.outputs['mean'] = numpy.float32(2.5)\n"
+            "task.outputs['grid'] = numpy.arange(12, dtype='int16').reshape(3, 4)\n"
+            "view = data.ndarray()\n"
+            "view += 1\n"
+            "task.outputs['view'] = view\n"
+        )
+        with appose.NDArray("uint8", [4]) as data:
+            data.ndarray()[:] = [1, 2, 3, 4]
+            task = service.task(script, {"data": data})
+            task.wait_for()
+            assert TaskStatus.COMPLETE == task.status, task.error
+            assert 2.5 == task.outputs["mean"]
+
+            # Arrays are copied into shared memory owned by the service.
+            with task.outputs["grid"] as grid:
+                assert "int16" == grid.dtype
+                assert [3, 4] == grid.shape
+                assert list(range(12)) == grid.ndarray().ravel().tolist()
+                assert grid.shm._unlink_on_dispose
+
+            # Arrays wrapping an existing NDArray are passed along as is.
+            view = task.outputs["view"]
+            assert data.shm.name == view.shm.name
+            assert not view.shm._unlink_on_dispose
+            assert [2, 3, 4, 5] == data.ndarray().tolist()
+            view.shm.close()
+
+
+def test_empty_numpy_arrays():
+    import numpy
+
+    env = appose.system()
+    with env.python() as service:
+        script = "task.outputs['empty'] = numpy.empty((0, 3))\nlist(a.shape)"
+        task = service.task("import numpy\n" + script, {"a": numpy.empty((2, 0))})
+        task.wait_for()
+        assert TaskStatus.COMPLETE == task.status, task.error
+        assert [2, 0] == task.outputs["result"]
+        with task.outputs["empty"] as empty:
+            assert (0, 3) == empty.ndarray().shape
+
+
+def test_unsubmittable_inputs():
+    import numpy
+
+    env = appose.system()
+    with env.python() as service:
+        task = service.task("1", {"a": numpy.array(["text"])})
+        with pytest.raises(TypeError):
+            task.start()
+        # The task is neither in flight, nor stuck in the QUEUED state.
+        assert TaskStatus.INITIAL == task.status
+        assert task.uuid not in service._tasks
+        assert 0 == service.metrics.in_flight
+
+        task.inputs["a"] = numpy.arange(3)
+        task.start().wait_for()
+        assert TaskStatus.COMPLETE == task.status, task.error
+
+
+def test_numpy_inputs():
+    import numpy
+
+    env = appose.system()
+    with env.python() as service:
+        script = "task.outputs['info'] = [type(a).__name__, a.dtype, a.shape]\n"
+        image = numpy.arange(6, dtype="float64").reshape(2, 3)
+        task = service.task(script + "a.ndarray().sum()", {"a": image})
+        task.wait_for()
+        assert TaskStatus.COMPLETE == task.status, task.error
+        assert ["NDArray", "float64", [2, 3]] == task.outputs["info"]
+        assert 15 == task.outputs["result"]
+        # The staging memory is freed once the task is done.
+        assert [] == task._staged
+
+        # Arrays already in shared memory are not copied.
+        with appose.NDArray("int32", [4]) as data:
+            task = service.task(script, {"a": data.ndarray()})
+            task.wait_for()
+            assert TaskStatus.COMPLETE == task.status, task.error
+            assert ["NDArray", "int32", [4]] == task.outputs["info"]
+            assert [] == task._staged
+
+
+def test_worker_attachment_cache():
+    env = appose.system()
+    with env.python() as service:
+        script = (
+            "blocks = task._worker._attachments._blocks\n"
+            "task.outputs['cached'] = sorted(blocks)\n"
+            "id(data.shm)\n"
+        )
+        with appose.NDArray("uint8", [100]) as data:
+            # Tasks receiving the same block share one mapping.
+            ids = []
+            for _ in range(3):
+                task = service.task(script, {"data": data})
+                task.wait_for()
+                assert TaskStatus.COMPLETE == task.status, task.error
+                assert [data.shm.name] == task.outputs["cached"]
+                ids.append(task.outputs["result"])
+            assert 1 == len(set(ids))
+
+        # Once the block is unlinked, the worker forgets it.
+        task = service.task("sorted(task._worker._attachments._blocks)")
+        task.wait_for()
+        assert [] == task.outputs["result"]
+
+
+def test_release_from_any_thread():
+    env = appose.system()
+    with env.python() as service:
+        script = "sorted(task._worker._attachments._blocks)"
+        data = appose.NDArray("uint8", [100])
+        task = service.task(script, {"data": data})
+        task.wait_for()
+        assert [data.shm.name] == task.outputs["result"]
+
+        # Unlinking a block never writes to the worker, which could block
+        # the stdout thread; the release goes along with the next request.
+        with service._stdin_lock:
+            unlinker = Thread(target=data.shm.unlink)
+            unlinker.start()
+            unlinker.join(timeout=5)
+            assert not unlinker.is_alive()
+        data.shm.close()
+        task = service.task(script)
+        task.wait_for()
+        assert [] == task.outputs["result"]
+
+
+def test_attachment_cache_budget():
+    from appose.python_worker import _AttachmentCache
+
+    cache = _AttachmentCache(max_idle_blocks=1, max_idle_bytes=1 << 20)
+    with appose.SharedMemory(create=True, size=64) as a:
+        with appose.SharedMemory(create=True, size=64) as b:
+            refs = []
+            shm_a = cache.acquire(a.name, a.size, refs)
+            assert shm_a is cache.acquire(a.name, a.size, refs)
+            shm_b = cache.acquire(b.name, b.size, refs)
+            shm_b.buf[0] = 1
+            shm_b.close()  # Has no effect while cached.
+            assert 1 == shm_b.buf[0]
+
+            # Only one idle block stays attached; the oldest goes first.
+            cache.release(refs)
+            assert [b.name] == list(cache._blocks)
+            cache.forget([b.name])
+            assert {} == cache._blocks
+            assert shm_b._mmap is None
@@ -0,0 +1,121 @@
+###
+# #%L
+# Appose: multi-language interprocess cooperation with shared memory.
+# %%
+# Copyright (C) 2023 - 2024 Appose developers.
+# %%
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDERS OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+# #L%
+###
+
+import json
+from time import sleep
+
+import appose
+from appose.pool import ServicePool
+from appose.tracing import Tracer, new_context
+
+
+def test_trace():
+    tracer = Tracer()
+    env = appose.system()
+    with env.python() as service:
+        service.trace(tracer)
+        task = service.task("task.trace['traceId']")
+        task.wait_for()
+        spans = _task_spans(tracer, 1)
+        worker_pid = service._process.pid
+
+    # The worker received the task's trace context.
+    trace_id = task.trace["traceId"]
+    assert trace_id == task.outputs["result"]
+
+    by_name = {}
+    for span in spans:
+        assert trace_id == span.trace_id
+        assert span.start <= span.end
+        by_name.setdefault(span.name, []).append(span)
+    root = by_name["task"][0]
+    assert root.parent_id is None
+    assert all(s.parent_id == root.span_id for s in spans if s is not root)
+    for name in ("encode", "write", "queue", "exec", "respond", "transit"):
+        assert name in by_name, name
+    for name in ("queue", "exec", "respond"):
+        assert worker_pid == by_name[name][0].pid
+
+    # NB: Worker spans are timed on the worker's clock, which is the same.
+    exec_span = by_name["exec"][0]
+    assert root.start <= exec_span.start <= exec_span.end <= root.end
+
+
+def test_trace_parent():
+    tracer = Tracer()
+    parent = new_context()
+    env = appose.system()
+    with env.python() as service:
+        service.trace(tracer)
+        task = service.task("1 + 1")
+        task.trace = new_context(parent)
+        task.wait_for()
+        spans = _task_spans(tracer, 1)
+
+    root = next(s for s in spans if s.name == "task")
+    assert parent["traceId"] == root.trace_id
+    assert parent["spanId"] == root.parent_id
+
+
+def test_export(tmp_path):
+    tracer = Tracer()
+    env = appose.system()
+    with ServicePool(env.python, 2) as pool:
+        pool.trace(tracer)
+        tasks = [pool.task("1 + 1") for _ in range(4)]
+        for task in tasks:
+            task.wait_for()
+        _task_spans(tracer, 4)
+        pids = {s._process.pid for s in pool.services}
+
+    path = tmp_path / "trace.json"
+    tracer.export_chrome(path)
+    with open(path) as f:
+        events = json.load(f)["traceEvents"]
+    complete = [e for e in events if e["ph"] == "X"]
+    assert 4 == sum(e["name"] == "task" for e in complete)
+    # Tasks of both workers appear on the same timeline.
+    assert pids <= {e["pid"] for e in complete if e["name"] == "exec"}
+    names = {e["args"]["name"] for e in events if e["name"] == "process_name"}
+    assert "Appose service" in names
+
+    otel = tracer.otel()
+    assert len(otel) == len(complete)
+    assert all(int(s["startTimeUnixNano"]) <= int(s["endTimeUnixNano"]) for s in otel)
+
+
+def _task_spans(tracer: Tracer, count: int):
+    """
+    Wait for the given number of task spans to be recorded.
+    """
+    # NB: A task's span is recorded after its listeners have run,
+    # which may happen after wait_for returns.
+    while sum(s.name == "task" for s in tracer.spans()) < count:
+        sleep(0.01)
+    return tracer.spans()
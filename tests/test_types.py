@@ -27,7 +27,10 @@
 # #L%
 ###
 
+import math
 import unittest
+from multiprocessing import resource_tracker
+from unittest import mock
 
 import appose
 
@@ -73,6 +76,14 @@ class TypesTest(unittest.TestCase):
 
     WORDS = ["quick", "brown", "fox"]
 
+    def setUp(self):
+        # NB: The expected JSON is formatted the way the json codec does it.
+        self.codec = appose.types.get_codec()
+        appose.types.set_codec("json")
+
+    def tearDown(self):
+        appose.types._codec = self.codec
+
     def test_encode(self):
         data = {
             "posByte": 123,
@@ -129,3 +140,75 @@ class TypesTest(unittest.TestCase):
             ndArray = data["ndArray"]
             self.assertEqual("float32", ndArray.dtype)
             self.assertEqual([2, 20, 25], ndArray.shape)
+
+    def test_lazy_attach(self):
+        with appose.SharedMemory(create=True, size=4000) as shm:
+            shm.buf[3] = 42
+            data = appose.types.decode(self.JSON.replace("SHM_NAME", shm.name))
+            ndArray = data["ndArray"]
+            self.assertEqual(shm.name, ndArray.shm.name)
+            self.assertEqual(4000, ndArray.shm.size)
+            self.assertIsNone(ndArray.shm._mmap)
+
+            # The block is attached once its buffer is accessed.
+            self.assertEqual(42, ndArray.shm.buf[3])
+            self.assertIsNotNone(ndArray.shm._mmap)
+            ndArray.shm.close()
+
+    def test_lazy_unlink(self):
+        shm = appose.SharedMemory(create=True, size=4000)
+        shm.unlink_on_dispose(False)
+        registered = []
+        with mock.patch.object(
+            resource_tracker, "register", lambda *args: registered.append(args)
+        ):
+            data = appose.types.decode(self.JSON.replace("SHM_NAME", shm.name))
+            lazy = data["ndArray"].shm
+            # Decoding a block neither attaches to it, nor registers it.
+            self.assertEqual([], registered)
+
+            # Nor does unlinking it.
+            lazy.unlink()
+            self.assertIsNone(lazy._mmap)
+            self.assertEqual([], registered)
+        with self.assertRaises(FileNotFoundError):
+            appose.SharedMemory(name=shm.name)
+        shm.close()
+
+    def test_attachments(self):
+        attachments = []
+        json_str = appose.types.encode({"data": b"\x00\xff", "n": 1}, attachments)
+        self.assertEqual('{"data":{"appose_type":"bytes","index":0},"n":1}', json_str)
+        self.assertEqual([b"\x00\xff"], attachments)
+        data = appose.types.decode(json_str, attachments)
+        self.assertEqual({"data": b"\x00\xff", "n": 1}, data)
+
+    def test_codecs(self):
+        data = {"big": 2**70, "text": "\u00e9", "n": [1.5]}
+        for name in ("json", "orjson"):
+            try:
+                appose.types.set_codec(name)
+            except ValueError:
+                continue
+            with appose.SharedMemory(create=True, size=4000) as shm:
+                json_str = self.JSON.replace("SHM_NAME", shm.name)
+                decoded = appose.types.decode(json_str)
+                self.assertEqual(shm.name, decoded["ndArray"].shm.name)
+                decoded["ndArray"].shm.close()
+            # Data the codec cannot handle falls back to the json codec.
+            self.assertEqual(data, appose.types.decode(appose.types.encode(data)))
+
+        with self.assertRaises(ValueError):
+            appose.types.set_codec("nonexistent")
+
+    def test_nonfinite_floats(self):
+        data = {"nan": float("nan"), "inf": [float("inf"), -float("inf")], "n": None}
+        for name in ("json", "orjson"):
+            try:
+                appose.types.set_codec(name)
+            except ValueError:
+                continue
+            decoded = appose.types.decode(appose.types.encode(data))
+            self.assertTrue(math.isnan(decoded["nan"]), name)
+            self.assertEqual([math.inf, -math.inf], decoded["inf"], name)
+            self.assertIsNone(decoded["n"], name)